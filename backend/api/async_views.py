@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial, wraps
+from threading import Lock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .metrics import current_recorder
+from .middleware import recording
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_DB_THREADS,
+                thread_name_prefix='api-db',
+            )
+    return _executor
+
+
+def run_view(view, request, *args, **kwargs):
+    """Выполняет синхронное представление в потоке пула.
+
+    У каждого потока своё подключение к базе; как и при обычном запросе,
+    устаревшие подключения закрываются до и после представления. Ответ
+    рендерится здесь же, потоковый ответ читается целиком: ASGI-обработчик
+    Django 3.2 перебирает его в цикле событий, где обращаться к базе
+    нельзя.
+    """
+    close_old_connections()
+    recorder = current_recorder.get()
+    try:
+        with recording(recorder) if recorder is not None else nullcontext():
+            response = view(request, *args, **kwargs)
+            if callable(getattr(response, 'render', None)):
+                start = time.perf_counter()
+                response.render()
+                request.metrics_render = time.perf_counter() - start
+            if response.streaming:
+                response.streaming_content = list(response.streaming_content)
+        return response
+    finally:
+        close_old_connections()
+
+
+class AsyncViewSetMixin:
+    """Асинхронные представления для ASGI.
+
+    При API_ASYNC_VIEWS as_view возвращает корутину. Действия из
+    async_actions (чтение списка и одного объекта) выполняются в пуле из
+    ASYNC_DB_THREADS потоков, а цикл событий тем временем обслуживает
+    другие соединения. Медленные клиенты и ожидание базы не занимают
+    воркер целиком, а число одновременных подключений к базе ограничено
+    размером пула. Остальные действия (запись, дополнительные действия)
+    выполняются, как обычные синхронные представления под ASGI, в общем
+    потоке Django. В Django 3.2 нет асинхронных методов ORM, поэтому
+    запросы к базе остаются синхронными.
+    """
+
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not settings.API_ASYNC_VIEWS:
+            return view
+        pooled = {
+            method for method, action in (actions or {}).items()
+            if action in cls.async_actions
+        }
+        if 'get' in pooled:
+            pooled.add('head')
+        run_pooled = sync_to_async(
+            partial(run_view, view),
+            thread_sensitive=False,
+            executor=get_executor(),
+        )
+        run_shared = sync_to_async(
+            partial(run_view, view), thread_sensitive=True)
+
+        @wraps(view)
+        async def async_view(request, *args, **kwargs):
+            if request.method.lower() in pooled:
+                return await run_pooled(request, *args, **kwargs)
+            return await run_shared(request, *args, **kwargs)
+
+        return async_view
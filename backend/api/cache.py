@@ -0,0 +1,161 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from foodgram.db_router import using_replica
+
+VERSION_KEY = 'api:version:{namespace}'
+RESPONSE_KEY = 'api:response:{namespace}:{digest}'
+STATS_KEY = 'api:stats:{namespace}:{result}'
+
+
+def get_version(namespace):
+    """Текущая версия пространства имён кэша.
+
+    Версия — время последнего изменения данных, она же используется как
+    Last-Modified.
+    """
+    key = VERSION_KEY.format(namespace=namespace)
+    version = cache.get(key)
+    if version is None:
+        version = time.time()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(namespace):
+    """Делает устаревшими все закэшированные ответы пространства имён."""
+    cache.set(VERSION_KEY.format(namespace=namespace), time.time(), None)
+
+
+def user_namespace(user_id):
+    """Пространство имён флагов пользователя: избранное, покупки,
+    подписки."""
+    return f'user:{user_id}'
+
+
+def response_key(namespace, *parts):
+    digest = hashlib.md5(
+        ':'.join(str(part) for part in parts).encode()
+    ).hexdigest()
+    return RESPONSE_KEY.format(namespace=namespace, digest=digest)
+
+
+def count_request(namespace, hit):
+    key = STATS_KEY.format(
+        namespace=namespace, result='hits' if hit else 'misses')
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def get_stats(namespaces):
+    """Счётчики попаданий и промахов кэша по пространствам имён."""
+    keys = {
+        (namespace, result): STATS_KEY.format(
+            namespace=namespace, result=result)
+        for namespace in namespaces
+        for result in ('hits', 'misses')
+    }
+    values = cache.get_many(keys.values())
+    stats = {namespace: {} for namespace in namespaces}
+    for (namespace, result), key in keys.items():
+        stats[namespace][result] = values.get(key, 0)
+    return stats
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag in (tag.strip() for tag in if_none_match.split(','))
+    if_modified_since = parse_http_date_safe(
+        request.headers.get('If-Modified-Since', ''))
+    return (if_modified_since is not None
+            and int(last_modified) <= if_modified_since)
+
+
+class CachedReadOnlyMixin:
+    """Кэширует готовый JSON ответов list и retrieve.
+
+    Ключ ответа строится из версий пространств имён get_cache_versions,
+    полного адреса запроса и согласованного типа ответа. Кэшируется
+    только JSON: остальные рендереры (Browsable API и т. п.) отвечают
+    как обычно. Ответ зависит от Accept, поэтому в нём всегда есть
+    Vary: Accept. Версии сбрасывают сигналы при изменении
+    моделей, поэтому срок жизни записей может быть большим. Если клиент
+    прислал актуальный ETag или If-Modified-Since, возвращается 304 без
+    обращения к базе и сериализатору.
+    """
+
+    cache_namespace = None
+
+    def get_cache_versions(self, request):
+        return [get_version(self.cache_namespace)]
+
+    def get_cache_key_parts(self, request):
+        return [request.build_absolute_uri()]
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def get_cache_timeout(self, versions):
+        # Сразу после изменения реплика может ещё отдавать старые данные:
+        # такой ответ хранится не дольше окна закрепления.
+        if (using_replica()
+                and time.time() - max(versions)
+                < settings.REPLICA_PIN_SECONDS):
+            return settings.REPLICA_PIN_SECONDS
+        return settings.API_CACHE_TIMEOUT
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if renderer.format != 'json':
+            response = handler(request, *args, **kwargs)
+            patch_vary_headers(response, ['Accept'])
+            return response
+        versions = self.get_cache_versions(request)
+        key = response_key(
+            self.cache_namespace,
+            *versions,
+            request.accepted_media_type,
+            *self.get_cache_key_parts(request)
+        )
+        entry = cache.get(key)
+        hit = entry is not None
+        count_request(self.cache_namespace, hit)
+        if not hit:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            body = renderer.render(
+                response.data, request.accepted_media_type,
+                self.get_renderer_context())
+            entry = {
+                'body': body,
+                'etag': quote_etag(hashlib.md5(body).hexdigest()),
+            }
+            cache.set(key, entry, self.get_cache_timeout(versions))
+        last_modified = max(versions)
+        if not_modified(request, entry['etag'], last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                entry['body'], content_type=renderer.media_type)
+        patch_vary_headers(response, ['Accept'])
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(last_modified)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
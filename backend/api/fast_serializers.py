@@ -0,0 +1,137 @@
+from django.conf import settings
+from django.db.models import QuerySet
+
+from api.serializers import thumbnail_urls
+
+TAG_FIELDS = ('id', 'name', 'color', 'slug')
+INGREDIENT_FIELDS = ('id', 'name', 'measurement_unit')
+FAST_ACTIONS = ('list', 'retrieve')
+
+
+class FastSerializerMixin:
+    """Отдаёт fast_serializer_class для list и retrieve в JSON.
+
+    Включается настройкой API_FAST_SERIALIZERS. Для Browsable API и
+    остальных действий используется обычный сериализатор.
+    """
+
+    fast_serializer_class = None
+
+    def get_serializer_class(self):
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        if (settings.API_FAST_SERIALIZERS
+                and self.action in FAST_ACTIONS
+                and getattr(renderer, 'format', None) == 'json'):
+            return self.fast_serializer_class
+        return super().get_serializer_class()
+
+
+class FastSerializer:
+    """Сериализатор только для чтения без полей DRF.
+
+    Повторяет вывод обычного сериализатора тех же данных (порядок
+    ключей, типы значений), но строит словари напрямую из атрибутов
+    объектов. Интерфейс — только то, что нужно list и retrieve:
+    конструктор как у Serializer и свойство data.
+    """
+
+    values_fields = None
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @property
+    def data(self):
+        if not self.many:
+            return self.to_representation(self.instance)
+        if self.values_fields and isinstance(self.instance, QuerySet):
+            return list(self.instance.values(*self.values_fields))
+        return [self.to_representation(item) for item in self.instance]
+
+    def to_representation(self, instance):
+        return {
+            field: getattr(instance, field) for field in self.values_fields
+        }
+
+
+class FastTagSerializer(FastSerializer):
+    """Аналог TagSerializer."""
+
+    values_fields = TAG_FIELDS
+
+
+class FastIngredientSerializer(FastSerializer):
+    """Аналог IngredientSerializer."""
+
+    values_fields = INGREDIENT_FIELDS
+
+
+def file_url(file, request):
+    """Как serializers.FileField.to_representation с use_url=True."""
+    if not file:
+        return None
+    try:
+        url = file.url
+    except AttributeError:
+        return None
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+class FastRecipeSerializer(FastSerializer):
+    """Аналог RecipeSerializer для списка и страницы рецепта.
+
+    Рассчитан на queryset с with_related() и with_user_flags():
+    автор, теги и ингредиенты уже загружены, флаги — аннотации.
+    """
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        super().__init__(instance, many, context, **kwargs)
+        self.request = self.context.get('request')
+        user = getattr(self.request, 'user', None)
+        self.authenticated = user is not None and user.is_authenticated
+        self.subscriptions = self.context.get('subscriptions')
+
+    def is_subscribed(self, author):
+        if not self.authenticated:
+            return False
+        if self.subscriptions is not None:
+            return author.id in self.subscriptions
+        return author.following.filter(user=self.request.user).exists()
+
+    def to_representation(self, recipe):
+        author = recipe.author
+        return {
+            'id': recipe.id,
+            'tags': [
+                {field: getattr(tag, field) for field in TAG_FIELDS}
+                for tag in recipe.tags.all()
+            ],
+            'name': str(recipe.name),
+            'author': {
+                'id': author.id,
+                'email': str(author.email),
+                'username': str(author.username),
+                'first_name': str(author.first_name),
+                'last_name': str(author.last_name),
+                'is_subscribed': self.is_subscribed(author),
+            },
+            'ingredients': [
+                {
+                    'id': item.ingredient.id,
+                    'name': str(item.ingredient.name),
+                    'measurement_unit': str(item.ingredient.measurement_unit),
+                    'amount': int(item.amount),
+                }
+                for item in recipe.ingredient_list.all()
+            ],
+            'image': file_url(recipe.image, self.request),
+            'thumbnails': thumbnail_urls(recipe.thumbnails, self.request),
+            'text': str(recipe.text),
+            'is_favorited': recipe.favorited,
+            'is_in_shopping_cart': recipe.in_shopping_cart,
+            'cooking_time': int(recipe.cooking_time),
+        }
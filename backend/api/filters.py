@@ -1,9 +1,15 @@
 from django_filters import rest_framework as filters
-from rest_framework.filters import SearchFilter
 
 from users.models import User
+from recipes.fulltext import search_recipes
 from recipes.models import Recipe, Tag
 
+# Порядок ?ordering=popular, совпадает с индексом recipe_popular_idx.
+POPULAR_ORDERING = ('-favorites_count', '-pub', '-id')
+# Пространство имён кэша страниц с этим порядком: его сбрасывает
+# изменение избранного.
+POPULAR_NAMESPACE = 'recipes:popular'
+
 
 class RecipeFilter(filters.FilterSet):
     author = filters.ModelChoiceFilter(
@@ -20,6 +26,13 @@ class RecipeFilter(filters.FilterSet):
         queryset=Tag.objects.all(),
         to_field_name='slug',
     )
+    search = filters.CharFilter(
+        method='filter_search',
+    )
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
@@ -28,6 +41,8 @@ class RecipeFilter(filters.FilterSet):
             'author',
             'is_favorited',
             'is_in_shopping_cart',
+            'search',
+            'ordering',
         ]
 
     def filter_is_favorited(self, queryset, name, value):
@@ -43,6 +58,8 @@ class RecipeFilter(filters.FilterSet):
             )
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
 
-class IngredientNameFilter(SearchFilter):
-    search_param = 'name'
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*POPULAR_ORDERING)
@@ -0,0 +1,276 @@
+import random
+import statistics
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.contrib.auth.models import AnonymousUser
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.fast_serializers import (FastIngredientSerializer,
+                                  FastRecipeSerializer, FastTagSerializer)
+from api.management.commands.benchmark_suite import DUMMY_CACHES
+from api.matching import recipe_ingredient_index
+from api.renderers import ORJSONRenderer
+from api.search import ingredient_index
+from api.serializers import (IngredientSerializer, RecipeSerializer,
+                             TagSerializer)
+from recipes.fulltext import search_recipes
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+DEFAULT_PAGE_SIZES = [6, 12, 25, 50, 100]
+DEFAULT_PREFIXES = ['а', 'ка', 'мол', 'соль', 'х', 'шоколад']
+DEFAULT_QUERIES = ['суп', 'курица с картофелем', 'салат', 'пирог яблочный',
+                   'запиканка']
+DEFAULT_PANTRY_SIZES = [3, 10, 30, 100]
+# Таблицы, которые в планах запросов должны читаться по индексу.
+INDEXED_TABLES = [
+    'recipes_favorite',
+    'recipes_shoppingcart',
+    'recipes_recipe_tags',
+]
+
+
+class Command(BaseCommand):
+    help = 'Замеряет число SQL-запросов и время ответа API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenario', nargs='?', default='recipes',
+            choices=['recipes', 'ingredients', 'explain', 'search', 'cook',
+                     'serializers'],
+            help='Что замерять: список рецептов, поиск ингредиентов, '
+                 'планы запросов списка рецептов, поиск рецептов, '
+                 'подбор рецептов по ингредиентам или сериализацию '
+                 '(совпадение вывода проверяет api.tests).'
+        )
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=DEFAULT_PAGE_SIZES,
+            help='Размеры страницы (limit) для замера.'
+        )
+        parser.add_argument(
+            '--prefixes', nargs='+', default=DEFAULT_PREFIXES,
+            help='Префиксы для поиска ингредиентов.'
+        )
+        parser.add_argument(
+            '--queries', nargs='+', default=DEFAULT_QUERIES,
+            help='Запросы для полнотекстового поиска рецептов.'
+        )
+        parser.add_argument(
+            '--pantry', nargs='+', type=int, default=DEFAULT_PANTRY_SIZES,
+            help='Сколько ингредиентов есть у пользователя при подборе.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=10,
+            help='Количество повторов каждого запроса.'
+        )
+        parser.add_argument(
+            '--user', help='Email пользователя для авторизованных запросов.'
+        )
+
+    def get_client(self, email):
+        client = APIClient(SERVER_NAME='localhost')
+        if email:
+            user = User.objects.filter(email=email).first()
+            if user is None:
+                raise CommandError(f'Пользователь {email} не найден.')
+            client.force_authenticate(user)
+        return client
+
+    def measure(self, client, url, repeat):
+        timings = []
+        queries = 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise CommandError(
+                    f'{url} вернул статус {response.status_code}.')
+            queries = len(context.captured_queries)
+        return queries, statistics.median(timings), max(timings)
+
+    def timeit(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            timings.append((time.perf_counter() - start) * 1_000_000)
+        return result, statistics.median(timings)
+
+    def handle(self, *args, **options):
+        getattr(self, f'bench_{options["scenario"]}')(options)
+
+    def bench_ingredients(self, options):
+        repeat = options['repeat']
+        ingredient_index.build()
+        self.stdout.write(
+            f'{"prefix":<12}{"found":>7}{"index, µs":>12}{"db, µs":>12}')
+        for prefix in options['prefixes']:
+            found, cached = self.timeit(
+                lambda: ingredient_index.search(prefix), repeat)
+            _, database = self.timeit(
+                lambda: list(Ingredient.objects.filter(
+                    name__istartswith=prefix
+                ).values('id', 'name', 'measurement_unit')),
+                repeat
+            )
+            self.stdout.write(
+                f'{prefix:<12}{len(found):>7}{cached:>12.1f}{database:>12.1f}')
+
+    def bench_search(self, options):
+        total = Recipe.objects.count()
+        client = self.get_client(options['user'])
+        self.stdout.write(f'Рецептов в базе: {total}')
+        self.stdout.write(
+            f'{"query":<24}{"found":>7}{"median, ms":>12}'
+            f'{"api, ms":>10}{"queries":>9}')
+        with override_settings(CACHES=DUMMY_CACHES):
+            for query in options['queries']:
+                params = urlencode({'search': query, 'limit': 10})
+                found, median = self.timeit(
+                    lambda: list(search_recipes(
+                        Recipe.objects.all(), query
+                    ).values_list('id', flat=True)[:10]),
+                    options['repeat']
+                )
+                queries, api, _ = self.measure(
+                    client, f'/api/recipes/?{params}',
+                    options['repeat'])
+                self.stdout.write(
+                    f'{query:<24}{len(found):>7}{median / 1000:>12.2f}'
+                    f'{api:>10.2f}{queries:>9}')
+
+    def bench_cook(self, options):
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError('В базе нет ингредиентов.')
+        recipe_ingredient_index.build()
+        modes = [False, True] if recipe_ingredient_index.use_numpy else [False]
+        use_numpy = settings.RECIPE_MATCH_USE_NUMPY
+        self.stdout.write(
+            f'{"pantry":<8}{"found":>7}{"python, µs":>13}{"numpy, µs":>12}')
+        try:
+            for size in options['pantry']:
+                pantry = random.sample(
+                    ingredient_ids, min(size, len(ingredient_ids)))
+                timings = {}
+                for mode in modes:
+                    settings.RECIPE_MATCH_USE_NUMPY = mode
+                    # Первый вызов собирает массивы NumPy, его не считаем.
+                    found = recipe_ingredient_index.search(pantry)
+                    _, timings[mode] = self.timeit(
+                        lambda: recipe_ingredient_index.search(pantry),
+                        options['repeat']
+                    )
+                numpy_timing = (
+                    f'{timings[True]:>12.1f}' if True in timings
+                    else f'{"—":>12}')
+                self.stdout.write(
+                    f'{size:<8}{len(found):>7}{timings[False]:>13.1f}'
+                    f'{numpy_timing}')
+        finally:
+            settings.RECIPE_MATCH_USE_NUMPY = use_numpy
+
+    def serializer_cases(self, user, size):
+        """(название, данные, обычный сериализатор, быстрый)."""
+        recipes = list(Recipe.objects.with_related().with_user_flags(
+            user).order_by('-pub', '-id')[:size])
+        return [
+            ('recipes', recipes, RecipeSerializer, FastRecipeSerializer),
+            ('tags', Tag.objects.all(), TagSerializer, FastTagSerializer),
+            ('ingredients', Ingredient.objects.all()[:size],
+             IngredientSerializer, FastIngredientSerializer),
+        ]
+
+    def bench_serializers(self, options):
+        user = AnonymousUser()
+        if options['user']:
+            user = User.objects.get(email=options['user'])
+        request = Request(
+            APIRequestFactory().get('/api/recipes/', SERVER_NAME='localhost'))
+        request.user = user
+        context = {'request': request}
+        if user.is_authenticated:
+            context['subscriptions'] = set(
+                user.is_subscribed.values_list('author_id', flat=True))
+        self.stdout.write(
+            f'{"case":<12}{"rows":>6}{"drf, rows/s":>14}'
+            f'{"fast, rows/s":>14}{"speedup":>9}')
+        for size in options['sizes']:
+            for name, data, slow, fast in self.serializer_cases(user, size):
+                rows = len(data)
+                if not rows:
+                    continue
+                _, drf = self.timeit(
+                    lambda: JSONRenderer().render(
+                        slow(data, many=True, context=context).data),
+                    options['repeat']
+                )
+                _, quick = self.timeit(
+                    lambda: ORJSONRenderer().render(
+                        fast(data, many=True, context=context).data),
+                    options['repeat']
+                )
+                self.stdout.write(
+                    f'{name:<12}{rows:>6}{rows / drf * 1_000_000:>14.0f}'
+                    f'{rows / quick * 1_000_000:>14.0f}{drf / quick:>9.1f}')
+
+    def explain_querysets(self, user):
+        recipes = Recipe.objects.with_user_flags(user)
+        tag = Tag.objects.first()
+        querysets = {
+            'list': recipes[:6],
+            'is_favorited': recipes.filter(is_favorited__user=user)[:6],
+            'is_in_shopping_cart': recipes.filter(
+                is_in_shopping_cart__user=user)[:6],
+        }
+        if tag is not None:
+            querysets['tags'] = recipes.filter(
+                tags__slug__in=[tag.slug]).distinct()[:6]
+        return querysets
+
+    def bench_explain(self, options):
+        if not options['user']:
+            raise CommandError('Для планов запросов нужен --user.')
+        user = User.objects.get(email=options['user'])
+        vendor = connection.vendor
+        full_scans = []
+        for name, queryset in self.explain_querysets(user).items():
+            plan = queryset.explain()
+            self.stdout.write(f'--- {name}\n{plan}\n')
+            for table in INDEXED_TABLES:
+                if vendor == 'postgresql':
+                    scanned = f'Seq Scan on {table}' in plan
+                else:
+                    scanned = any(
+                        line.strip().endswith(f'SCAN {table}')
+                        for line in plan.splitlines()
+                    )
+                if scanned:
+                    full_scans.append(f'{name}: {table}')
+        if full_scans:
+            raise CommandError(
+                'Полный просмотр таблиц: ' + ', '.join(full_scans))
+        self.stdout.write(self.style.SUCCESS('Все проверки идут по индексам.'))
+
+    def bench_recipes(self, options):
+        client = self.get_client(options['user'])
+        self.stdout.write(
+            f'{"url":<32}{"queries":>8}{"median, ms":>12}{"max, ms":>10}')
+        # Без кэша ответов: иначе все повторы, кроме первого, — попадания
+        # в кэш без запросов к базе.
+        with override_settings(CACHES=DUMMY_CACHES):
+            for size in options['sizes']:
+                url = f'/api/recipes/?limit={size}'
+                queries, median, worst = self.measure(
+                    client, url, options['repeat'])
+                self.stdout.write(
+                    f'{url:<32}{queries:>8}{median:>12.2f}{worst:>10.2f}')
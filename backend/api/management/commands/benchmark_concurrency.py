@@ -0,0 +1,193 @@
+import asyncio
+import statistics
+import time
+from collections import Counter
+from urllib.parse import quote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_PATHS = [
+    '/api/recipes/?limit=6',
+    '/api/recipes/?page=2&limit=6',
+    '/api/ingredients/?name=к',
+    '/api/tags/',
+]
+NETWORK_ERRORS = (
+    OSError, ValueError, asyncio.IncompleteReadError,
+    asyncio.LimitOverrunError, asyncio.TimeoutError,
+)
+
+
+class Result:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = 0
+        self.elapsed = 0
+
+
+async def read_response(reader):
+    """Статус ответа и можно ли переиспользовать соединение."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection') != 'close'
+
+
+async def client(host, port, requests, deadline, timeout, result):
+    """Одно соединение: запросы подряд до deadline."""
+    reader = writer = None
+    number = 0
+    while time.monotonic() < deadline:
+        request = requests[number % len(requests)]
+        number += 1
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, port), timeout)
+            writer.write(request)
+            status, keep_alive = await asyncio.wait_for(
+                read_response(reader), timeout)
+        except NETWORK_ERRORS:
+            result.errors += 1
+            keep_alive = False
+            await asyncio.sleep(0.01)
+        else:
+            result.latencies.append(time.perf_counter() - start)
+            result.statuses[status] += 1
+        if not keep_alive and writer is not None:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def load(url, paths, headers, connections, duration, timeout):
+    parts = urlsplit(url)
+    if parts.scheme != 'http' or not parts.hostname:
+        raise CommandError(f'Нужен адрес вида http://host:port: {url}')
+    host_header = parts.netloc
+    base = parts.path.rstrip('/')
+    requests = [
+        (f'GET {quote(base + path, safe="/?&=%")} HTTP/1.1\r\n'
+         f'Host: {host_header}\r\n'
+         + ''.join(f'{header}\r\n' for header in headers)
+         + '\r\n').encode()
+        for path in paths
+    ]
+    result = Result()
+    start = time.monotonic()
+    deadline = start + duration
+    await asyncio.gather(*(
+        client(parts.hostname, parts.port or 80, requests, deadline,
+               timeout, result)
+        for _ in range(connections)
+    ))
+    result.elapsed = time.monotonic() - start
+    return result
+
+
+def raise_open_files_limit(connections):
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = connections + 100
+    if soft < needed:
+        if hard != resource.RLIM_INFINITY:
+            needed = min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест с множеством одновременных соединений. '
+            'Сравнивает пропускную способность развёртываний, например '
+            'sync=http://127.0.0.1:8000 (gunicorn foodgram.wsgi) и '
+            'async=http://127.0.0.1:8001 (gunicorn foodgram.asgi '
+            '-k uvicorn.workers.UvicornWorker). Клиент однопоточный: '
+            'запускайте его не на той же машине, что и сервер, иначе '
+            'он сам станет узким местом.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'targets', nargs='+',
+            help='Развёртывания в виде имя=http://host:port.')
+        parser.add_argument(
+            '--connections', type=int, default=500,
+            help='Одновременных соединений.')
+        parser.add_argument(
+            '--duration', type=float, default=30,
+            help='Длительность теста каждого развёртывания, секунды.')
+        parser.add_argument(
+            '--timeout', type=float, default=10,
+            help='Тайм-аут ответа, секунды.')
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Адрес запроса, можно указать несколько раз. '
+                 'По умолчанию списки рецептов, ингредиентов и тегов.')
+        parser.add_argument(
+            '--token', help='Токен для заголовка Authorization.')
+
+    def handle(self, *args, **options):
+        raise_open_files_limit(options['connections'])
+        headers = []
+        if options['token']:
+            headers.append(f'Authorization: Token {options["token"]}')
+        results = {}
+        for target in options['targets']:
+            name, _, url = target.partition('=')
+            if not url or '://' in name:
+                name = url = target
+            self.stdout.write(
+                f'{name}: {options["connections"]} соединений, '
+                f'{options["duration"]:g} с...')
+            results[name] = asyncio.run(load(
+                url, options['paths'] or DEFAULT_PATHS, headers,
+                options['connections'], options['duration'],
+                options['timeout']))
+        self.print_results(results)
+
+    def print_results(self, results):
+        self.stdout.write(
+            f'{"target":<12}{"requests":>10}{"rps":>10}{"p50, ms":>10}'
+            f'{"p95, ms":>10}{"p99, ms":>10}{"errors":>8}  statuses')
+        base_rps = None
+        for name, result in results.items():
+            rps = len(result.latencies) / result.elapsed
+            if len(result.latencies) >= 2:
+                quantiles = statistics.quantiles(
+                    result.latencies, n=100, method='inclusive')
+                p50, p95, p99 = (
+                    quantiles[value - 1] * 1000 for value in (50, 95, 99))
+            else:
+                p50 = p95 = p99 = 0
+            statuses = ', '.join(
+                f'{status}: {count}'
+                for status, count in sorted(result.statuses.items()))
+            self.stdout.write(
+                f'{name:<12}{len(result.latencies):>10}{rps:>10.1f}'
+                f'{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{result.errors:>8}'
+                f'  {statuses}')
+            if base_rps is None:
+                base_rps = rps
+            elif base_rps:
+                self.stdout.write(
+                    f'{name}: пропускная способность {rps / base_rps:.2f}x '
+                    'относительно первого развёртывания.')
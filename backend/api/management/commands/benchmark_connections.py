@@ -0,0 +1,106 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from api.metrics import registry
+from foodgram.postgresql.base import DatabaseWrapper
+from foodgram.postgresql.pool import close_pools
+
+MODES = ('new', 'persistent', 'pool')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает накладные расходы на подключение к PostgreSQL: '
+            'новое подключение на каждый запрос (CONN_MAX_AGE=0), '
+            'постоянные подключения и пул. Каждый запрос — как в Django: '
+            'сигналы request_started и request_finished вокруг SQL.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=1000,
+            help='Запросов в каждом режиме.')
+        parser.add_argument(
+            '--threads', type=int, default=1,
+            help='Потоков, одновременно выполняющих запросы.')
+        parser.add_argument(
+            '--mode', action='append', dest='modes', choices=MODES,
+            help='Режим, можно указать несколько раз. По умолчанию все.')
+        parser.add_argument(
+            '--pool-size', type=int, default=10,
+            help='MAX_SIZE пула в режиме pool.')
+        parser.add_argument(
+            '--query', default='SELECT 1', help='SQL одного запроса.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if not isinstance(connections[alias], DatabaseWrapper):
+            raise CommandError(
+                f'База {alias} должна использовать ENGINE '
+                'foodgram.postgresql.')
+        settings_dict = connections[alias].settings_dict
+        original = {
+            key: settings_dict.get(key) for key in ('CONN_MAX_AGE', 'POOL')
+        }
+        modes = {
+            'new': {'CONN_MAX_AGE': 0, 'POOL': None},
+            'persistent': {'CONN_MAX_AGE': None, 'POOL': None},
+            'pool': {
+                'CONN_MAX_AGE': 0,
+                'POOL': {'MAX_SIZE': options['pool_size'], 'TIMEOUT': 30},
+            },
+        }
+        self.stdout.write(
+            f'{"mode":<12}{"rps":>10}{"p50, ms":>10}{"p95, ms":>10}'
+            f'{"connects":>10}{"connect, ms":>13}{"wait, ms":>10}')
+        try:
+            for mode in options['modes'] or MODES:
+                settings_dict.update(modes[mode])
+                self.run_mode(mode, alias, options)
+        finally:
+            connections[alias].close()
+            close_pools()
+            settings_dict.update(original)
+
+    def run_mode(self, mode, alias, options):
+        connections[alias].close()
+        close_pools()
+        registry.reset()
+        latencies = []
+        per_thread = options['requests'] // options['threads']
+
+        def worker():
+            for _ in range(per_thread):
+                start = time.perf_counter()
+                request_started.send(sender=self.__class__)
+                with connections[alias].cursor() as cursor:
+                    cursor.execute(options['query'])
+                    cursor.fetchall()
+                request_finished.send(sender=self.__class__)
+                latencies.append(time.perf_counter() - start)
+            connections[alias].close()
+
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(target=worker)
+            for _ in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        quantiles = statistics.quantiles(
+            latencies, n=100, method='inclusive')
+        connects, connect_time = registry.summary('api_db_connect_seconds')
+        waits, wait_time = registry.summary('api_db_pool_wait_seconds')
+        self.stdout.write(
+            f'{mode:<12}{len(latencies) / elapsed:>10.1f}'
+            f'{quantiles[49] * 1000:>10.2f}{quantiles[94] * 1000:>10.2f}'
+            f'{connects:>10}'
+            f'{connect_time / max(connects, 1) * 1000:>13.2f}'
+            f'{wait_time / max(waits, 1) * 1000:>10.2f}')
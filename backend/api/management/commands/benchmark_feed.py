@@ -0,0 +1,190 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.test import APIClient
+
+from api.pagination import KeysetPagination
+from recipes import feed
+from recipes.models import FeedItem, Recipe
+from users.models import Follow, User
+
+READER_PREFIX = 'feed_benchmark_'
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def percentiles(values):
+    if len(values) < 2:
+        value = values[0] * 1000 if values else 0
+        return value, value
+    quantiles = statistics.quantiles(values, n=100, method='inclusive')
+    return quantiles[49] * 1000, quantiles[94] * 1000
+
+
+def on_read_page(user_id, position, page_size):
+    """Страница ленты без готовой таблицы: соединение подписок с
+    рецептами и сортировка по дате публикации."""
+    recipes = Recipe.objects.filter(
+        author__in=Follow.objects.filter(user_id=user_id).values('author')
+    )
+    return keyset_page(recipes, ('-pub', '-id'), position, page_size)
+
+
+def keyset_page(queryset, ordering, position, page_size):
+    queryset = queryset.order_by(*ordering)
+    if position is not None:
+        queryset = queryset.filter(
+            KeysetPagination(ordering, page_size).position_filter(position))
+    return list(queryset.values_list(
+        *(field.lstrip('-') for field in ordering))[:page_size])
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает ленту подписок, собираемую при чтении '
+            '(подписки JOIN рецепты), с готовыми лентами FeedItem для '
+            'читателей, подписанных на тысячи авторов, и измеряет цену '
+            'записи: раскладку рецепта по лентам, подписку и отписку. '
+            'Читатели и подписки создаются в транзакции, которая в конце '
+            'откатывается. Нужны авторы с рецептами, например после '
+            'manage.py generate_data --users 3000 --recipes 30000.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--readers', type=int, default=20,
+            help='Сколько читателей создать.')
+        parser.add_argument(
+            '--follows', type=int, default=2000,
+            help='На сколько авторов подписан каждый читатель.')
+        parser.add_argument(
+            '--pages', type=int, default=5,
+            help='Сколько страниц ленты пролистать.')
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        authors = list(User.objects.filter(
+            recipes_count__gt=0).values_list('id', flat=True))
+        if len(authors) < options['follows']:
+            raise CommandError(
+                f'Авторов с рецептами {len(authors)}, нужно не меньше '
+                f'{options["follows"]}: создайте данные generate_data.')
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            try:
+                self.run(rng, authors, options)
+            finally:
+                transaction.set_rollback(True)
+
+    def run(self, rng, authors, options):
+        User.objects.bulk_create([
+            User(username=f'{READER_PREFIX}{number}',
+                 email=f'{READER_PREFIX}{number}@example.com')
+            for number in range(options['readers'])
+        ])
+        reader_ids = [
+            reader.id for reader in User.objects.filter(
+                username__startswith=READER_PREFIX)
+        ]
+        Follow.objects.bulk_create([
+            Follow(user_id=reader_id, author_id=author_id)
+            for reader_id in reader_ids
+            for author_id in rng.sample(authors, options['follows'])
+        ], batch_size=5000)
+        _, elapsed = timed(feed.rebuild, reader_ids)
+        if connection.vendor == 'postgresql':
+            # Без статистики планировщик не знает о новых строках.
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE recipes_feeditem')
+                cursor.execute('ANALYZE users_follow')
+        rows = FeedItem.objects.filter(user_id__in=reader_ids).count()
+        on_read = User.objects.filter(feed_on_read=True).count()
+        self.stdout.write(
+            f'Читателей: {len(reader_ids)}, подписок у каждого: '
+            f'{options["follows"]}, строк лент: {rows} '
+            f'(в среднем {rows // len(reader_ids)} на читателя), '
+            f'заполнены за {elapsed:.2f} с. Авторов, которые читаются '
+            f'при запросе: {on_read}.')
+        self.compare_reads(reader_ids, options)
+        self.measure_endpoint(reader_ids[0], options)
+        self.measure_writes(rng, reader_ids, authors)
+
+    def compare_reads(self, reader_ids, options):
+        strategies = {'on-read': on_read_page, 'feed': feed.page}
+        latencies = {
+            (name, page): []
+            for name in strategies for page in range(options['pages'])
+        }
+        for name, page_func in strategies.items():
+            # Прогрев кэшей базы.
+            page_func(reader_ids[0], None, options['page_size'])
+            for reader_id in reader_ids:
+                position = None
+                for page in range(options['pages']):
+                    rows, elapsed = timed(
+                        page_func, reader_id, position,
+                        options['page_size'])
+                    latencies[(name, page)].append(elapsed)
+                    if not rows:
+                        break
+                    position = rows[-1]
+        self.stdout.write(
+            f'{"strategy":<10}{"page":>6}{"p50, ms":>10}{"p95, ms":>10}')
+        for page in (0, options['pages'] - 1):
+            for name in strategies:
+                p50, p95 = percentiles(latencies[(name, page)])
+                self.stdout.write(
+                    f'{name:<10}{page + 1:>6}{p50:>10.2f}{p95:>10.2f}')
+
+    def measure_endpoint(self, reader_id, options):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=reader_id))
+        url = f'/api/recipes/feed/?limit={options["page_size"]}'
+        client.get(url)
+        durations = []
+        for _ in range(20):
+            response, elapsed = timed(client.get, url)
+            durations.append(elapsed)
+        if response.status_code != 200:
+            raise CommandError(
+                f'{url}: {response.status_code} {response.content[:200]}')
+        p50, p95 = percentiles(durations)
+        self.stdout.write(
+            f'GET /api/recipes/feed/ (с сериализацией): p50 {p50:.2f} мс, '
+            f'p95 {p95:.2f} мс.')
+
+    def measure_writes(self, rng, reader_ids, authors):
+        # Рецепты авторов, которые читаются при запросе, не раскладываются.
+        fanned_out = User.objects.filter(recipes_count__gt=0,
+                                         feed_on_read=False)
+        author_id = rng.choice(list(set(authors) & set(
+            fanned_out.values_list('id', flat=True))))
+        Follow.objects.bulk_create([
+            Follow(user_id=reader_id, author_id=author_id)
+            for reader_id in reader_ids
+        ], ignore_conflicts=True)
+        recipe = Recipe.objects.filter(author_id=author_id).first()
+        FeedItem.objects.filter(recipe=recipe).delete()
+        result, elapsed = timed(feed.fan_out, recipe.id)
+        self.stdout.write(
+            f'Раскладка рецепта по {result["followers"]} лентам: '
+            f'{elapsed * 1000:.2f} мс.')
+        prolific = fanned_out.order_by('-recipes_count').first()
+        reader_id = reader_ids[0]
+        feed.remove_author(reader_id, prolific.id)
+        Follow.objects.filter(
+            user_id=reader_id, author_id=prolific.id).delete()
+        follow, elapsed = timed(
+            Follow.objects.create, user_id=reader_id, author_id=prolific.id)
+        self.stdout.write(
+            f'Подписка на автора с {prolific.recipes_count} рецептами '
+            f'(сразу не больше FEED_SYNC_LIMIT, остальные в фоне): '
+            f'{elapsed * 1000:.2f} мс.')
+        _, elapsed = timed(follow.delete)
+        self.stdout.write(f'Отписка: {elapsed * 1000:.2f} мс.')
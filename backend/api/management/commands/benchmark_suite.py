@@ -0,0 +1,217 @@
+import json
+import statistics
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from api.metrics import QueryRecorder
+from api.middleware import recording
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+DUMMY_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+
+def percentile(quantiles, value):
+    return round(quantiles[value - 1], 3)
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет основные сценарии API через тестовый клиент, '
+            'считает p50/p95/p99 и число SQL-запросов и сравнивает '
+            'с сохранённым базовым результатом.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=30,
+            help='Повторов каждого сценария.')
+        parser.add_argument(
+            '--baseline', default=DEFAULT_BASELINE,
+            help='JSON-файл с базовым результатом.')
+        parser.add_argument(
+            '--save', action='store_true',
+            help='Сохранить результат как новый базовый.')
+        parser.add_argument(
+            '--threshold', type=float, default=0.25,
+            help='Допустимый рост p95 относительно базового (0.25 = 25%%).')
+        parser.add_argument(
+            '--min-delta', type=float, default=2.0,
+            help='Рост p95 меньше этого числа миллисекунд не считается '
+                 'регрессией.')
+        parser.add_argument(
+            '--with-cache', action='store_true',
+            help='Не отключать кэш ответов.')
+        parser.add_argument(
+            '--user', help='Email пользователя для авторизованных запросов.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 2:
+            raise CommandError('--repeat должен быть не меньше 2.')
+        user = self.get_user(options['user'])
+        caches = {} if options['with_cache'] else {'CACHES': DUMMY_CACHES}
+        with override_settings(**caches):
+            results = {
+                name: self.run_flow(request, cleanup, options['repeat'])
+                for name, request, cleanup in self.get_flows(user)
+            }
+        report = {
+            'meta': {
+                'vendor': connection.vendor,
+                'recipes': Recipe.objects.count(),
+                'users': User.objects.count(),
+                'repeat': options['repeat'],
+                'cache': options['with_cache'],
+            },
+            'flows': results,
+        }
+        self.print_results(results)
+        path = Path(options['baseline'])
+        if options['save']:
+            path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+            self.stdout.write(self.style.SUCCESS(
+                f'Базовый результат сохранён в {path}.'))
+            return
+        if not path.exists():
+            self.stdout.write(self.style.WARNING(
+                f'Файла {path} нет, сравнивать не с чем. '
+                'Сохраните базовый результат с --save.'))
+            return
+        self.compare(report, json.loads(path.read_text()), options)
+
+    def get_user(self, email):
+        if email:
+            user = User.objects.filter(email=email).first()
+            if user is None:
+                raise CommandError(f'Пользователь {email} не найден.')
+            return user
+        user = User.objects.annotate(
+            carts=Count('shopping_cart')
+        ).order_by('-carts', 'id').first()
+        if user is None or not Recipe.objects.exists():
+            raise CommandError(
+                'Нет данных. Создайте их командой generate_data.')
+        return user
+
+    def get_flows(self, user):
+        """Сценарии: (название, запрос, действие после замера)."""
+        anonymous = APIClient(SERVER_NAME='localhost')
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user)
+        recipe = Recipe.objects.order_by('-favorites_count', 'id').first()
+        target = Recipe.objects.exclude(
+            is_favorited__user=user
+        ).exclude(is_in_shopping_cart__user=user).order_by('id').first()
+        tag = Tag.objects.order_by('id').first()
+        ingredients = ','.join(str(pk) for pk in Ingredient.objects.filter(
+            ingredient_list__isnull=False
+        ).values_list('id', flat=True).distinct()[:10])
+
+        def get(client, url):
+            return lambda: client.get(url)
+
+        flows = [
+            ('recipes_list_anonymous', get(anonymous, '/api/recipes/'), None),
+            ('recipes_list', get(client, '/api/recipes/?limit=6'), None),
+            ('recipes_list_cursor',
+             get(client, '/api/recipes/?pagination=cursor&limit=25'), None),
+            ('recipes_popular',
+             get(client, '/api/recipes/?ordering=popular&limit=25'), None),
+            ('recipes_favorited',
+             get(client, '/api/recipes/?is_favorited=1&limit=6'), None),
+            ('recipes_search',
+             get(client, '/api/recipes/?search=суп&limit=6'), None),
+            ('recipe_detail', get(client, f'/api/recipes/{recipe.id}/'),
+             None),
+            ('ingredients_search', get(anonymous, '/api/ingredients/?name=к'),
+             None),
+            ('subscriptions',
+             get(client, '/api/users/subscriptions/?recipes_limit=3'), None),
+            ('cook',
+             get(client, f'/api/recipes/cook/?ingredients={ingredients}'),
+             None),
+            ('download_shopping_cart',
+             get(client, '/api/recipes/download_shopping_cart/'), None),
+        ]
+        if tag is not None:
+            flows.append((
+                'recipes_by_tag',
+                get(client, f'/api/recipes/?tags={tag.slug}&limit=6'), None))
+        if target is not None:
+            for action in ('favorite', 'shopping_cart'):
+                url = f'/api/recipes/{target.id}/{action}/'
+                flows.append((
+                    f'{action}_add',
+                    lambda url=url: client.post(url),
+                    lambda url=url: client.delete(url),
+                ))
+        return flows
+
+    def run_flow(self, request, cleanup, repeat):
+        timings = []
+        queries = 0
+        # Первый прогон прогревает кэши процесса и не считается.
+        for iteration in range(repeat + 1):
+            recorder = QueryRecorder()
+            with recording(recorder):
+                start = time.perf_counter()
+                response = request()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                duration = (time.perf_counter() - start) * 1000
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{response.request["PATH_INFO"]} вернул статус '
+                    f'{response.status_code}.')
+            if cleanup is not None:
+                cleanup()
+            if iteration:
+                timings.append(duration)
+                queries = max(queries, recorder.count)
+        quantiles = statistics.quantiles(timings, n=100, method='inclusive')
+        return {
+            'p50': percentile(quantiles, 50),
+            'p95': percentile(quantiles, 95),
+            'p99': percentile(quantiles, 99),
+            'queries': queries,
+        }
+
+    def print_results(self, results):
+        self.stdout.write(
+            f'{"flow":<26}{"p50, ms":>9}{"p95, ms":>9}{"p99, ms":>9}'
+            f'{"queries":>9}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<26}{result["p50"]:>9.2f}{result["p95"]:>9.2f}'
+                f'{result["p99"]:>9.2f}{result["queries"]:>9}')
+
+    def compare(self, report, baseline, options):
+        if report['meta'] != baseline.get('meta'):
+            self.stdout.write(self.style.WARNING(
+                f'Условия отличаются от базовых: {baseline.get("meta")}.'))
+        regressions = []
+        for name, result in report['flows'].items():
+            base = baseline['flows'].get(name)
+            if base is None:
+                continue
+            if result['queries'] > base['queries']:
+                regressions.append(
+                    f'{name}: запросов {result["queries"]} '
+                    f'вместо {base["queries"]}')
+            limit = base['p95'] * (1 + options['threshold'])
+            if (result['p95'] > limit
+                    and result['p95'] - base['p95'] > options['min_delta']):
+                regressions.append(
+                    f'{name}: p95 {result["p95"]:.2f} мс '
+                    f'вместо {base["p95"]:.2f} мс')
+        if regressions:
+            raise CommandError(
+                'Регрессии производительности:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет.'))
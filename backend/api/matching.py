@@ -0,0 +1,250 @@
+import time
+from threading import Lock
+
+from django.conf import settings
+
+from recipes.models import RecipeIngredient
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ORDER_COVERAGE = 'coverage'
+ORDER_MISSING = 'missing'
+
+
+def popcount(value):
+    return bin(value).count('1')
+
+
+def to_mask(positions):
+    mask = 0
+    for position in positions:
+        mask |= 1 << position
+    return mask
+
+
+def bits(mask):
+    """Номера установленных битов маски."""
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+class RecipeMatrix:
+    """Пары (рецепт, ингредиент) в массивах NumPy.
+
+    Совпадения считаются сразу для всех рецептов через isin и bincount,
+    память расходуется только на существующие пары. Столбцы — номера
+    битов ингредиентов, а не их id. Изменение рецепта не пересобирает
+    массивы: старые пары рецепта получают столбец -1 и больше ни с чем
+    не совпадают, новые дописываются в конец.
+    """
+
+    def __init__(self, masks):
+        self.row_of = {}
+        rows = []
+        columns = []
+        for row, (recipe_id, mask) in enumerate(masks.items()):
+            self.row_of[recipe_id] = row
+            for position in bits(mask):
+                rows.append(row)
+                columns.append(position)
+        self.recipe_ids = numpy.fromiter(
+            self.row_of, dtype=numpy.int64, count=len(self.row_of))
+        self.rows = numpy.array(rows, dtype=numpy.int64)
+        self.columns = numpy.array(columns, dtype=numpy.int64)
+        self.totals = numpy.bincount(self.rows, minlength=len(masks))
+        self.removed = 0
+
+    @property
+    def is_fragmented(self):
+        """Удалённых пар больше, чем живых: пора собрать заново."""
+        return self.removed > len(self.columns) - self.removed
+
+    def update(self, recipe_id, mask):
+        """Заменяет ингредиенты рецепта; mask=0 — рецепт удалён."""
+        row = self.row_of.get(recipe_id)
+        if row is None:
+            if not mask:
+                return
+            row = self.row_of[recipe_id] = len(self.recipe_ids)
+            self.recipe_ids = numpy.append(self.recipe_ids, recipe_id)
+            self.totals = numpy.append(self.totals, 0)
+        else:
+            old = (self.rows == row) & (self.columns >= 0)
+            self.removed += int(numpy.count_nonzero(old))
+            self.columns[old] = -1
+        columns = list(bits(mask))
+        self.rows = numpy.concatenate([
+            self.rows, numpy.full(len(columns), row, dtype=numpy.int64)])
+        self.columns = numpy.concatenate([
+            self.columns, numpy.array(columns, dtype=numpy.int64)])
+        self.totals[row] = len(columns)
+
+    def score(self, positions):
+        hits = numpy.isin(self.columns, list(positions))
+        have = numpy.bincount(
+            self.rows[hits], minlength=len(self.recipe_ids))
+        found = have > 0
+        return zip(
+            self.recipe_ids[found].tolist(),
+            have[found].tolist(),
+            self.totals[found].tolist(),
+        )
+
+
+class RecipeIngredientIndex:
+    """Индекс «рецепт → набор ингредиентов» в памяти процесса.
+
+    Набор ингредиентов рецепта хранится битовой маской (int). Номера
+    битов раздаются ингредиентам подряд по мере появления в рецептах,
+    поэтому длина маски зависит от числа ингредиентов, а не от их id.
+    При установленном NumPy подсчёт идёт по массивам пар сразу для всех
+    рецептов. Изменения рецептов применяются точечно и к маскам, и к
+    массивам NumPy. Массивы собираются заново вне блокировки, когда в
+    них накопилось много удалённых пар; изменения, сделанные за время
+    сборки, затем применяются к новым массивам. Полная перестройка из
+    базы — при первом запросе и по истечении RECIPE_MATCH_INDEX_TTL.
+    """
+
+    def __init__(self):
+        self._masks = None
+        self._positions = None
+        self._matrix = None
+        # id рецептов, изменённых во время сборки матрицы; None — сборки
+        # нет.
+        self._changed = None
+        self._generation = 0
+        self._built_at = 0
+        self._lock = Lock()
+        self._matrix_lock = Lock()
+
+    @property
+    def is_warm(self):
+        ttl = settings.RECIPE_MATCH_INDEX_TTL
+        return self._masks is not None and (
+            not ttl or time.monotonic() - self._built_at < ttl
+        )
+
+    @property
+    def use_numpy(self):
+        return numpy is not None and settings.RECIPE_MATCH_USE_NUMPY
+
+    def build(self):
+        masks = {}
+        positions = {}
+        for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id').order_by().iterator():
+            position = positions.setdefault(ingredient_id, len(positions))
+            masks[recipe_id] = masks.get(recipe_id, 0) | 1 << position
+        with self._lock:
+            self._masks = masks
+            self._positions = positions
+            self._matrix = None
+            self._generation += 1
+            self._built_at = time.monotonic()
+
+    def _set_mask(self, recipe_id, mask):
+        """Меняет маску рецепта; вызывается под self._lock."""
+        if mask:
+            self._masks[recipe_id] = mask
+        else:
+            self._masks.pop(recipe_id, None)
+        if self._matrix is not None:
+            self._matrix.update(recipe_id, mask)
+        if self._changed is not None:
+            self._changed.add(recipe_id)
+
+    def update_recipe(self, recipe_id, ingredient_ids):
+        with self._lock:
+            if self._masks is None:
+                return
+            positions = self._positions
+            self._set_mask(recipe_id, to_mask(
+                positions.setdefault(ingredient_id, len(positions))
+                for ingredient_id in ingredient_ids
+            ))
+
+    def remove_recipe(self, recipe_id):
+        with self._lock:
+            if self._masks is None:
+                return
+            self._set_mask(recipe_id, 0)
+
+    def build_matrix(self):
+        """Собирает матрицу NumPy из масок, не держа self._lock.
+
+        Пока одна матрица собирается, остальные запросы считают по
+        старой, если она есть.
+        """
+        with self._matrix_lock:
+            with self._lock:
+                matrix = self._matrix
+                if matrix is not None and not matrix.is_fragmented:
+                    return
+                masks = dict(self._masks)
+                generation = self._generation
+                self._changed = set()
+            try:
+                matrix = RecipeMatrix(masks)
+                with self._lock:
+                    # Если маски за это время перестроены из базы,
+                    # матрица по старым маскам не нужна.
+                    if generation == self._generation:
+                        for recipe_id in self._changed:
+                            matrix.update(
+                                recipe_id, self._masks.get(recipe_id, 0))
+                        self._matrix = matrix
+            finally:
+                with self._lock:
+                    self._changed = None
+
+    def score(self, ingredient_ids):
+        """Тройки (id рецепта, есть ингредиентов, всего ингредиентов)."""
+        if not self.is_warm:
+            self.build()
+        use_numpy = self.use_numpy
+        if use_numpy:
+            matrix = self._matrix
+            if matrix is None or (matrix.is_fragmented
+                                  and not self._matrix_lock.locked()):
+                self.build_matrix()
+        with self._lock:
+            # Ингредиентов, которых нет ни в одном рецепте, нет и в масках.
+            positions = [
+                self._positions[ingredient_id]
+                for ingredient_id in ingredient_ids
+                if ingredient_id in self._positions
+            ]
+            if use_numpy and self._matrix is not None:
+                return list(self._matrix.score(positions))
+            available = to_mask(positions)
+            return [
+                (recipe_id, popcount(mask & available), popcount(mask))
+                for recipe_id, mask in self._masks.items()
+                if mask & available
+            ]
+
+    def search(self, ingredient_ids, order=ORDER_COVERAGE, limit=None):
+        """Рецепты, для которых есть хотя бы один из ингредиентов.
+
+        Сортировка по доле имеющихся ингредиентов (coverage) или по
+        числу недостающих (missing). Возвращает тройки
+        (id рецепта, доля, недостаёт).
+        """
+        results = [
+            (recipe_id, have / total, total - have)
+            for recipe_id, have, total in self.score(ingredient_ids)
+            if total
+        ]
+        if order == ORDER_MISSING:
+            results.sort(key=lambda item: (item[2], -item[1], -item[0]))
+        else:
+            results.sort(key=lambda item: (-item[1], item[2], -item[0]))
+        return results[:limit] if limit else results
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
@@ -0,0 +1,183 @@
+import re
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from threading import Lock
+
+# Границы корзин гистограмм, секунды.
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Границы корзин для подключений к базе, секунды.
+CONNECT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+# Границы корзин для числа запросов к базе.
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+NUMBER_RE = re.compile(r'\b\d+\b')
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+
+METRICS = {
+    'api_request_duration_seconds': (
+        'Время обработки запроса.', DURATION_BUCKETS),
+    'api_db_duration_seconds': (
+        'Время SQL-запросов за один запрос.', DURATION_BUCKETS),
+    'api_render_duration_seconds': (
+        'Время сериализации ответа в байты.', DURATION_BUCKETS),
+    'api_db_queries': (
+        'Число SQL-запросов за один запрос.', QUERY_BUCKETS),
+    'api_db_connect_seconds': (
+        'Время установки подключения к базе.', CONNECT_BUCKETS),
+    'api_db_pool_wait_seconds': (
+        'Ожидание подключения из пула.', CONNECT_BUCKETS),
+    'api_job_duration_seconds': (
+        'Время выполнения фоновой задачи.', DURATION_BUCKETS),
+}
+N_PLUS_ONE_METRIC = 'api_n_plus_one_total'
+POOL_TIMEOUTS_METRIC = 'api_db_pool_timeouts_total'
+JOB_DURATION_METRIC = 'api_job_duration_seconds'
+JOBS_METRIC = 'api_jobs_total'
+COUNTERS = {
+    N_PLUS_ONE_METRIC: 'Запросы с повторяющимися SQL-запросами (N+1).',
+    POOL_TIMEOUTS_METRIC: 'Не дождались свободного подключения в пуле.',
+    JOBS_METRIC: 'Попытки выполнения фоновых задач по итогу.',
+}
+
+# QueryRecorder текущего запроса для потоков api.async_views.
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+def sql_shape(sql):
+    """SQL без конкретных значений: списки IN, числа и строки
+    заменены."""
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    sql = STRING_RE.sub('?', sql)
+    return NUMBER_RE.sub('?', sql)
+
+
+class QueryRecorder:
+    """Обёртка для connection.execute_wrapper.
+
+    Считает запросы, их суммарное время и повторы одинаковых по форме
+    запросов.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.shapes[sql_shape(sql)] += 1
+
+    def repeated(self, threshold):
+        """Формы запросов, выполненных threshold раз и больше."""
+        return [
+            (shape, count) for shape, count in self.shapes.most_common()
+            if count >= threshold
+        ]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.total += 1
+
+
+def format_labels(labels):
+    return ','.join(
+        '{}="{}"'.format(
+            name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    )
+
+
+class Registry:
+    """Гистограммы и счётчики в памяти процесса.
+
+    Метрики не делятся между процессами: при нескольких воркерах
+    gunicorn у каждого свои значения.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = Counter()
+        self._lock = Lock()
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(
+                    METRICS[name][1])
+            histogram.observe(value)
+
+    def increment(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def summary(self, name):
+        """Число наблюдений и их сумма по всем меткам гистограммы."""
+        with self._lock:
+            histograms = [
+                histogram for (metric, _), histogram
+                in self._histograms.items() if metric == name
+            ]
+            return (sum(histogram.total for histogram in histograms),
+                    sum(histogram.sum for histogram in histograms))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def export(self):
+        """Метрики в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        for name, (description, _) in METRICS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, labels), histogram in histograms:
+                if metric != name:
+                    continue
+                cumulative = 0
+                bounds = [*histogram.buckets, '+Inf']
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    bucket_labels = format_labels([*labels, ('le', bound)])
+                    lines.append(
+                        f'{name}_bucket{{{bucket_labels}}} {cumulative}')
+                lines.append(
+                    f'{name}_sum{{{format_labels(labels)}}} {histogram.sum}')
+                lines.append(
+                    f'{name}_count{{{format_labels(labels)}}} '
+                    f'{histogram.total}')
+        for name, description in COUNTERS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} counter')
+            for (metric, labels), value in counters:
+                if metric == name:
+                    lines.append(
+                        f'{name}{{{format_labels(labels)}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.permissions import SAFE_METHODS
+
+from foodgram.db_router import replica_alias
+
+from .metrics import (N_PLUS_ONE_METRIC, QueryRecorder, current_recorder,
+                      registry)
+
+logger = logging.getLogger(__name__)
+
+PIN_KEY = 'db:pin:{digest}'
+
+
+def endpoint_name(request):
+    """Имя представления и действия: RecipeViewSet.list,
+    FollowMakeView.post."""
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name or match._func_path
+    method = request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+@contextmanager
+def recording(recorder):
+    """Включает recorder на всех подключениях к базам."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield
+
+
+class QueryMetricsMiddleware(MiddlewareMixin):
+    """Замеряет SQL-запросы и время ответа для каждого представления.
+
+    Для каждого запроса считает число SQL-запросов и их время, время
+    рендеринга ответа и общее время. Значения уходят в заголовок
+    Server-Timing и в гистограммы api.metrics с меткой представления.
+    Если одинаковый по форме SQL выполнен N_PLUS_ONE_THRESHOLD раз и
+    больше, пишет предупреждение в лог и увеличивает счётчик
+    api_n_plus_one_total. У потоковых ответов запросы внутри генератора
+    учитываются в метриках, но не в заголовке. Запросы из потоков
+    api.async_views тоже учитываются: recorder передаётся им через
+    current_recorder.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not settings.API_METRICS:
+            return self.get_response(request)
+        recorder = self.start(request)
+        token = current_recorder.set(recorder)
+        try:
+            with recording(recorder):
+                response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.finish(request, response, recorder)
+
+    async def __acall__(self, request):
+        if not settings.API_METRICS:
+            return await self.get_response(request)
+        recorder = self.start(request)
+        token = current_recorder.set(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.finish(request, response, recorder)
+
+    def start(self, request):
+        request.metrics_start = time.perf_counter()
+        request.metrics_render = 0
+        return QueryRecorder()
+
+    def finish(self, request, response, recorder):
+        if settings.API_SERVER_TIMING:
+            response['Server-Timing'] = self.server_timing(request, recorder)
+        if response.streaming:
+            response.streaming_content = self.stream(
+                request, response.streaming_content, recorder)
+        else:
+            self.record(request, response, recorder)
+        return response
+
+    def process_template_response(self, request, response):
+        # Ответы api.async_views отрендерены и замерены заранее.
+        if not settings.API_METRICS or response.is_rendered:
+            return response
+        start = time.perf_counter()
+
+        def rendered(response):
+            request.metrics_render = time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def stream(self, request, content, recorder):
+        with recording(recorder):
+            yield from content
+        self.record(request, None, recorder)
+
+    def server_timing(self, request, recorder):
+        total = time.perf_counter() - request.metrics_start
+        render = request.metrics_render
+        app = max(total - recorder.duration - render, 0)
+        return (
+            f'db;dur={recorder.duration * 1000:.1f};'
+            f'desc="{recorder.count} queries", '
+            f'app;dur={app * 1000:.1f}, '
+            f'render;dur={render * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+    def record(self, request, response, recorder):
+        endpoint = endpoint_name(request)
+        labels = {'endpoint': endpoint, 'method': request.method}
+        registry.observe('api_request_duration_seconds', labels,
+                         time.perf_counter() - request.metrics_start)
+        registry.observe('api_db_duration_seconds', labels, recorder.duration)
+        registry.observe('api_db_queries', labels, recorder.count)
+        registry.observe('api_render_duration_seconds', labels,
+                         request.metrics_render)
+        repeated = recorder.repeated(settings.N_PLUS_ONE_THRESHOLD)
+        if repeated:
+            registry.increment(N_PLUS_ONE_METRIC, {'endpoint': endpoint})
+            for shape, count in repeated:
+                logger.warning(
+                    'Возможный N+1 в %s: запрос выполнен %s раз: %s',
+                    endpoint, count, shape)
+
+
+def pin_key(request):
+    """Ключ закрепления за основной базой: по токену или сессии."""
+    credentials = (request.headers.get('Authorization')
+                   or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not credentials:
+        return None
+    return PIN_KEY.format(
+        digest=hashlib.md5(credentials.encode()).hexdigest())
+
+
+class ReplicaRoutingMiddleware(MiddlewareMixin):
+    """Направляет чтение безопасных запросов на реплики.
+
+    GET, HEAD и OPTIONS читают с одной случайной реплики из
+    DATABASE_REPLICAS, остальные запросы работают с основной базой.
+    После успешного изменяющего запроса клиент (по токену или сессии)
+    на REPLICA_PIN_SECONDS закрепляется за основной базой: реплика могла
+    ещё не получить его изменения.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        token = replica_alias.set(self.choose_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            replica_alias.reset(token)
+        self.pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        alias = await sync_to_async(
+            self.choose_replica, thread_sensitive=False)(request)
+        token = replica_alias.set(alias)
+        try:
+            response = await self.get_response(request)
+        finally:
+            replica_alias.reset(token)
+        await sync_to_async(self.pin, thread_sensitive=False)(
+            request, response)
+        return response
+
+    def choose_replica(self, request):
+        if request.method not in SAFE_METHODS:
+            return None
+        key = pin_key(request)
+        if key is not None and cache.get(key):
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def pin(self, request, response):
+        if request.method in SAFE_METHODS or response.status_code >= 400:
+            return
+        key = pin_key(request)
+        if key is not None:
+            cache.set(key, True, settings.REPLICA_PIN_SECONDS)
@@ -1,6 +1,199 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from recipes import feed
+from recipes.models import FeedItem
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по ключу (курсору) без OFFSET.
+
+    Курсор хранит значения полей ordering у последней записи страницы,
+    следующая страница выбирается условием «строго после» по этим
+    полям. Общее количество записей считается только по запросу
+    ?count=true и кэшируется на KEYSET_COUNT_TIMEOUT секунд.
+    """
+
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    page_size_query_param = 'limit'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def __init__(self, ordering, page_size, max_page_size=None):
+        self.ordering = ordering
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        if self.max_page_size:
+            return min(page_size, self.max_page_size)
+        return page_size
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance):
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            values.append(
+                value.isoformat() if hasattr(value, 'isoformat') else value)
+        return base64.urlsafe_b64encode(
+            json.dumps(values).encode()).decode()
+
+    def position_filter(self, position):
+        """Условие «запись идёт после position» для полей ordering."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_count(self, queryset):
+        key = 'api:count:' + hashlib.md5(
+            str(queryset.query).encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.KEYSET_COUNT_TIMEOUT)
+        return count
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'true':
+            self.count = self.get_count(queryset)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(position))
+        page = list(queryset[:page_size + 1])
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1])
+        )
+
+    def get_first_link(self):
+        return remove_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([
+            ('next', self.get_next_link()),
+            ('first', self.get_first_link()),
+            ('results', data),
+        ])
+        if self.count is not None:
+            response['count'] = self.count
+            response.move_to_end('count', last=False)
+        return Response(response)
+
+
+class FeedPagination(KeysetPagination):
+    """Лента подписок: всегда по курсору, новые рецепты сверху.
+
+    Страница собирается recipes.feed.page из готовых строк FeedItem и
+    рецептов авторов, которые читаются при запросе, поэтому вместо
+    paginate_queryset — paginate_feed.
+    """
+
+    def __init__(self):
+        super().__init__(('-pub', '-recipe_id'), settings.FEED_PAGE_SIZE,
+                         settings.FEED_MAX_PAGE_SIZE)
+
+    def paginate_feed(self, user_id, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'true':
+            self.count = self.get_count(
+                FeedItem.objects.filter(user_id=user_id)
+            ) + feed.on_read_count(user_id)
+        position = self.decode_cursor(request, FeedItem)
+        page = feed.page(user_id, position, page_size + 1)
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        return self.page
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация с режимом курсора.
+
+    По умолчанию работает как PageNumberPagination, с ?pagination=cursor
+    переключается на KeysetPagination по полям keyset_ordering. Если у
+    представления есть метод get_keyset_ordering(request), порядок
+    берётся из него; None — порядок не годится для курсора (например,
+    по релевантности поиска), и страницы остаются постраничными.
+    """
+
     page_size_query_param = 'limit'
     page_size = 3
+    mode_query_param = 'pagination'
+    keyset_ordering = ('-pub', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        ordering = None
+        if request.query_params.get(self.mode_query_param) == 'cursor':
+            ordering = self.get_keyset_ordering(request, view)
+        if ordering is not None:
+            self.keyset = KeysetPagination(
+                ordering, self.page_size, self.max_page_size)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_keyset_ordering(self, request, view):
+        if hasattr(view, 'get_keyset_ordering'):
+            return view.get_keyset_ordering(request)
+        return self.keyset_ordering
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class SubscriptionPagination(CustomPagination):
+    page_size = 6
+    keyset_ordering = ('-author_id',)
@@ -0,0 +1,138 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+
+from rest_framework import renderers
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SHOPPING_LIST_TITLE = 'Cписок покупок:'
+NAME = 'ingredient__name'
+UNIT = 'ingredient__measurement_unit'
+AMOUNT = 'amount_sum'
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    """JSONRenderer на orjson.
+
+    Вывод совпадает с JSONRenderer побайтно: компактные разделители,
+    UTF-8 без экранирования, U+2028 и U+2029 экранируются. Даты и типы,
+    которых orjson не знает (Decimal, ленивые строки и т. п.),
+    обрабатывает JSONEncoder из DRF. Без orjson, с отступами (indent) и
+    при ошибке orjson работает обычный JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(
+                accepted_media_type or '', renderer_context or {}):
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=JSONEncoder().default,
+                option=(orjson.OPT_NON_STR_KEYS
+                        | orjson.OPT_PASSTHROUGH_DATETIME
+                        | orjson.OPT_PASSTHROUGH_DATACLASS),
+            )
+        except (orjson.JSONEncodeError, TypeError):
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        # JSONRenderer экранирует эти символы для совместимости с JS.
+        return ret.replace(
+            '\u2028'.encode(), b'\\u2028'
+        ).replace(
+            '\u2029'.encode(), b'\\u2029'
+        )
+
+
+class ShoppingListRenderer(ABC, renderers.BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    Строки списка выдаются по частям методом stream, чтобы ответ можно
+    было отдавать через StreamingHttpResponse. Наследники обязаны
+    определить stream, иначе их нельзя создать.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # Сообщения об ошибках (например, 401) приходят словарём.
+            return '\n'.join(
+                f'{key}: {value}' for key, value in data.items()
+            ).encode(self.charset)
+        return ''.join(self.stream(data)).encode(self.charset)
+
+    @abstractmethod
+    def stream(self, ingredients):
+        """Выдаёт список покупок по частям (строками) из строк
+        shopping_list.export_rows."""
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield SHOPPING_LIST_TITLE
+        separator = ''
+        for item in ingredients:
+            yield (
+                f'{separator}\n{item[NAME]} - '
+                f'{item[AMOUNT]} {item[UNIT]}'
+            )
+            separator = ', '
+
+
+class _Echo:
+    """Псевдофайл, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(['name', 'amount', 'measurement_unit'])
+        for item in ingredients:
+            yield writer.writerow([item[NAME], item[AMOUNT], item[UNIT]])
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return json.dumps(data, ensure_ascii=False).encode(self.charset)
+        return super().render(data, accepted_media_type, renderer_context)
+
+    def stream(self, ingredients):
+        yield '['
+        separator = ''
+        for item in ingredients:
+            yield separator + json.dumps({
+                'name': item[NAME],
+                'amount': item[AMOUNT],
+                'measurement_unit': item[UNIT],
+            }, ensure_ascii=False)
+            separator = ', '
+        yield ']'
+
+
+SHOPPING_LIST_RENDERERS = {
+    renderer.format: renderer
+    for renderer in (ShoppingListTextRenderer, ShoppingListCSVRenderer,
+                     ShoppingListJSONRenderer)
+}
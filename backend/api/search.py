@@ -0,0 +1,122 @@
+import time
+from bisect import bisect_left
+from threading import Lock, Thread
+
+from django.conf import settings
+from django.db import connection
+
+from recipes.models import Ingredient
+
+
+class IngredientIndex:
+    """Префиксный индекс ингредиентов в памяти процесса.
+
+    Хранит отсортированный по названию в нижнем регистре массив и ищет
+    по нему бинарным поиском. Индекс строится в фоновом потоке, один раз
+    на процесс: пока его нет, search возвращает None, и поиск идёт в
+    базе. Индекс сбрасывается сигналами и импортом при изменении
+    ингредиентов, а по истечении INGREDIENT_INDEX_TTL перестраивается в
+    фоне, чтобы другие воркеры тоже видели изменения; до конца
+    перестройки отвечает старый индекс.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._built_at = 0
+        # Номер сброса: индекс, построенный до invalidate, не сохраняется.
+        self._generation = 0
+        self._building = False
+        self._lock = Lock()
+
+    @property
+    def is_warm(self):
+        ttl = settings.INGREDIENT_INDEX_TTL
+        return self._index is not None and (
+            not ttl or time.monotonic() - self._built_at < ttl
+        )
+
+    def build(self):
+        generation = self._generation
+        rows = sorted(
+            (name.lower(), pk, name, unit)
+            for pk, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator()
+        )
+        index = (
+            [row[0] for row in rows],
+            [
+                {'id': pk, 'name': name, 'measurement_unit': unit}
+                for _, pk, name, unit in rows
+            ],
+        )
+        with self._lock:
+            if generation == self._generation:
+                self._index = index
+                self._built_at = time.monotonic()
+        return index
+
+    def build_in_background(self):
+        """Запускает построение индекса, если оно ещё не идёт."""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        Thread(target=self._build_thread, name='ingredient-index',
+               daemon=True).start()
+
+    def _build_thread(self):
+        try:
+            self.build()
+        finally:
+            with self._lock:
+                self._building = False
+            connection.close()
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._generation += 1
+
+    def search(self, prefix, limit=None):
+        """Ингредиенты, название которых начинается с prefix.
+
+        None, если индекс ещё не построен.
+        """
+        index = self._index
+        if not self.is_warm:
+            self.build_in_background()
+        if index is None:
+            return None
+        keys, rows = index
+        prefix = prefix.lower()
+        start = bisect_left(keys, prefix)
+        end = len(keys) if limit is None else min(len(keys), start + limit)
+        result = []
+        for position in range(start, end):
+            if not keys[position].startswith(prefix):
+                break
+            result.append(rows[position])
+        return result
+
+
+ingredient_index = IngredientIndex()
+
+
+def search_ingredients(prefix, limit=None):
+    """Поиск ингредиентов по началу названия.
+
+    Если кэш отключён настройкой INGREDIENT_SEARCH_CACHE или индекс
+    ещё строится, запрос уходит в базу и использует индекс по
+    UPPER(name).
+    """
+    if settings.INGREDIENT_SEARCH_CACHE:
+        result = ingredient_index.search(prefix, limit)
+        if result is not None:
+            return result
+    queryset = Ingredient.objects.filter(
+        name__istartswith=prefix
+    ).values('id', 'name', 'measurement_unit')
+    if limit is not None:
+        queryset = queryset[:limit]
+    return list(queryset)
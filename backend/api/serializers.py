@@ -1,7 +1,19 @@
+import posixpath
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.urls import reverse
 from rest_framework import serializers
 from drf_extra_fields.fields import Base64ImageField
 from djoser.serializers import UserSerializer, UserCreateSerializer
 
+from api.matching import recipe_ingredient_index
+from api.renderers import SHOPPING_LIST_RENDERERS
+from jobs.models import Job
+from recipes import shopping_list
+from recipes.images import schedule_thumbnails
+from recipes.importers import READERS
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
                             ShoppingCart, Tag)
 from users.models import Follow, User
@@ -10,6 +22,17 @@ MIN_AMOUNT = 1
 MAX_AMOUNT = 32000
 
 
+def get_recipes_limit(request):
+    """Значение ?recipes_limit= или None, если его нет или оно неверное."""
+    if request is None:
+        return None
+    try:
+        limit = int(request.query_params.get('recipes_limit', ''))
+    except ValueError:
+        return None
+    return limit if limit > 0 else None
+
+
 class CustomUserSerializer(UserSerializer):
     """Сериализатор для модели User."""
 
@@ -28,8 +51,11 @@ class CustomUserSerializer(UserSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        if request.user.is_anonymous:
+        if request is None or request.user.is_anonymous:
             return False
+        subscriptions = self.context.get('subscriptions')
+        if subscriptions is not None:
+            return obj.id in subscriptions
         return Follow.objects.filter(author=obj, user=request.user).exists()
 
 
@@ -59,6 +85,26 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+def thumbnail_urls(thumbnails, request=None):
+    """Ссылки на уменьшенные копии картинки: {формат: {ширина: url}}."""
+    urls = {}
+    for image_format, sizes in thumbnails.items():
+        urls[image_format] = {}
+        for width, name in sizes.items():
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[image_format][width] = url
+    return urls
+
+
+class ThumbnailsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные копии картинки: {формат: {ширина: url}}."""
+
+    def to_representation(self, value):
+        return thumbnail_urls(value, self.context.get('request'))
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Recipe."""
     tags = TagSerializer(many=True)
@@ -71,6 +117,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_in_shopping_cart = serializers.SerializerMethodField(
         method_name='get_is_in_shopping_cart')
     author = CustomUserSerializer()
+    thumbnails = ThumbnailsField()
 
     class Meta:
         model = Recipe
@@ -81,6 +128,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             'author',
             'ingredients',
             'image',
+            'thumbnails',
             'text',
             'is_favorited',
             'is_in_shopping_cart',
@@ -89,15 +137,19 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     def get_is_favorited(self, obj):
         """проверка на добавление рецепта в избранное"""
+        if hasattr(obj, 'favorited'):
+            return obj.favorited
         request = self.context.get('request')
-        if request.user.is_anonymous:
+        if request is None or request.user.is_anonymous:
             return False
         return Favorite.objects.filter(
             recipe=obj, user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'in_shopping_cart'):
+            return obj.in_shopping_cart
         request = self.context.get('request')
-        if request.user.is_anonymous:
+        if request is None or request.user.is_anonymous:
             return False
         return ShoppingCart.objects.filter(
             recipe=obj, user=request.user).exists()
@@ -105,6 +157,7 @@ class RecipeSerializer(serializers.ModelSerializer):
 
 class RecipeShortSerializer(serializers.ModelSerializer):
     """"Сериализатор для добавления в избранное"""
+    thumbnails = ThumbnailsField()
 
     class Meta:
         model = Recipe
@@ -112,14 +165,18 @@ class RecipeShortSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'thumbnails',
             'cooking_time',
         )
 
 
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
-    """Сериализатор для добавления ингредиентов в рецепт."""
-    id = serializers.PrimaryKeyRelatedField(source='ingredient',
-                                            queryset=Ingredient.objects.all())
+    """Сериализатор для добавления ингредиентов в рецепт.
+
+    Существование ингредиентов проверяет RecipeCreateSerializer одним
+    запросом на весь список.
+    """
+    id = serializers.IntegerField(source='ingredient_id', min_value=1)
     amount = serializers.IntegerField(
         min_value=MIN_AMOUNT,
         max_value=MAX_AMOUNT)
@@ -129,6 +186,71 @@ class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
+def missing_ids(model, ids):
+    """id из ids, которых нет в таблице model. Один запрос."""
+    existing = set(
+        model.objects.filter(id__in=ids).values_list('id', flat=True))
+    return [pk for pk in ids if pk not in existing]
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для массовых операций."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_RECIPES_LIMIT,
+    )
+
+    def validate_recipes(self, value):
+        value = list(dict.fromkeys(value))
+        missing = missing_ids(Recipe, value)
+        if missing:
+            raise serializers.ValidationError(
+                f'Рецепты не найдены: {missing}.')
+        return value
+
+
+class ShoppingListExportSerializer(serializers.Serializer):
+    """Формат фоновой выгрузки списка покупок."""
+
+    format = serializers.ChoiceField(
+        choices=list(SHOPPING_LIST_RENDERERS), default='txt')
+
+
+class IngredientImportSerializer(serializers.Serializer):
+    """Файл .json или .csv для фоновой загрузки ингредиентов."""
+
+    file = serializers.FileField()
+
+    def validate_file(self, value):
+        extension = posixpath.splitext(value.name)[1].lower()
+        if extension not in READERS:
+            raise serializers.ValidationError(
+                f'Поддерживаются файлы {", ".join(READERS)}.')
+        if value.size > settings.INGREDIENT_IMPORT_MAX_SIZE:
+            raise serializers.ValidationError('Слишком большой файл.')
+        return value
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """Состояние фоновой задачи; download — ссылка на готовый файл."""
+
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ('id', 'status', 'attempts', 'max_attempts', 'result',
+                  'error', 'download', 'created', 'started', 'finished')
+
+    def get_download(self, obj):
+        if not obj.file:
+            return None
+        url = reverse('api:job-download', args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
 class RecipeCreateSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientCreateSerializer(many=True)
     image = Base64ImageField(required=True)
@@ -136,8 +258,8 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         min_value=MIN_AMOUNT,
         max_value=MAX_AMOUNT
     )
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(min_value=1))
 
     class Meta:
         model = Recipe
@@ -149,34 +271,101 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                   'cooking_time',
                   )
 
+    def validate_ingredients(self, value):
+        ingredient_ids = [item['ingredient_id'] for item in value]
+        if len(ingredient_ids) != len(set(ingredient_ids)):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться.')
+        missing = missing_ids(Ingredient, ingredient_ids)
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {missing}.')
+        return value
+
+    def validate_image(self, value):
+        width, height = value.image.size
+        if width * height > settings.IMAGE_MAX_PIXELS:
+            raise serializers.ValidationError(
+                'Слишком большое изображение.')
+        return value
+
+    def validate_tags(self, value):
+        if len(value) != len(set(value)):
+            raise serializers.ValidationError('Теги не должны повторяться.')
+        missing = missing_ids(Tag, value)
+        if missing:
+            raise serializers.ValidationError(f'Теги не найдены: {missing}.')
+        return value
+
     def update_ingredients(self, recipe, ingredients_data):
-        recipe_ingredients = []
-        for ingredient_data in ingredients_data:
-            ingredient_id = ingredient_data.get('ingredient').id
-            amount = ingredient_data.get('amount')
-            recipe_ingredients.append(
-                RecipeIngredient(recipe=recipe,
-                                 ingredient_id=ingredient_id,
-                                 amount=amount)
-            )
-
-        RecipeIngredient.objects.filter(recipe=recipe).delete()
-        RecipeIngredient.objects.bulk_create(recipe_ingredients)
+        """Приводит ингредиенты рецепта к ingredients_data.
+
+        Удаляет, добавляет и меняет количество только у тех строк,
+        которые отличаются от текущих. Разница по каждому ингредиенту
+        переносится в списки покупок, где есть рецепт.
+        """
+        amounts = {
+            item['ingredient_id']: item['amount'] for item in ingredients_data
+        }
+        current = {
+            item.ingredient_id: item
+            for item in RecipeIngredient.objects.filter(recipe=recipe)
+        }
+        deltas = {}
+        removed = current.keys() - amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+            for ingredient_id in removed:
+                deltas[ingredient_id] = -current[ingredient_id].amount
+        added = []
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            item = current.get(ingredient_id)
+            if item is None:
+                added.append(RecipeIngredient(recipe=recipe,
+                                              ingredient_id=ingredient_id,
+                                              amount=amount))
+                deltas[ingredient_id] = amount
+            elif item.amount != amount:
+                deltas[ingredient_id] = amount - item.amount
+                item.amount = amount
+                changed.append(item)
+        RecipeIngredient.objects.bulk_create(added)
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        shopping_list.change_recipe(recipe.id, deltas)
+        ingredient_ids = list(amounts)
+        transaction.on_commit(
+            lambda: recipe_ingredient_index.update_recipe(
+                recipe.id, ingredient_ids)
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags')
         instance = super().create(validated_data)
+        instance.tags.set(tags)
         self.update_ingredients(instance, ingredients)
+        schedule_thumbnails(instance.id)
         return instance
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop('ingredients')
+        ingredients_data = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
         instance = super().update(instance, validated_data)
-        self.update_ingredients(instance, ingredients_data)
+        if tags is not None:
+            # set() сам сравнивает наборы и меняет только разницу.
+            instance.tags.set(tags)
+        if ingredients_data is not None:
+            self.update_ingredients(instance, ingredients_data)
+        if 'image' in validated_data:
+            schedule_thumbnails(instance.id)
         return instance
 
     def to_representation(self, instance):
-        return RecipeSerializer(instance).data
+        return RecipeSerializer(instance, context=self.context).data
 
 
 class CustomUserCreateSerializer(UserCreateSerializer):
@@ -207,8 +396,7 @@ class FollowSerializer(serializers.ModelSerializer):
                                       read_only=True)
     is_subscribed = serializers.SerializerMethodField(
         method_name='get_is_subscribed')
-    recipes = RecipeShortSerializer(source='author.recipes', many=True,
-                                    read_only=True)
+    recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
 
     class Meta:
@@ -225,20 +413,24 @@ class FollowSerializer(serializers.ModelSerializer):
         ]
 
     def get_recipes_count(self, obj):
-        return obj.author.recipes.count()
+        return obj.author.recipes_count
 
     def get_is_subscribed(self, obj):
+        request = self.context.get('request')
+        if request is not None and obj.user_id == request.user.id:
+            return True
         if obj.user.is_authenticated:
             return obj.user.is_subscribed.filter(author=obj.author).exists()
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes = obj.recipes.all()
-        limit = request.GET.get('recipes_limit')
-
-        if limit:
-            recipes = recipes[:int(limit)]
-        serializer = RecipeShortSerializer(recipes, many=True)
+        recipes = getattr(obj.author, 'recipes_preview', None)
+        if recipes is None:
+            recipes = obj.author.recipes.all()
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit:
+                recipes = recipes[:limit]
+        serializer = RecipeShortSerializer(
+            recipes, many=True, context=self.context)
         return serializer.data
 
 
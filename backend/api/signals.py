@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import Follow, User
+
+from .cache import bump_version, user_namespace
+from .filters import POPULAR_NAMESPACE
+from .matching import recipe_ingredient_index
+from .search import ingredient_index
+
+
+def bump_on_commit(namespace):
+    transaction.on_commit(lambda: bump_version(namespace))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    ingredient_index.invalidate()
+    bump_on_commit('ingredients')
+    bump_on_commit('recipes')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(**kwargs):
+    bump_on_commit('tags')
+    bump_on_commit('recipes')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipes(**kwargs):
+    bump_on_commit('recipes')
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(update_fields=None, **kwargs):
+    # Вход в систему обновляет только last_login, в рецептах его нет.
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        bump_on_commit('recipes')
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Follow)
+def invalidate_user_flags(instance, **kwargs):
+    bump_on_commit(user_namespace(instance.user_id))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+def invalidate_popular(**kwargs):
+    # Меняется favorites_count, а с ним порядок ?ordering=popular.
+    bump_on_commit(POPULAR_NAMESPACE)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_matching_index(instance, **kwargs):
+    recipe_id = instance.pk
+    transaction.on_commit(
+        lambda: recipe_ingredient_index.remove_recipe(recipe_id))
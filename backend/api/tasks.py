@@ -0,0 +1,47 @@
+import codecs
+import posixpath
+from uuid import uuid4
+
+from django.core.files.base import ContentFile
+
+from jobs.queue import JobError
+from jobs.storage import job_storage
+from recipes import shopping_list
+from recipes.importers import READERS, import_ingredients as import_files
+
+from .renderers import SHOPPING_LIST_RENDERERS
+
+INGREDIENT_UPLOAD_DIR = 'uploads/'
+
+
+def save_upload(file):
+    """Сохраняет загруженный файл в хранилище задач и возвращает его
+    имя для import_ingredients."""
+    return job_storage.save(
+        f'{INGREDIENT_UPLOAD_DIR}{uuid4().hex}/'
+        f'{posixpath.basename(file.name)}', file)
+
+
+def export_shopping_list(user_id, format):
+    """Файл списка покупок пользователя в формате format."""
+    renderer = SHOPPING_LIST_RENDERERS[format]()
+    rows = shopping_list.export_rows(user_id).iterator()
+    return ContentFile(
+        ''.join(renderer.stream(rows)).encode(renderer.charset),
+        name=f'shopping_list.{renderer.format}')
+
+
+def import_ingredients(name, batch_size=1000):
+    """Загружает ингредиенты из файла name в хранилище и удаляет его."""
+    reader = READERS.get(posixpath.splitext(name)[1].lower())
+    if reader is None or not job_storage.exists(name):
+        raise JobError(f'Файл {name} не найден или не поддерживается.')
+    try:
+        with job_storage.open(name, 'rb') as file:
+            total, created = import_files(
+                [(reader, codecs.getreader('utf-8-sig')(file))], batch_size)
+    except (ValueError, KeyError, IndexError) as error:
+        job_storage.delete(name)
+        raise JobError(f'Некорректный файл: {error}') from error
+    job_storage.delete(name)
+    return {'read': total, 'created': created}
@@ -0,0 +1,1491 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from threading import current_thread
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import Count
+from django.db.models.signals import pre_delete
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from PIL import Image, PngImagePlugin
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.fast_serializers import FastRecipeSerializer
+from api.management.commands.benchmark import INDEXED_TABLES, Command
+from api.matching import (RecipeIngredientIndex, RecipeMatrix,
+                          recipe_ingredient_index)
+from api.metrics import POOL_TIMEOUTS_METRIC, registry
+from api.middleware import QueryMetricsMiddleware
+from api.renderers import SHOPPING_LIST_RENDERERS, ShoppingListRenderer
+from api.search import (IngredientIndex, ingredient_index,
+                        search_ingredients)
+from api.views import RecipeViewSet
+from foodgram.db_router import PrimaryReplicaRouter, replica_alias
+from foodgram.postgresql.pool import close_pools
+from jobs.models import Job
+from jobs.queue import run_job
+from recipes import feed
+from recipes.fulltext import update_search_index
+from recipes.images import (METADATA_KEYS, process_recipe_image,
+                            strip_metadata)
+from recipes.importers import import_ingredients, read_csv, read_json
+from recipes.models import (Favorite, FeedItem, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Tag)
+from recipes.relations import RecipesNotFound, add_recipes
+from recipes.shopping_list import export_rows, find_drift
+from users.models import Follow, User
+
+DUMMY_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api-tests',
+    },
+}
+
+
+@override_settings(CACHES=DUMMY_CACHES)
+class RecipeAPITestCase(TestCase):
+    """Несколько авторов с рецептами, тегами и ингредиентами."""
+
+    recipes_count = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Тестовый')
+        authors = [
+            User.objects.create(
+                username=f'author{number}',
+                email=f'author{number}@example.com',
+                first_name='Автор', last_name=str(number))
+            for number in range(3)
+        ]
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(5)
+        ]
+        for number in range(cls.recipes_count):
+            recipe = Recipe.objects.create(
+                author=authors[number % len(authors)],
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=number + 1,
+                image='recipes/images/test.png',
+            )
+            recipe.tags.set(cls.tags[:number % len(cls.tags) + 1])
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=number + 1)
+                for ingredient in cls.ingredients[:number % 4 + 1]
+            ])
+            if number % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if number % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(user=cls.user, author=authors[0])
+        cls.recipe = Recipe.objects.order_by('id').first()
+
+    def get_client(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+
+class FastSerializerTest(RecipeAPITestCase):
+    """Быстрый путь отдаёт побайтно тот же JSON, что и сериализаторы
+    DRF."""
+
+    def fetch(self, client, url, fast):
+        with override_settings(API_FAST_SERIALIZERS=fast):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_recipes_match_drf(self):
+        urls = ['/api/recipes/?limit=20', f'/api/recipes/{self.recipe.id}/']
+        for user in (None, self.user):
+            client = self.get_client(user)
+            for url in urls:
+                with self.subTest(url=url, user=user):
+                    self.assertEqual(self.fetch(client, url, True),
+                                     self.fetch(client, url, False))
+
+    def test_recipes_use_fast_serializer(self):
+        client = self.get_client(self.user)
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.id}/'):
+            with self.subTest(url=url), mock.patch.object(
+                    FastRecipeSerializer, 'to_representation',
+                    autospec=True,
+                    side_effect=FastRecipeSerializer.to_representation
+            ) as to_representation:
+                self.assertEqual(client.get(url).status_code, 200)
+                to_representation.assert_called()
+
+    def test_tags_and_ingredients_match_drf(self):
+        client = self.get_client()
+        for url in ('/api/tags/', '/api/ingredients/',
+                    f'/api/tags/{self.tags[0].id}/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.fetch(client, url, True),
+                                 self.fetch(client, url, False))
+
+
+@override_settings(JOBS_BACKEND='immediate')
+class JobFileTest(RecipeAPITestCase):
+    """Файлы задач не лежат в MEDIA_ROOT и отдаются только владельцу."""
+
+    def setUp(self):
+        files_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, files_root)
+        override = override_settings(JOBS_FILES_ROOT=files_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.files_root = files_root
+
+    def export(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.get_client(self.user).post(
+                '/api/recipes/download_shopping_cart/export/',
+                {'format': 'csv'})
+        self.assertEqual(response.status_code, 202)
+        return Job.objects.get(pk=response.json()['id'])
+
+    def test_file_is_not_public(self):
+        job = self.export()
+        self.assertEqual(job.status, Job.SUCCESS)
+        path = os.path.realpath(job.file.path)
+        self.assertTrue(path.startswith(os.path.realpath(self.files_root)))
+        self.assertFalse(
+            path.startswith(os.path.realpath(settings.MEDIA_ROOT)))
+        self.assertNotIn(f'/{job.pk}/', job.file.name)
+
+    def test_download_only_by_owner(self):
+        job = self.export()
+        url = f'/api/jobs/{job.pk}/download/'
+        response = self.get_client(self.user).get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Ингредиент', b''.join(
+            response.streaming_content).decode())
+        stranger = User.objects.create(
+            username='stranger', email='stranger@example.com')
+        self.assertEqual(
+            self.get_client(stranger).get(url).status_code, 404)
+        self.assertEqual(self.get_client().get(url).status_code, 401)
+
+
+class ShoppingListRendererTest(RecipeAPITestCase):
+    """Выгрузка списка покупок в форматах txt, csv и json."""
+
+    def test_formats(self):
+        client = self.get_client(self.user)
+        rows = list(export_rows(self.user.id))
+        for renderer_class in SHOPPING_LIST_RENDERERS.values():
+            renderer = renderer_class()
+            with self.subTest(format=renderer.format):
+                response = client.get(
+                    '/api/recipes/download_shopping_cart/',
+                    {'format': renderer.format})
+                self.assertEqual(response.status_code, 200)
+                content = b''.join(response.streaming_content)
+                self.assertEqual(content, renderer.render(rows))
+        response = client.get('/api/recipes/download_shopping_cart/',
+                              {'format': 'json'})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(
+            {item['name']: item['amount'] for item in data},
+            {row['ingredient__name']: row['amount_sum'] for row in rows})
+
+    def test_stream_is_abstract(self):
+        with self.assertRaises(TypeError):
+            ShoppingListRenderer()
+
+        class NoStream(ShoppingListRenderer):
+            format = 'txt'
+
+        with self.assertRaises(TypeError):
+            NoStream()
+
+
+class CookTest(RecipeAPITestCase):
+    """Подбор рецептов по ингредиентам: /api/recipes/cook/."""
+
+    def setUp(self):
+        recipe_ingredient_index.build()
+
+    def cook(self, query):
+        return self.get_client().get(f'/api/recipes/cook/?{query}')
+
+    def test_matches(self):
+        ingredient = self.ingredients[0]
+        expected = set(Recipe.objects.filter(
+            ingredients=ingredient).values_list('id', flat=True))
+        for use_numpy in (False, True):
+            with self.subTest(use_numpy=use_numpy), override_settings(
+                    RECIPE_MATCH_USE_NUMPY=use_numpy):
+                response = self.cook(f'ingredients={ingredient.id}&limit=100')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    {item['id'] for item in response.json()}, expected)
+
+    def test_limit(self):
+        ingredient_id = self.ingredients[0].id
+        response = self.cook(f'ingredients={ingredient_id}&limit=2')
+        self.assertEqual(len(response.json()), 2)
+        for limit in (0, -1):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.cook(
+                    f'ingredients={ingredient_id}&limit={limit}'
+                ).status_code, 400)
+
+    def test_invalid_ingredients(self):
+        for value in ('-1', '0', str(10 ** 9), 'abc'):
+            with self.subTest(value=value):
+                self.assertEqual(
+                    self.cook(f'ingredients={value}').status_code, 400)
+
+
+class RecipeMatchingIndexTest(RecipeAPITestCase):
+    """Индекс подбора рецептов совпадает с подсчётом в базе после
+    правок рецептов."""
+
+    pantries = [[0], [0, 1], [1, 2, 3], [4], [0, 1, 2, 3, 4]]
+
+    def setUp(self):
+        self.index = RecipeIngredientIndex()
+        self.index.build()
+
+    def expected(self, ingredient_ids):
+        totals = dict(RecipeIngredient.objects.values(
+            'recipe_id').annotate(total=Count('id')).values_list(
+            'recipe_id', 'total'))
+        have = RecipeIngredient.objects.filter(
+            ingredient_id__in=ingredient_ids
+        ).values('recipe_id').annotate(have=Count('id')).values_list(
+            'recipe_id', 'have')
+        return sorted((recipe_id, count, totals[recipe_id])
+                      for recipe_id, count in have)
+
+    def assertMatchesDatabase(self):
+        for numbers in self.pantries:
+            ingredient_ids = [self.ingredients[number].id
+                              for number in numbers]
+            expected = self.expected(ingredient_ids)
+            for use_numpy in (False, True):
+                with self.subTest(pantry=numbers, use_numpy=use_numpy), \
+                        override_settings(RECIPE_MATCH_USE_NUMPY=use_numpy):
+                    self.assertEqual(
+                        sorted(self.index.score(ingredient_ids)), expected)
+
+    def set_ingredients(self, recipe, ingredients):
+        RecipeIngredient.objects.filter(recipe=recipe).delete()
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in ingredients
+        ])
+        self.index.update_recipe(
+            recipe.id, [ingredient.id for ingredient in ingredients])
+
+    def test_edits_update_matrix_in_place(self):
+        self.assertMatchesDatabase()
+        recipes = list(Recipe.objects.order_by('id'))
+        with mock.patch('api.matching.RecipeMatrix',
+                        wraps=RecipeMatrix) as matrix_class:
+            self.set_ingredients(recipes[0], self.ingredients[3:])
+            self.set_ingredients(recipes[1], [])
+            self.index.remove_recipe(recipes[2].id)
+            recipes[2].delete()
+            saffron = Ingredient.objects.create(name='Шафран',
+                                                measurement_unit='г')
+            recipe = Recipe.objects.create(
+                author=recipes[0].author, name='Новый', text='Описание',
+                cooking_time=1, image='recipes/images/test.png')
+            self.set_ingredients(recipe, [saffron, self.ingredients[0]])
+            self.pantries = [*self.pantries, [0, 5]]
+            self.ingredients = [*self.ingredients, saffron]
+            self.assertMatchesDatabase()
+        matrix_class.assert_not_called()
+
+    def test_fragmented_matrix_is_rebuilt(self):
+        self.assertMatchesDatabase()
+        recipe = self.recipe
+        with mock.patch('api.matching.RecipeMatrix',
+                        wraps=RecipeMatrix) as matrix_class:
+            for number in range(30):
+                self.set_ingredients(
+                    recipe, self.ingredients[number % 5:number % 5 + 2])
+            self.assertMatchesDatabase()
+        matrix_class.assert_called_once()
+
+    def test_changes_during_build(self):
+        recipe = self.recipe
+
+        def build(masks):
+            # Блокировка индекса не занята: правка проходит сразу.
+            self.set_ingredients(recipe, self.ingredients[2:])
+            return RecipeMatrix(masks)
+
+        with mock.patch('api.matching.RecipeMatrix', side_effect=build):
+            self.index.score([self.ingredients[0].id])
+        self.assertTrue(RecipeIngredient.objects.filter(
+            recipe=recipe, ingredient=self.ingredients[4]).exists())
+        self.assertMatchesDatabase()
+
+
+class AsyncViewsTest(SimpleTestCase):
+    """AsyncViewSetMixin: в пуле потоков только list и retrieve."""
+
+    def thread_name(self, actions, method):
+        """Имя потока, в котором выполнилось бы представление."""
+        with override_settings(API_ASYNC_VIEWS=True), mock.patch(
+                'api.async_views.run_view',
+                side_effect=lambda *args, **kwargs: current_thread().name):
+            view = RecipeViewSet.as_view(actions)
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+        return asyncio.run(view(getattr(RequestFactory(), method)('/')))
+
+    def test_pooled_actions(self):
+        list_route = {'get': 'list', 'post': 'create'}
+        detail_route = {'get': 'retrieve', 'patch': 'partial_update',
+                        'delete': 'destroy'}
+        for actions, method, pooled in (
+                (list_route, 'get', True),
+                (list_route, 'head', True),
+                (list_route, 'post', False),
+                (detail_route, 'get', True),
+                (detail_route, 'patch', False),
+                (detail_route, 'delete', False),
+                ({'get': 'download_shopping_cart'}, 'get', False),
+                ({'post': 'favorite', 'delete': 'favorite'}, 'post', False)):
+            with self.subTest(actions=actions, method=method):
+                self.assertEqual(
+                    self.thread_name(actions, method).startswith('api-db'),
+                    pooled)
+
+    def test_disabled(self):
+        view = RecipeViewSet.as_view({'get': 'list'})
+        self.assertFalse(asyncio.iscoroutinefunction(view))
+
+
+class RecipeListQueriesTest(RecipeAPITestCase):
+    """Число SQL-запросов списка рецептов не зависит от размера
+    страницы."""
+
+    def count_queries(self, client, url):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(client.get(url).status_code, 200)
+        return len(context.captured_queries)
+
+    def test_constant_queries(self):
+        for user in (None, self.user):
+            client = self.get_client(user)
+            for mode in ('', '&pagination=cursor'):
+                expected = self.count_queries(
+                    client, f'/api/recipes/?limit=1{mode}')
+                for size in (3, 6, self.recipes_count):
+                    url = f'/api/recipes/?limit={size}{mode}'
+                    with self.subTest(user=user, url=url):
+                        with self.assertNumQueries(expected):
+                            response = client.get(url)
+                        self.assertEqual(
+                            len(response.json()['results']), size)
+
+
+class IndexTest(RecipeAPITestCase):
+    """Индексы и ограничения для горячих запросов списка рецептов."""
+
+    indexes = {
+        'recipes_favorite': 'unique_favorite',
+        'recipes_shoppingcart': 'unique_shopping_cart',
+        'recipes_recipeingredient': 'unique_recipe_ingredient',
+        'recipes_recipe': 'recipe_pub_id_idx',
+    }
+
+    def test_indexes_exist(self):
+        with connection.cursor() as cursor:
+            for table, name in self.indexes.items():
+                with self.subTest(table=table):
+                    self.assertIn(name, connection.introspection
+                                  .get_constraints(cursor, table))
+
+    @skipUnless(connection.vendor == 'postgresql', 'планы PostgreSQL')
+    def test_hot_queries_use_indexes(self):
+        # На маленьких таблицах планировщик выбирает полный просмотр,
+        # поэтому запрещаем его: Seq Scan останется, только если
+        # подходящего индекса нет.
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        querysets = Command().explain_querysets(self.user)
+        for name, queryset in querysets.items():
+            plan = queryset.explain()
+            for table in INDEXED_TABLES:
+                with self.subTest(query=name, table=table):
+                    self.assertNotIn(f'Seq Scan on {table}', plan)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ResponseCacheTest(RecipeAPITestCase):
+    """Кэшируется только JSON, ответ зависит от Accept."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_json_is_cached(self):
+        client = self.get_client()
+        for result in ('MISS', 'HIT'):
+            response = client.get('/api/tags/')
+            with self.subTest(result=result):
+                self.assertEqual(response['X-Cache'], result)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertIn('Accept', response['Vary'])
+
+    def test_browsable_api_is_not_cached(self):
+        client = self.get_client()
+        client.get('/api/tags/')
+        for url, accept in (('/api/tags/?format=api', '*/*'),
+                            ('/api/tags/', 'text/html')):
+            with self.subTest(url=url, accept=accept):
+                response = client.get(url, HTTP_ACCEPT=accept)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(
+                    response['Content-Type'].startswith('text/html'))
+                self.assertNotIn('X-Cache', response)
+                self.assertIn('Accept', response['Vary'])
+
+    def test_indent_is_part_of_key(self):
+        client = self.get_client()
+        compact = client.get('/api/tags/').content
+        response = client.get('/api/tags/',
+                              HTTP_ACCEPT='application/json; indent=4')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertNotEqual(response.content, compact)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PopularCacheTest(RecipeAPITestCase):
+    """Изменение избранного сбрасывает кэш ?ordering=popular."""
+
+    url = '/api/recipes/?ordering=popular&limit=3'
+
+    def setUp(self):
+        cache.clear()
+
+    def first_id(self, client):
+        return client.get(self.url).json()['results'][0]['id']
+
+    def test_favorite_changes_order(self):
+        reader = self.get_client()
+        first = self.first_id(reader)
+        self.assertEqual(reader.get(self.url)['X-Cache'], 'HIT')
+        recipe = Recipe.objects.exclude(pk=first).order_by('pub').first()
+        fans = [
+            User.objects.create(username=f'fan{number}',
+                                email=f'fan{number}@example.com')
+            for number in range(2)
+        ]
+        for fan in fans:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.get_client(fan).post(
+                    f'/api/recipes/{recipe.id}/favorite/')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.first_id(reader), recipe.id)
+
+
+class KeysetPaginationTest(RecipeAPITestCase):
+    """Страницы по курсору: ?pagination=cursor."""
+
+    url = '/api/recipes/?pagination=cursor&limit=5'
+
+    def setUp(self):
+        self.client = self.get_client()
+
+    def pages(self, url=url):
+        """Списки id рецептов по страницам, по ссылкам next."""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([recipe['id']
+                          for recipe in response.json()['results']])
+            url = response.json()['next']
+        return pages
+
+    def expected_ids(self):
+        return list(Recipe.objects.order_by('-pub', '-id').values_list(
+            'id', flat=True))
+
+    def test_pages(self):
+        pages = self.pages()
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual(sum(pages, []), self.expected_ids())
+        response = self.client.get(self.url + '&count=true')
+        self.assertEqual(response.json()['count'], self.recipes_count)
+
+    def test_equal_pub_ordered_by_id(self):
+        Recipe.objects.update(pub=self.recipe.pub)
+        ids = sum(self.pages(), [])
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertEqual(len(ids), self.recipes_count)
+
+    def test_stable_under_inserts(self):
+        expected = self.expected_ids()
+        response = self.client.get(self.url)
+        first_page = [recipe['id'] for recipe in response.json()['results']]
+        last = Recipe.objects.get(pk=first_page[-1])
+        oldest = Recipe.objects.get(pk=expected[-1])
+        new = {}
+        for name, pub in (('top', None), ('tied', last.pub),
+                          ('old', oldest.pub - timedelta(days=1))):
+            recipe = Recipe.objects.create(
+                author=self.recipe.author, name=name, text='Описание',
+                cooking_time=1, image='recipes/images/test.png')
+            if pub is not None:
+                Recipe.objects.filter(pk=recipe.pk).update(pub=pub)
+            new[name] = recipe.id
+        # Рецепты до курсора (новый и с тем же pub, но большим id) не
+        # сдвигают следующие страницы, рецепт после курсора попадает в
+        # конец.
+        rest = sum(self.pages(response.json()['next']), [])
+        self.assertEqual(rest, expected[5:] + [new['old']])
+
+    def test_invalid_cursor(self):
+        cursors = [
+            'не курсор',
+            base64.urlsafe_b64encode(b'[1]').decode(),
+            base64.urlsafe_b64encode(b'{"pub": 1}').decode(),
+            base64.urlsafe_b64encode(b'["not a date", 1]').decode(),
+            base64.urlsafe_b64encode(b'["2024-01-01T00:00:00", "x"]').decode(),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    f'{self.url}&{urlencode({"cursor": cursor})}')
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(),
+                                 {'detail': 'Неверный курсор.'})
+
+
+class QueryMetricsTest(RecipeAPITestCase):
+    """QueryMetricsMiddleware и /api/metrics/."""
+
+    timing_re = re.compile(
+        r'db;dur=[\d.]+;desc="(\d+) queries", app;dur=[\d.]+, '
+        r'render;dur=[\d.]+, total;dur=[\d.]+')
+
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+    def middleware(self, get_response):
+        return QueryMetricsMiddleware(get_response)(
+            RequestFactory().get('/'))
+
+    def run_queries(self, count):
+        for pk in range(count):
+            Recipe.objects.filter(pk=pk).exists()
+        return HttpResponse()
+
+    def test_server_timing(self):
+        client = self.get_client(self.user)
+        for url in ('/api/users/me/', '/api/recipes/'):
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(url)
+                match = self.timing_re.fullmatch(response['Server-Timing'])
+                self.assertIsNotNone(match, response['Server-Timing'])
+                self.assertGreater(int(match[1]), 0)
+                if url == '/api/users/me/':
+                    self.assertEqual(int(match[1]), len(queries))
+        with override_settings(API_SERVER_TIMING=False):
+            self.assertNotIn('Server-Timing', client.get('/api/users/me/'))
+
+    def test_request_metrics(self):
+        self.get_client().get('/api/tags/')
+        labels = 'endpoint="TagViewSet.list",method="GET"'
+        exported = registry.export()
+        for name in ('api_request_duration_seconds', 'api_db_queries',
+                     'api_db_duration_seconds',
+                     'api_render_duration_seconds'):
+            with self.subTest(name=name):
+                self.assertIn(f'# TYPE {name} histogram', exported)
+                self.assertIn(f'{name}_count{{{labels}}} 1', exported)
+                self.assertIn(f'{name}_bucket{{{labels},le="+Inf"}} 1',
+                              exported)
+        self.assertEqual(registry.summary('api_db_queries'), (1, 1))
+
+    def test_n_plus_one(self):
+        threshold = settings.N_PLUS_ONE_THRESHOLD
+        self.middleware(lambda request: self.run_queries(threshold - 1))
+        self.assertNotIn('api_n_plus_one_total{', registry.export())
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            response = self.middleware(
+                lambda request: self.run_queries(threshold))
+        self.assertIn(f'выполнен {threshold} раз', logs.output[0])
+        self.assertIn(f'desc="{threshold} queries"',
+                      response['Server-Timing'])
+        self.assertIn('api_n_plus_one_total{endpoint="unresolved"} 1',
+                      registry.export())
+
+    def test_streaming_response(self):
+        def stream(request):
+            def content():
+                yield b'a'
+                self.run_queries(2)
+                yield b'b'
+            return StreamingHttpResponse(content())
+
+        response = self.middleware(stream)
+        self.assertEqual(registry.summary('api_db_queries'), (0, 0))
+        self.assertEqual(b''.join(response.streaming_content), b'ab')
+        self.assertEqual(registry.summary('api_db_queries'), (1, 2))
+
+    def test_metrics_view(self):
+        self.get_client().get('/api/tags/')
+        client = self.get_client()
+        response = client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('api_request_duration_seconds_count{'
+                      'endpoint="TagViewSet.list",method="GET"} 1', lines)
+        for line in lines:
+            with self.subTest(line=line):
+                self.assertRegex(
+                    line, r'^(# (HELP|TYPE) \w+ .+|\w+\{.*\} [\d.e+-]+)$')
+        self.assertEqual(
+            client.get('/api/metrics/', REMOTE_ADDR='10.0.0.1').status_code,
+            403)
+        with override_settings(METRICS_ALLOWED_IPS=['10.0.0.1']):
+            self.assertEqual(client.get(
+                '/api/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 200)
+            self.assertEqual(client.get('/api/metrics/').status_code, 403)
+
+
+class ImportIngredientsTest(RecipeAPITestCase):
+    """Команда import_json."""
+
+    def write_file(self, content, suffix='.csv'):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_import(self):
+        json_path = self.write_file(
+            '[{"name": "Шафран", "measurement_unit": "г"},'
+            ' {"name": "Ингредиент 0", "measurement_unit": "г"}]', '.json')
+        csv_path = self.write_file('Шафран,г\nКардамон,г\n')
+        call_command('import_json', json_path, csv_path, stdout=io.StringIO())
+        call_command('import_json', csv_path, stdout=io.StringIO())
+        self.assertEqual(
+            Ingredient.objects.filter(
+                name__in=['Шафран', 'Кардамон', 'Ингредиент 0']).count(), 3)
+
+    def test_read_json_across_chunks(self):
+        items = [{'name': f'Ингредиент {number}', 'measurement_unit': 'г'}
+                 for number in range(5000)]
+        rows = list(read_json(io.StringIO(json.dumps(items))))
+        self.assertEqual(rows[4999], ('Ингредиент 4999', 'г'))
+        self.assertEqual(len(rows), 5000)
+
+    def test_invalid_json_elements(self):
+        cases = {
+            '[{"name": "Шафран", "measurement_unit": "г"}, 1]':
+                'элемент 1: ожидался объект',
+            '[{"name": "Шафран", "measurement_unit": "г"}, ["Соль", "г"]]':
+                'элемент 1: ожидался объект',
+            '[{"name": "Шафран"}]': 'элемент 0: поле measurement_unit',
+            '[{"name": null, "measurement_unit": "г"}]':
+                'элемент 0: поле name',
+        }
+        for content, message in cases.items():
+            with self.subTest(content=content):
+                path = self.write_file(content, '.json')
+                with self.assertRaisesMessage(CommandError, message):
+                    call_command('import_json', path)
+        self.assertFalse(Ingredient.objects.filter(name='Шафран').exists())
+
+    def test_invalid_csv_row(self):
+        path = self.write_file('Шафран,г\n\nСоль\n')
+        with self.assertRaisesMessage(CommandError, 'строка 3'):
+            call_command('import_json', path)
+        self.assertFalse(Ingredient.objects.filter(name='Шафран').exists())
+
+    def test_batch_size_must_be_positive(self):
+        path = self.write_file('Шафран,г\n')
+        for batch_size in (0, -1):
+            with self.subTest(batch_size=batch_size):
+                with self.assertRaises(CommandError):
+                    call_command('import_json', path, batch_size=batch_size)
+        self.assertFalse(Ingredient.objects.filter(name='Шафран').exists())
+
+
+@mock.patch.object(ingredient_index, 'build_in_background')
+class IngredientSearchTest(RecipeAPITestCase):
+    """Автодополнение ингредиентов: индекс в памяти и запасной запрос к
+    базе."""
+
+    def setUp(self):
+        ingredient_index.invalidate()
+        self.addCleanup(ingredient_index.invalidate)
+
+    def names(self, prefix):
+        return [row['name'] for row in search_ingredients(prefix)]
+
+    def test_cold_index_uses_database(self, build_in_background):
+        # В SQLite LIKE не различает регистр только для латиницы.
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.names('Ингредиент')), 5)
+        self.assertIsNone(ingredient_index.search('ингредиент'))
+        build_in_background.assert_called()
+
+    def test_prefix(self, build_in_background):
+        ingredient_index.build()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('ИНГРЕДИЕНТ 3'), ['Ингредиент 3'])
+        self.assertEqual(self.names('ингредиент')[:2],
+                         ['Ингредиент 0', 'Ингредиент 1'])
+        self.assertEqual(search_ingredients('ингредиент', 2),
+                         search_ingredients('ингредиент')[:2])
+        self.assertEqual(self.names('шафран'), [])
+        build_in_background.assert_not_called()
+
+    def test_import_invalidates_index(self, build_in_background):
+        ingredient_index.build()
+        import_ingredients([(read_csv, io.StringIO('Шафран,г\n'))])
+        self.assertIsNone(ingredient_index.search('шафран'))
+        self.assertEqual(self.names('Шафран'), ['Шафран'])
+        ingredient_index.build()
+        self.assertEqual(
+            [row['name'] for row in ingredient_index.search('шафран')],
+            ['Шафран'])
+
+    def test_build_started_once(self, build_in_background):
+        build_in_background.side_effect = (
+            IngredientIndex.build_in_background.__get__(ingredient_index))
+        # Поток не запускается и не сбрасывает флаг сам.
+        self.addCleanup(setattr, ingredient_index, '_building', False)
+        with mock.patch('api.search.Thread') as thread:
+            for _ in range(3):
+                ingredient_index.search('ингредиент')
+        thread.assert_called_once()
+
+
+class SearchTest(RecipeAPITestCase):
+    """Полнотекстовый поиск рецептов: ?search=."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        author = User.objects.get(username='author0')
+        recipes = {}
+        for key, name, text in (
+                ('title', 'Курица с картофелем', 'Запечь курица и картофель.'),
+                ('text', 'Обед', 'Салат, курица, огурцы и зелень.'),
+                ('pie', 'Шарлотка', 'Яблоки, мука, яйца.'),
+        ):
+            recipes[key] = Recipe.objects.create(
+                author=author, name=name, text=text, cooking_time=30,
+                image='recipes/images/test.png')
+            update_search_index(recipes[key].id)
+        cls.found = recipes
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT to_regprocedure('similarity(text, text)')")
+                if cursor.fetchone()[0] is None:
+                    self.skipTest('нет расширения pg_trgm')
+        elif connection.vendor != 'sqlite':
+            self.skipTest('поиск только по названию')
+
+    def search(self, query, params=''):
+        response = self.get_client().get(
+            f'/api/recipes/?search={query}&limit=10{params}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, query, params=''):
+        return [item['id'] for item in self.search(query, params)['results']]
+
+    def test_ranking(self):
+        # Рецепт text новее, но слово у него только в описании.
+        self.assertEqual(self.ids('курица'), [
+            self.found['title'].id, self.found['text'].id])
+
+    def test_cursor_mode_keeps_ranking(self):
+        data = self.search('курица', '&pagination=cursor')
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([item['id'] for item in data['results']], [
+            self.found['title'].id, self.found['text'].id])
+
+    def test_single_query(self):
+        client = self.get_client()
+        with CaptureQueriesContext(connection) as context:
+            client.get('/api/recipes/?limit=10')
+        with self.assertNumQueries(len(context.captured_queries)):
+            client.get('/api/recipes/?search=курица&limit=10')
+
+    @skipUnless(connection.vendor == 'postgresql', 'словари PostgreSQL')
+    def test_stemming(self):
+        self.assertEqual(self.ids('картофеля'), [self.found['title'].id])
+
+    @skipUnless(connection.vendor == 'postgresql', 'pg_trgm')
+    def test_typo(self):
+        self.assertEqual(self.ids('шарлота'), [self.found['pie'].id])
+
+
+class ThumbnailTest(RecipeAPITestCase):
+    """Уменьшенные копии картинки рецепта и очистка метаданных."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def save_image(self, image_format, **params):
+        buffer = io.BytesIO()
+        Image.new('RGB', (1000, 500), '#E26C2D').save(
+            buffer, image_format, **params)
+        extension = 'jpg' if image_format == 'JPEG' else 'png'
+        name = default_storage.save(f'recipes/images/photo.{extension}',
+                                    ContentFile(buffer.getvalue()))
+        Recipe.objects.filter(pk=self.recipe.pk).update(image=name)
+        return name
+
+    def save_jpeg(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        return self.save_image('JPEG', exif=exif, icc_profile=b'icc')
+
+    def test_thumbnails(self):
+        original = self.save_jpeg()
+        process_recipe_image(self.recipe.pk)
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertNotEqual(recipe.image.name, original)
+        self.assertFalse(default_storage.exists(original))
+        with recipe.image.open('rb') as file:
+            image = Image.open(file)
+            # Поворот из EXIF применён к пикселям.
+            self.assertEqual(image.size, (500, 1000))
+            self.assertFalse(set(image.info) & METADATA_KEYS)
+        self.assertEqual(set(recipe.thumbnails), {'webp', 'jpg'})
+        widths = {str(width) for width in settings.THUMBNAIL_WIDTHS}
+        for sizes in recipe.thumbnails.values():
+            self.assertEqual(set(sizes), widths)
+            for width, name in sizes.items():
+                with self.subTest(name=name), default_storage.open(
+                        name) as file:
+                    image = Image.open(file)
+                    self.assertEqual(image.width, min(int(width), 500))
+                    self.assertFalse(set(image.info) & METADATA_KEYS)
+        data = self.get_client().get(f'/api/recipes/{recipe.pk}/').json()
+        self.assertEqual(
+            data['thumbnails']['webp']['320'],
+            'http://testserver'
+            + default_storage.url(recipe.thumbnails['webp']['320']))
+
+    def test_png_text_is_stripped(self):
+        info = PngImagePlugin.PngInfo()
+        info.add_text('Author', 'Автор')
+        self.save_image('PNG', pnginfo=info)
+        process_recipe_image(self.recipe.pk)
+        with Recipe.objects.get(pk=self.recipe.pk).image.open('rb') as file:
+            self.assertEqual(Image.open(file).text, {})
+
+    def test_image_changed_during_job(self):
+        self.save_jpeg()
+        new_name = 'recipes/images/new.png'
+
+        def replace_image(*args, **kwargs):
+            Recipe.objects.filter(pk=self.recipe.pk).update(image=new_name)
+            return strip_metadata(*args, **kwargs)
+
+        with mock.patch('recipes.images.strip_metadata',
+                        side_effect=replace_image):
+            process_recipe_image(self.recipe.pk)
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertEqual(recipe.image.name, new_name)
+        self.assertEqual(recipe.thumbnails, {})
+        self.assertEqual(default_storage.listdir('recipes/thumbnails')[1], [])
+        self.assertEqual(
+            default_storage.listdir('recipes/images')[1], ['photo.jpg'])
+
+
+class RelationsTest(RecipeAPITestCase):
+    """Избранное и список покупок: одиночные и массовые запросы."""
+
+    def setUp(self):
+        self.client = self.get_client(self.user)
+        self.recipe_ids = list(Recipe.objects.exclude(
+            is_favorited__user=self.user
+        ).order_by('id').values_list('id', flat=True)[:3])
+
+    def test_favorite_twice(self):
+        url = f'/api/recipes/{self.recipe_ids[0]}/favorite/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(Favorite.objects.filter(
+            user=self.user, recipe_id=self.recipe_ids[0]).count(), 1)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+
+    def test_bulk(self):
+        for model, url in ((Favorite, '/api/recipes/favorite/bulk/'),
+                           (ShoppingCart, '/api/recipes/shopping_cart/bulk/')):
+            with self.subTest(url=url):
+                model.objects.filter(user=self.user).delete()
+                first, *rest = self.recipe_ids
+                self.client.post(url, {'recipes': [first]}, format='json')
+                response = self.client.post(
+                    url, {'recipes': self.recipe_ids}, format='json')
+                self.assertEqual(response.json(),
+                                 {'added': rest, 'skipped': [first]})
+                self.assertEqual(
+                    model.objects.filter(user=self.user).count(), 3)
+                response = self.client.delete(
+                    url, {'recipes': rest}, format='json')
+                self.assertEqual(response.json(),
+                                 {'removed': rest, 'skipped': []})
+                response = self.client.delete(
+                    url, {'recipes': self.recipe_ids}, format='json')
+                self.assertEqual(response.json(),
+                                 {'removed': [first], 'skipped': rest})
+                self.assertFalse(model.objects.filter(user=self.user))
+
+    def test_deleted_recipe(self):
+        recipe_id = self.recipe_ids[0]
+        Recipe.objects.filter(pk=recipe_id).delete()
+        with self.assertRaises(RecipesNotFound) as context:
+            add_recipes(Favorite, self.user.id, self.recipe_ids)
+        self.assertEqual(context.exception.recipe_ids, [recipe_id])
+        self.assertFalse(Favorite.objects.filter(
+            user=self.user, recipe_id__in=self.recipe_ids))
+        # Рецепт удалили после проверки сериализатором.
+        with mock.patch('api.serializers.missing_ids', return_value=[]):
+            response = self.client.post(
+                '/api/recipes/favorite/bulk/',
+                {'recipes': self.recipe_ids}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(recipe_id), response.json()['recipes'][0])
+
+    def test_pre_delete_sees_row(self):
+        url = f'/api/recipes/{self.recipe_ids[0]}/shopping_cart/'
+        self.client.post(url)
+        seen = []
+
+        def receiver(instance, **kwargs):
+            seen.append(ShoppingCart.objects.filter(pk=instance.pk).exists())
+
+        pre_delete.connect(receiver, sender=ShoppingCart)
+        self.addCleanup(pre_delete.disconnect, receiver, sender=ShoppingCart)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(seen, [True])
+
+
+class CountersTest(RecipeAPITestCase):
+    """Денормализованные счётчики совпадают с числом записей."""
+
+    def setUp(self):
+        self.client = self.get_client(self.user)
+        self.author = User.objects.get(username='author1')
+
+    def assertCounters(self):
+        out = io.StringIO()
+        call_command('reconcile_counters', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue().count('расхождений 0.'), 4,
+                         out.getvalue())
+
+    def test_fixture(self):
+        self.assertCounters()
+
+    def test_relation_toggles(self):
+        recipe = self.recipe
+        for model, field, action in (
+                (Favorite, 'favorites_count', 'favorite'),
+                (ShoppingCart, 'shopping_cart_count', 'shopping_cart')):
+            with self.subTest(action=action):
+                url = f'/api/recipes/{recipe.id}/{action}/'
+                bulk_url = f'/api/recipes/{action}/bulk/'
+                before = model.objects.filter(recipe=recipe).count()
+                for request in (
+                        lambda: self.client.post(url),
+                        lambda: self.client.post(url),
+                        lambda: self.client.post(
+                            bulk_url, {'recipes': [recipe.id]},
+                            format='json')):
+                    request()
+                    recipe.refresh_from_db()
+                    self.assertEqual(getattr(recipe, field), before + 1)
+                for request in (
+                        lambda: self.client.delete(url),
+                        lambda: self.client.delete(url),
+                        lambda: self.client.delete(
+                            bulk_url, {'recipes': [recipe.id]},
+                            format='json')):
+                    request()
+                    recipe.refresh_from_db()
+                    self.assertEqual(getattr(recipe, field), before)
+        self.assertCounters()
+
+    def test_follow_toggle(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        for status_code in (201, 400):
+            self.assertEqual(self.client.post(url).status_code, status_code)
+            self.author.refresh_from_db()
+            self.assertEqual(self.author.followers_count, 1)
+        for _ in range(2):
+            self.client.delete(url)
+            self.author.refresh_from_db()
+            self.assertEqual(self.author.followers_count, 0)
+        self.assertCounters()
+
+    def test_recipes_count(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Новый', text='Описание',
+            cooking_time=1, image='recipes/images/test.png')
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 5)
+        recipe.delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 4)
+        self.assertCounters()
+
+    def test_reconcile_counters(self):
+        Recipe.objects.update(favorites_count=100, shopping_cart_count=0)
+        User.objects.filter(pk=self.author.pk).update(
+            followers_count=3, recipes_count=0)
+        out = io.StringIO()
+        call_command('reconcile_counters', dry_run=True, stdout=out)
+        self.assertIn(f'recipe.favorites_count: расхождений '
+                      f'{self.recipes_count}.', out.getvalue())
+        self.assertIn('user.recipes_count: расхождений 1.', out.getvalue())
+        self.assertEqual(Recipe.objects.filter(
+            favorites_count=100).count(), self.recipes_count)
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.assertCounters()
+        self.author.refresh_from_db()
+        self.assertEqual(
+            (self.author.followers_count, self.author.recipes_count), (0, 4))
+
+
+class SubscriptionsTest(RecipeAPITestCase):
+    """Список подписок с превью рецептов авторов."""
+
+    url = '/api/users/subscriptions/'
+
+    def setUp(self):
+        self.client = self.get_client(self.user)
+        for author in User.objects.filter(username__in=['author1',
+                                                        'author2']):
+            Follow.objects.create(user=self.user, author=author)
+
+    def previews(self, query=''):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        return {
+            author['id']: [recipe['id'] for recipe in author['recipes']]
+            for author in response.json()['results']
+        }
+
+    def newest(self, author_id, limit=None):
+        return list(Recipe.objects.filter(author_id=author_id).order_by(
+            '-pub', '-id').values_list('id', flat=True)[:limit])
+
+    def test_recipes_limit(self):
+        for query, limit in (('', None), ('?recipes_limit=2', 2),
+                             ('?recipes_limit=10', None),
+                             ('?recipes_limit=0', None),
+                             ('?recipes_limit=x', None)):
+            with self.subTest(query=query):
+                previews = self.previews(query)
+                self.assertEqual(len(previews), 3)
+                for author_id, recipe_ids in previews.items():
+                    self.assertEqual(recipe_ids,
+                                     self.newest(author_id, limit))
+
+    def test_equal_pub_ordered_by_id(self):
+        Recipe.objects.update(pub=self.recipe.pub)
+        for author_id, recipe_ids in self.previews(
+                '?recipes_limit=3').items():
+            self.assertEqual(recipe_ids, self.newest(author_id, 3))
+            self.assertEqual(recipe_ids, sorted(recipe_ids, reverse=True))
+
+    def test_constant_queries(self):
+        query = '?recipes_limit=2'
+        with CaptureQueriesContext(connection) as before:
+            self.previews(query)
+        for number in range(3):
+            author = User.objects.create(
+                username=f'new{number}', email=f'new{number}@example.com')
+            for _ in range(3):
+                Recipe.objects.create(
+                    author=author, name='Новый', text='Описание',
+                    cooking_time=1, image='recipes/images/test.png')
+            Follow.objects.create(user=self.user, author=author)
+        with self.assertNumQueries(len(before)):
+            self.assertEqual(len(self.previews(query)), 6)
+
+
+class ShoppingListTest(RecipeAPITestCase):
+    """Готовые списки покупок совпадают с суммой по ShoppingCart."""
+
+    def setUp(self):
+        self.buyer = User.objects.create(
+            username='buyer', email='buyer@example.com')
+        self.client = self.get_client(self.buyer)
+        self.recipes = list(Recipe.objects.order_by('id')[:3])
+
+    def items(self, user=None):
+        return dict(ShoppingListItem.objects.filter(
+            user=user or self.buyer
+        ).values_list('ingredient_id', 'amount'))
+
+    def assertNoDrift(self):
+        self.assertEqual(find_drift(), {})
+
+    def test_fixture_has_no_drift(self):
+        self.assertNoDrift()
+        self.assertTrue(self.items(self.user))
+
+    def test_cart_add_and_remove(self):
+        first, second, third = (recipe.id for recipe in self.recipes)
+        self.client.post(f'/api/recipes/{first}/shopping_cart/')
+        self.client.post('/api/recipes/shopping_cart/bulk/',
+                         {'recipes': [second, third]}, format='json')
+        # Ингредиент 0 есть во всех трёх рецептах: 1 + 2 + 3.
+        ingredient = self.ingredients[0].id
+        self.assertEqual(self.items()[ingredient], 6)
+        self.assertNoDrift()
+        self.client.delete(f'/api/recipes/{second}/shopping_cart/')
+        self.assertEqual(self.items()[ingredient], 4)
+        self.assertNoDrift()
+        self.client.delete('/api/recipes/shopping_cart/bulk/',
+                           {'recipes': [first, third]}, format='json')
+        self.assertEqual(self.items(), {})
+
+    def test_recipe_ingredients_changed(self):
+        recipe = self.recipes[2]
+        self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        kept, removed, changed = self.ingredients[:3]
+        added = self.ingredients[4]
+        response = self.get_client(recipe.author).patch(
+            f'/api/recipes/{recipe.id}/',
+            {'ingredients': [{'id': kept.id, 'amount': 3},
+                             {'id': changed.id, 'amount': 10},
+                             {'id': added.id, 'amount': 7}]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.items(),
+                         {kept.id: 3, changed.id: 10, added.id: 7})
+        self.assertNotIn(removed.id, self.items())
+        self.assertNoDrift()
+
+    def test_recipe_deleted(self):
+        first, second = self.recipes[:2]
+        for recipe in (first, second):
+            self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        response = self.get_client(second.author).delete(
+            f'/api/recipes/{second.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.items(), {self.ingredients[0].id: 1})
+        self.assertNoDrift()
+
+    def test_check_shopping_lists(self):
+        ingredient = self.ingredients[0]
+        ShoppingListItem.objects.filter(
+            user=self.user, ingredient=ingredient).update(amount=-5)
+        ShoppingListItem.objects.create(
+            user=self.buyer, ingredient=ingredient, amount=2)
+        drift = find_drift()
+        self.assertEqual(set(drift), {(self.user.id, ingredient.id),
+                                      (self.buyer.id, ingredient.id)})
+        self.assertEqual(drift[self.buyer.id, ingredient.id], (2, 0))
+        out = io.StringIO()
+        call_command('check_shopping_lists', dry_run=True, stdout=out)
+        self.assertIn('Расхождений: 2, пользователей: 2.', out.getvalue())
+        self.assertEqual(len(find_drift()), 2)
+        call_command('check_shopping_lists', stdout=io.StringIO())
+        self.assertNoDrift()
+        self.assertEqual(self.items(), {})
+
+
+class FeedTest(RecipeAPITestCase):
+    """Лента подписок: готовые строки FeedItem и авторы, которые
+    читаются при запросе."""
+
+    def setUp(self):
+        self.client = self.get_client(self.user)
+        self.authors = list(User.objects.filter(
+            username__startswith='author').order_by('username'))
+
+    def feed_ids(self, limit=3):
+        """id рецептов ленты, страница за страницей по ссылкам next."""
+        ids = []
+        url = f'/api/recipes/feed/?limit={limit}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.json()['results']]
+            url = response.json()['next']
+        return ids
+
+    def expected_ids(self, *authors):
+        return list(Recipe.objects.filter(author__in=authors).order_by(
+            '-pub', '-id').values_list('id', flat=True))
+
+    def test_feed(self):
+        self.assertEqual(self.feed_ids(), self.expected_ids(self.authors[0]))
+        self.assertEqual(feed.find_drift(), (set(), set()))
+
+    @override_settings(FEED_SYNC_LIMIT=1)
+    def test_follow_backfill(self):
+        author = self.authors[1]
+        response = self.client.post(f'/api/users/{author.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        expected = self.expected_ids(author)
+        self.assertEqual(
+            list(FeedItem.objects.filter(
+                user=self.user, author=author
+            ).values_list('recipe_id', flat=True)), expected[:1])
+        job = Job.objects.get(task='recipes.feed.backfill')
+        self.assertTrue(run_job(job.pk))
+        self.assertEqual(
+            FeedItem.objects.filter(user=self.user, author=author).count(),
+            len(expected))
+        self.assertEqual(self.feed_ids(),
+                         self.expected_ids(self.authors[0], author))
+
+    def test_unfollow(self):
+        author = self.authors[0]
+        response = self.client.delete(f'/api/users/{author.id}/subscribe/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(FeedItem.objects.filter(user=self.user))
+        self.assertEqual(self.feed_ids(), [])
+
+    def test_new_and_deleted_recipe(self):
+        author = self.authors[0]
+        recipe = Recipe.objects.create(
+            author=author, name='Новый', text='Описание', cooking_time=1,
+            image='recipes/images/test.png')
+        self.assertEqual(self.feed_ids()[0], recipe.id)
+        deleted = self.expected_ids(author)[1]
+        response = self.get_client(author).delete(f'/api/recipes/{deleted}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertNotIn(deleted, self.feed_ids())
+        self.assertEqual(self.feed_ids(), self.expected_ids(author))
+
+    def test_on_read_authors(self):
+        fanned_out, on_read = self.authors[:2]
+        Follow.objects.create(user=self.user, author=on_read)
+        with override_settings(FEED_ON_READ_RECIPES=3):
+            # У каждого автора 4 рецепта; первый остаётся в лентах.
+            User.objects.filter(pk=fanned_out.pk).update(recipes_count=0)
+            self.assertEqual(feed.update_on_read_authors(), (2, 0))
+        self.assertFalse(FeedItem.objects.filter(author=on_read))
+        # Одинаковые pub у рецептов обоих источников: порядок и курсор
+        # держатся на id.
+        Recipe.objects.update(pub=self.recipe.pub)
+        FeedItem.objects.update(pub=self.recipe.pub)
+        expected = self.expected_ids(fanned_out, on_read)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/feed/?count=true')
+        self.assertEqual(response.json()['count'], len(expected))
+        if connection.features.supports_slicing_ordering_in_compound:
+            self.assertTrue(any('UNION ALL' in query['sql']
+                                for query in queries))
+        for limit in (1, 2, 3, 100):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.feed_ids(limit), expected)
+
+
+# Вторая база — зеркало основной (TEST MIRROR), как реплики из
+# DB_REPLICA_HOSTS. Псевдоним нужен до создания тестовых баз.
+REPLICA = 'replica_test'
+connections.settings.setdefault(REPLICA, {
+    **connections.settings['default'], 'TEST': {'MIRROR': 'default'}})
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[REPLICA],
+                   REPLICA_PIN_SECONDS=1)
+class ReplicaRoutingTest(TransactionTestCase):
+    """PrimaryReplicaRouter и ReplicaRoutingMiddleware. Зеркало —
+    отдельное подключение, поэтому данные должны быть зафиксированы."""
+
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='reader',
+                                        email='reader@example.com')
+        self.author = User.objects.create(username='author',
+                                          email='author@example.com')
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user)}')
+
+    def request(self, method, url):
+        """Ответ и число запросов к основной базе и к реплике."""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = getattr(self.client, method)(url)
+        return response, primary, replica
+
+    def test_router(self):
+        router = PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Recipe), 'default')
+        token = replica_alias.set(REPLICA)
+        self.addCleanup(replica_alias.reset, token)
+        self.assertEqual(router.db_for_read(Recipe), REPLICA)
+        self.assertEqual(Recipe.objects.all().db, REPLICA)
+        for model in (Token, Job):
+            self.assertEqual(router.db_for_read(model), 'default')
+        self.assertEqual(router.db_for_write(Recipe), 'default')
+        self.assertFalse(router.allow_migrate(REPLICA, 'recipes'))
+        self.assertTrue(router.allow_migrate('default', 'recipes'))
+
+    def test_get_reads_replica(self):
+        response, primary, replica = self.request('get', '/api/users/me/')
+        self.assertEqual(response.json()['username'], 'reader')
+        self.assertTrue(replica)
+        # Токен всегда читается с основной базы.
+        self.assertTrue(primary)
+        self.assertTrue(all('authtoken_token' in query['sql']
+                            for query in primary))
+
+    def test_write_pins_to_primary(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        response, _, replica = self.request('post', url)
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(replica)
+        response, _, replica = self.request('get', '/api/users/subscriptions/')
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertFalse(replica)
+        time.sleep(settings.REPLICA_PIN_SECONDS + 0.1)
+        _, _, replica = self.request('get', '/api/users/subscriptions/')
+        self.assertTrue(replica)
+
+    def test_failed_write_does_not_pin(self):
+        url = f'/api/users/{self.user.id}/subscribe/'
+        response, _, replica = self.request('post', url)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(replica)
+        _, _, replica = self.request('get', '/api/users/me/')
+        self.assertTrue(replica)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'пул подключений psycopg2')
+class ConnectionPoolTest(TestCase):
+    """Пул подключений и проверка подключений foodgram.postgresql."""
+
+    pool = {'MAX_SIZE': 1, 'TIMEOUT': 0.1, 'MAX_IDLE': 60}
+
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.addCleanup(close_pools)
+
+    def make_connection(self, **options):
+        settings_dict = {**connection.settings_dict, **options}
+        # Псевдоним тот же: обработчики connection_created ищут его в
+        # connections. У основного подключения POOL нет, пулом оно не
+        # пользуется.
+        wrapper = type(connections['default'])(settings_dict)
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def terminate(self, wrapper):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)',
+                           [wrapper.connection.get_backend_pid()])
+
+    def select_one(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            return cursor.fetchone()[0]
+
+    def test_pool_reuses_connection(self):
+        wrapper = self.make_connection(POOL=self.pool)
+        wrapper.ensure_connection()
+        raw = wrapper.connection
+        wrapper.close()
+        self.assertEqual(wrapper.pool.stats(), {'size': 1, 'idle': 1})
+        wrapper.ensure_connection()
+        self.assertIs(wrapper.connection, raw)
+        self.assertEqual(wrapper.pool.stats(), {'size': 1, 'idle': 0})
+        self.assertEqual(registry.summary('api_db_connect_seconds')[0], 1)
+        self.assertEqual(registry.summary('api_db_pool_wait_seconds')[0], 2)
+
+    def test_pool_replaces_broken_connection(self):
+        wrapper = self.make_connection(POOL=self.pool,
+                                       CONN_HEALTH_CHECKS=True)
+        wrapper.ensure_connection()
+        raw = wrapper.connection
+        self.terminate(wrapper)
+        wrapper.close()
+        self.assertEqual(self.select_one(wrapper), 1)
+        self.assertIsNot(wrapper.connection, raw)
+        self.assertEqual(registry.summary('api_db_connect_seconds')[0], 2)
+
+    def test_pool_timeout(self):
+        busy = self.make_connection(POOL=self.pool)
+        busy.ensure_connection()
+        waiting = self.make_connection(POOL=self.pool)
+        with self.assertRaises(OperationalError):
+            waiting.ensure_connection()
+        self.assertIn(f'{POOL_TIMEOUTS_METRIC}{{alias="default"}} 1',
+                      registry.export())
+        busy.close()
+        waiting.ensure_connection()
+        count, waited = registry.summary('api_db_pool_wait_seconds')
+        self.assertEqual(count, 2)
+        self.assertLess(waited, self.pool['TIMEOUT'])
+
+    def test_health_check(self):
+        for checks in (True, False):
+            with self.subTest(checks=checks):
+                wrapper = self.make_connection(
+                    CONN_MAX_AGE=None, CONN_HEALTH_CHECKS=checks)
+                wrapper.ensure_connection()
+                self.terminate(wrapper)
+                # Начало следующего HTTP-запроса.
+                wrapper.close_if_unusable_or_obsolete()
+                if checks:
+                    self.assertEqual(self.select_one(wrapper), 1)
+                else:
+                    with self.assertRaises(OperationalError):
+                        self.select_one(wrapper)
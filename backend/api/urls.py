@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework import routers
-from api.views import (CustomUserViewSet, FollowMakeView, FollowViewSet,
-                       IngredientViewSet, TagViewSet, RecipeViewSet)
+from api.views import (CacheStatsView, CustomUserViewSet, FollowMakeView,
+                       FollowViewSet, IngredientViewSet, JobViewSet,
+                       MetricsView, TagViewSet, RecipeViewSet)
 
 app_name = 'api'
 
@@ -12,6 +13,7 @@ router.register('users', CustomUserViewSet)
 router.register('tags', TagViewSet)
 router.register('recipes', RecipeViewSet)
 router.register('ingredients', IngredientViewSet)
+router.register('jobs', JobViewSet)
 
 
 urlpatterns = [
@@ -21,6 +23,8 @@ urlpatterns = [
         'users/<int:user_id>/subscribe/',
         FollowMakeView.as_view(),
         name='subscribe'),
+    path('cache/stats/', CacheStatsView.as_view(), name='cache_stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
 ]
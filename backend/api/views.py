@@ -1,50 +1,151 @@
-from django.db.models import Sum
-from django.shortcuts import HttpResponse, get_object_or_404
+import posixpath
+
+from django.conf import settings
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.http import (FileResponse, Http404, HttpResponse,
+                         StreamingHttpResponse)
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import generics, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
-from .filters import IngredientNameFilter, RecipeFilter
-from .pagination import CustomPagination
-from .serializers import (IngredientSerializer, RecipeSerializer,
-                          RecipeCreateSerializer, RecipeShortSerializer,
+from .async_views import AsyncViewSetMixin
+from .cache import (CachedReadOnlyMixin, get_stats, get_version,
+                    user_namespace)
+from .fast_serializers import (FastIngredientSerializer,
+                               FastRecipeSerializer, FastSerializerMixin,
+                               FastTagSerializer)
+from .filters import POPULAR_NAMESPACE, POPULAR_ORDERING, RecipeFilter
+from .matching import ORDER_COVERAGE, ORDER_MISSING, recipe_ingredient_index
+from .metrics import registry
+from .pagination import (CustomPagination, FeedPagination,
+                         SubscriptionPagination)
+from .renderers import (ShoppingListCSVRenderer, ShoppingListJSONRenderer,
+                        ShoppingListTextRenderer)
+from .search import search_ingredients
+from .serializers import (IngredientSerializer, IngredientImportSerializer,
+                          JobSerializer, RecipeSerializer,
+                          RecipeCreateSerializer, RecipeIdsSerializer,
+                          RecipeShortSerializer,
+                          ShoppingListExportSerializer,
                           TagSerializer, CustomUserSerializer,
-                          CustomUserCreateSerializer, FollowSerializer)
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+                          CustomUserCreateSerializer, FollowSerializer,
+                          get_recipes_limit)
+from .tasks import export_shopping_list, import_ingredients, save_upload
+from jobs.models import Job
+from jobs.queue import enqueue
+from recipes import shopping_list
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from recipes.relations import RecipesNotFound, add_recipes, remove_recipes
 from users.models import Follow, User
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+def job_accepted(request, job):
+    """Ответ 202 со ссылкой на состояние поставленной задачи."""
+    serializer = JobSerializer(job, context={'request': request})
+    return Response(
+        serializer.data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Location': request.build_absolute_uri(
+            reverse('api:job-detail', args=[job.pk]))},
+    )
+
+
+class TagViewSet(AsyncViewSetMixin, CachedReadOnlyMixin,
+                 FastSerializerMixin, viewsets.ReadOnlyModelViewSet):
+    cache_namespace = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    fast_serializer_class = FastTagSerializer
     pagination_class = None
     permission_classes = [AllowAny, ]
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(AsyncViewSetMixin, CachedReadOnlyMixin,
+                        FastSerializerMixin, viewsets.ReadOnlyModelViewSet):
+    cache_namespace = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
+    fast_serializer_class = FastIngredientSerializer
     pagination_class = None
     permission_classes = [AllowAny, ]
-    search_fields = ['^name', ]
-    filter_backends = [IngredientNameFilter, ]
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        return Response(
+            search_ingredients(name, settings.INGREDIENT_SEARCH_LIMIT))
+
+    @action(
+        detail=False,
+        methods=['POST'],
+        url_path='import',
+        permission_classes=[IsAdminUser, ],
+    )
+    def import_file(self, request):
+        """Загружает ингредиенты из файла в фоне. Ответ — задача."""
+        serializer = IngredientImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        file = serializer.validated_data['file']
+        return job_accepted(
+            request, enqueue(import_ingredients, user=request.user,
+                             name=save_upload(file)))
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(AsyncViewSetMixin, CachedReadOnlyMixin,
+                    FastSerializerMixin, ModelViewSet):
+    cache_namespace = 'recipes'
     queryset = Recipe.objects.all()
+    serializer_class = RecipeSerializer
+    fast_serializer_class = FastRecipeSerializer
     pagination_class = CustomPagination
     filter_backends = [DjangoFilterBackend, ]
     filterset_class = RecipeFilter
 
+    def get_cache_versions(self, request):
+        versions = super().get_cache_versions(request)
+        if request.query_params.get('ordering') == 'popular':
+            versions.append(get_version(POPULAR_NAMESPACE))
+        if request.user.is_authenticated:
+            versions.append(get_version(user_namespace(request.user.id)))
+        return versions
+
+    def get_cache_key_parts(self, request):
+        return [request.user.id, *super().get_cache_key_parts(request)]
+
+    def get_keyset_ordering(self, request):
+        if request.query_params.get('ordering') == 'popular':
+            return POPULAR_ORDERING
+        if request.query_params.get('search'):
+            # Результаты поиска упорядочены по релевантности.
+            return None
+        return self.pagination_class.keyset_ordering
+
+    def get_queryset(self):
+        return self.queryset.with_related().with_user_flags(
+            self.request.user)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        user = self.request.user
+        if user.is_authenticated:
+            context['subscriptions'] = set(
+                user.is_subscribed.values_list('author_id', flat=True)
+            )
+        return context
+
     def get_serializer_class(self):
-        if self.request.method == 'GET':
-            return RecipeSerializer
-        return RecipeCreateSerializer
+        if self.request.method != 'GET':
+            return RecipeCreateSerializer
+        return super().get_serializer_class()
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -56,30 +157,23 @@ class RecipeViewSet(ModelViewSet):
     def favorite(self, request, pk):
         recipe_obj = get_object_or_404(Recipe, pk=pk)
         if request.method == 'POST':
-            already_existed, created = Favorite.objects.get_or_create(
-                user=request.user,
-                recipe=recipe_obj
-            )
-            if not created:
+            if not self.add_recipe(Favorite, recipe_obj):
                 return Response(
-                    {'errors': 'Ошибка при создании записи.'},
+                    {'errors': 'Рецепт уже в избранном.'},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
             serializer = RecipeShortSerializer(recipe_obj,
                                                context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if request.method == 'DELETE':
-            favorite = request.user.favorites.all()
-            if favorite:
-                favorite.delete()
-                return Response(
-                    {'message': 'Рецепт удален из избранного.'},
-                    status=status.HTTP_204_NO_CONTENT,
-                )
+        if remove_recipes(Favorite, request.user.id, [recipe_obj.id]):
             return Response(
-                {'errors': 'Рецепт не найден в избранном.'},
-                status=status.HTTP_400_BAD_REQUEST,
+                {'message': 'Рецепт удален из избранного.'},
+                status=status.HTTP_204_NO_CONTENT,
             )
+        return Response(
+            {'errors': 'Рецепт не найден в избранном.'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
     @action(
         detail=True,
@@ -90,45 +184,188 @@ class RecipeViewSet(ModelViewSet):
         user = self.request.user
 
         if request.method == 'POST':
-            ShoppingCart.objects.create(recipe=recipe, user=user)
-            serializer = RecipeSerializer(recipe)
+            if not self.add_recipe(ShoppingCart, recipe):
+                return Response(
+                    {'errors': 'Рецепт уже в списке покупок.'},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            recipe.in_shopping_cart = True
+            serializer = RecipeSerializer(
+                recipe, context=self.get_serializer_context())
             return Response(
                 data=serializer.data,
                 status=status.HTTP_201_CREATED
             )
 
-        obj = get_object_or_404(ShoppingCart, recipe=recipe, user=user)
-        obj.delete()
+        if not remove_recipes(ShoppingCart, user.id, [recipe.id]):
+            return Response(
+                {'errors': 'Рецепта нет в списке покупок.'},
+                status=status.HTTP_404_NOT_FOUND,
+            )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def add_recipe(self, model, recipe):
+        try:
+            return add_recipes(model, self.request.user.id, [recipe.id])
+        except RecipesNotFound:
+            raise Http404
+
+    def bulk_update_relation(self, request, model):
+        """Добавляет (POST) или убирает (DELETE) сразу несколько рецептов.
+
+        Тело запроса: {"recipes": [id, ...]}. В ответе — id рецептов,
+        которые изменились, и тех, что уже были в нужном состоянии.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            try:
+                changed = add_recipes(model, request.user.id, recipe_ids)
+            except RecipesNotFound as error:
+                raise ValidationError({'recipes': [str(error)]})
+            key = 'added'
+        else:
+            changed = remove_recipes(model, request.user.id, recipe_ids)
+            key = 'removed'
+        changed_ids = {instance.recipe_id for instance in changed}
+        return Response({
+            key: [pk for pk in recipe_ids if pk in changed_ids],
+            'skipped': [pk for pk in recipe_ids if pk not in changed_ids],
+        })
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='favorite/bulk',
+    )
+    def favorite_bulk(self, request):
+        return self.bulk_update_relation(request, Favorite)
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='shopping_cart/bulk',
+    )
+    def shopping_cart_bulk(self, request):
+        return self.bulk_update_relation(request, ShoppingCart)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        url_path='cook',
+    )
+    def cook(self, request):
+        """Рецепты, которые можно приготовить из имеющихся ингредиентов."""
+        try:
+            ingredient_ids = {
+                int(value)
+                for param in request.query_params.getlist('ingredients')
+                for value in param.split(',') if value
+            }
+            limit = min(
+                int(request.query_params.get(
+                    'limit', settings.RECIPE_MATCH_LIMIT)),
+                settings.RECIPE_MATCH_MAX_LIMIT
+            )
+        except ValueError:
+            return Response(
+                {'errors': 'Параметры ingredients и limit — целые числа.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if limit < 1:
+            return Response(
+                {'errors': 'limit должен быть не меньше 1.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if ingredient_ids and (
+                min(ingredient_ids) < 1
+                or Ingredient.objects.filter(
+                    id__in=ingredient_ids).count() != len(ingredient_ids)):
+            return Response(
+                {'errors': 'Неизвестные ингредиенты.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        order = request.query_params.get('order', ORDER_COVERAGE)
+        if order not in (ORDER_COVERAGE, ORDER_MISSING):
+            return Response(
+                {'errors': 'order может быть coverage или missing.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        matches = recipe_ingredient_index.search(
+            ingredient_ids, order, limit) if ingredient_ids else []
+        recipes = Recipe.objects.in_bulk(
+            [recipe_id for recipe_id, _, _ in matches])
+        data = []
+        for recipe_id, coverage, missing in matches:
+            if recipe_id not in recipes:
+                continue
+            item = RecipeShortSerializer(
+                recipes[recipe_id], context={'request': request}).data
+            item['coverage'] = round(coverage, 4)
+            item['missing'] = missing
+            data.append(item)
+        return Response(data)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        permission_classes=[IsAuthenticated, ],
+    )
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь, новые
+        сверху. Страницы — по курсору (?cursor=, ?limit=, ?count=true).
+
+        Ленты хранятся готовыми (recipes.feed), поэтому страница — это
+        чтение по индексу FeedItem (и по рецептам самых популярных
+        авторов) и загрузка самих рецептов по id.
+        """
+        paginator = FeedPagination()
+        items = paginator.paginate_feed(request.user.id, request)
+        recipes = self.get_queryset().in_bulk(
+            [item.recipe_id for item in items])
+        serializer = self.get_serializer(
+            [recipes[item.recipe_id] for item in items
+             if item.recipe_id in recipes],
+            many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     @action(
         detail=False,
         methods=['GET'],
         url_path='download_shopping_cart',
-        permission_classes=[IsAuthenticated, ]
+        permission_classes=[IsAuthenticated, ],
+        renderer_classes=[ShoppingListTextRenderer,
+                          ShoppingListCSVRenderer,
+                          ShoppingListJSONRenderer, ]
     )
     def download_shopping_cart(self, request):
-        ingredient_list = "Cписок покупок:"
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__is_in_shopping_cart__user=request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(amount_sum=Sum('amount'))
-        for num, i in enumerate(ingredients):
-            ingredient_list += (
-                f"\n{i['ingredient__name']} - "
-                f"{i['amount_sum']} {i['ingredient__measurement_unit']}"
-            )
-            if num < ingredients.count() - 1:
-                ingredient_list += ', '
-        file = 'shopping_list'
-        response = HttpResponse(
-            ingredient_list,
-            'Content-Type: application/txt'
+        ingredients = shopping_list.export_rows(request.user.id)
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
         )
-        response['Content-Disposition'] = f'attachment; filename="{file}.txt"'
+        file = f'shopping_list.{renderer.format}'
+        response['Content-Disposition'] = f'attachment; filename="{file}"'
         return response
 
+    @action(
+        detail=False,
+        methods=['POST'],
+        url_path='download_shopping_cart/export',
+        permission_classes=[IsAuthenticated, ],
+    )
+    def export_shopping_cart(self, request):
+        """Готовит файл списка покупок в фоне. Ответ — задача, файл
+        потом скачивается по ссылке download."""
+        serializer = ShoppingListExportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return job_accepted(
+            request, enqueue(export_shopping_list, user=request.user,
+                             user_id=request.user.id,
+                             format=serializer.validated_data['format']))
+
 
 class CustomUserViewSet(UserViewSet):
     serializer_class = CustomUserSerializer
@@ -145,9 +382,28 @@ class FollowViewSet(viewsets.ModelViewSet):
     queryset = Follow.objects.all()
     serializer_class = FollowSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = SubscriptionPagination
 
     def get_queryset(self):
-        return self.queryset.filter(user=self.request.user)
+        # Тот же порядок, что в подзапросе: при равных pub — по id.
+        recipes = Recipe.objects.order_by('-pub', '-id')
+        limit = get_recipes_limit(self.request)
+        if limit:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).order_by('-pub', '-id').values('pk')[:limit]
+            ))
+        return self.queryset.filter(
+            user=self.request.user
+        ).select_related(
+            'author'
+        ).order_by(
+            '-author_id'
+        ).prefetch_related(
+            Prefetch('author__recipes', queryset=recipes,
+                     to_attr='recipes_preview')
+        )
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -156,11 +412,7 @@ class FollowViewSet(viewsets.ModelViewSet):
         methods=['GET'],
         detail=False,)
     def subscriptions(self, request):
-        subscriptions = self.get_queryset().select_related('following')
-        serializer = FollowSerializer(subscriptions,
-                                      many=True,
-                                      context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.list(request)
 
 
 class FollowMakeView(generics.RetrieveDestroyAPIView,
@@ -192,3 +444,57 @@ class FollowMakeView(generics.RetrieveDestroyAPIView,
 
     def perform_destroy(self, instance):
         self.request.user.is_subscribed.filter(author=instance).delete()
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Фоновые задачи пользователя; администратор видит все."""
+
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return self.queryset
+        return self.queryset.filter(user=self.request.user)
+
+    @action(detail=True, methods=['GET'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if not job.file:
+            if job.done:
+                return Response(
+                    {'errors': 'У задачи нет файла.'},
+                    status=status.HTTP_404_NOT_FOUND,
+                )
+            return Response(
+                {'errors': 'Задача ещё не выполнена.'},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return FileResponse(
+            job.file.open('rb'), as_attachment=True,
+            filename=posixpath.basename(job.file.name))
+
+
+class MetricsView(APIView):
+    """Метрики запросов в формате Prometheus, только с адресов
+    METRICS_ALLOWED_IPS."""
+
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(
+            registry.export(),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class CacheStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(get_stats([
+            viewset.cache_namespace
+            for viewset in (TagViewSet, IngredientViewSet, RecipeViewSet)
+        ]))
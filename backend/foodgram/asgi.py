@@ -3,6 +3,11 @@ ASGI config for foodgram project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Under ASGI the recipe, ingredient and tag endpoints are served by the
+async views from ``api.async_views``. Run with uvicorn workers::
+
+    gunicorn foodgram.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 """
@@ -12,5 +17,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+os.environ.setdefault('API_ASYNC_VIEWS', 'true')
 
 application = get_asgi_application()
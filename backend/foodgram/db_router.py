@@ -0,0 +1,39 @@
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS
+
+# Реплика, с которой читает текущий запрос; None — читать с основной
+# базы. Выставляет api.middleware.ReplicaRoutingMiddleware.
+replica_alias = ContextVar('replica_alias', default=None)
+
+# Эти модели всегда читаются с основной базы: только что выданный токен,
+# сессия или состояние фоновой задачи могут ещё не дойти до реплики.
+PRIMARY_ONLY_MODELS = {'authtoken.token', 'sessions.session', 'jobs.job'}
+
+
+def using_replica():
+    return replica_alias.get() is not None
+
+
+class PrimaryReplicaRouter:
+    """Чтение с реплик в безопасных запросах, запись в основную базу.
+
+    Все базы содержат одни и те же данные, поэтому связи между
+    объектами из разных баз разрешены, а миграции применяются только к
+    основной базе.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = replica_alias.get()
+        if alias is None or model._meta.label_lower in PRIMARY_ONLY_MODELS:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
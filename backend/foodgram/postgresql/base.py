@@ -0,0 +1,89 @@
+import time
+
+from django.db.backends.postgresql import base
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from api.metrics import registry
+
+from .pool import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с проверкой подключений и необязательным пулом.
+
+    Дополнительные ключи настроек базы:
+
+    CONN_HEALTH_CHECKS — перед первым запросом каждого HTTP-запроса
+    постоянное подключение проверяется запросом SELECT 1 и при обрыве
+    открывается заново (как в Django 4.1).
+    POOL — словарь MAX_SIZE, TIMEOUT, MAX_IDLE: подключения берутся из
+    пула процесса и возвращаются в него вместо закрытия. Django 3.2 не
+    работает с psycopg 3, поэтому пул свой, на psycopg2.
+
+    Время установки подключений и ожидания пула уходит в api.metrics.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_pending = False
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def connect_timed(self, conn_params):
+        start = time.perf_counter()
+        connection = super().get_new_connection(conn_params)
+        registry.observe('api_db_connect_seconds', {'alias': self.alias},
+                         time.perf_counter() - start)
+        return connection
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return self.connect_timed(conn_params)
+        connection, waited = pool.acquire(
+            lambda: self.connect_timed(conn_params))
+        registry.observe('api_db_pool_wait_seconds', {'alias': self.alias},
+                         waited)
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        connection = self.connection
+        try:
+            with self.wrap_database_errors:
+                if connection.closed:
+                    # Оборванное сервером подключение пул просто забудет.
+                    pass
+                elif self.in_atomic_block:
+                    # Django будет откатывать транзакцию на этом
+                    # подключении, в пул его возвращать нельзя.
+                    connection.close()
+                elif connection.get_transaction_status() != (
+                        TRANSACTION_STATUS_IDLE):
+                    connection.rollback()
+        except Exception:
+            connection.close()
+            raise
+        finally:
+            pool.release(connection)
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # Проверяем не сейчас, а перед первым запросом к базе.
+        self.health_check_pending = self.connection is not None
+
+    def ensure_connection(self):
+        if self.health_check_pending:
+            self.health_check_pending = False
+            if (self.settings_dict.get('CONN_HEALTH_CHECKS')
+                    and self.connection is not None
+                    and not self.in_atomic_block
+                    and not self.is_usable()):
+                self.close()
+        super().ensure_connection()
@@ -0,0 +1,142 @@
+import os
+import time
+from collections import deque
+from threading import Condition, Lock
+
+import psycopg2
+
+from api.metrics import POOL_TIMEOUTS_METRIC, registry
+
+_pools = {}
+_pools_lock = Lock()
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+def is_usable(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except psycopg2.Error:
+        return False
+    return True
+
+
+class ConnectionPool:
+    """Пул подключений psycopg2 внутри одного процесса.
+
+    Открывает не больше max_size подключений. Если все заняты, acquire
+    ждёт освободившееся до timeout секунд. Подключения, простоявшие
+    без дела дольше max_idle секунд, закрываются: сервер или
+    балансировщик мог уже оборвать их. При check перед выдачей
+    подключение проверяется запросом SELECT 1.
+    """
+
+    def __init__(self, alias, max_size, timeout, max_idle, check):
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check = check
+        self._idle = deque()
+        self._size = 0
+        self._condition = Condition()
+
+    def acquire(self, connect):
+        """Подключение из пула или новое (через connect) и время
+        ожидания в секундах."""
+        start = time.monotonic()
+        while True:
+            connection = self._take(start + self.timeout)
+            if connection is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    self._forget()
+                    raise
+            elif self.check and not is_usable(connection):
+                connection.close()
+                self._forget()
+                continue
+            return connection, time.monotonic() - start
+
+    def release(self, connection):
+        with self._condition:
+            if connection.closed:
+                self._size -= 1
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def _take(self, deadline):
+        """Свободное подключение; None — можно открыть новое."""
+        with self._condition:
+            while True:
+                while self._idle:
+                    connection, released = self._idle.pop()
+                    if (not connection.closed
+                            and time.monotonic() - released < self.max_idle):
+                        return connection
+                    connection.close()
+                    self._size -= 1
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    registry.increment(
+                        POOL_TIMEOUTS_METRIC, {'alias': self.alias})
+                    raise PoolTimeout(
+                        f'Нет свободного подключения к {self.alias} '
+                        f'за {self.timeout} с: все {self.max_size} заняты.')
+                self._condition.wait(remaining)
+
+    def _forget(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {'size': self._size, 'idle': len(self._idle)}
+
+
+def get_pool(alias, settings_dict):
+    """Пул подключений базы alias в текущем процессе или None, если
+    POOL не задан.
+
+    Пулы привязаны к pid: после fork воркер создаёт свой.
+    """
+    options = settings_dict.get('POOL')
+    if not options:
+        return None
+    key = (os.getpid(), alias)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(
+                alias,
+                max_size=options.get('MAX_SIZE', 10),
+                timeout=options.get('TIMEOUT', 5),
+                max_idle=options.get('MAX_IDLE', 300),
+                check=settings_dict.get('CONN_HEALTH_CHECKS', False),
+            )
+    return pool
+
+
+def close_pools():
+    """Закрывает свободные подключения всех пулов процесса и забывает
+    пулы."""
+    with _pools_lock:
+        pools = [
+            pool for (pid, _), pool in _pools.items()
+            if pid == os.getpid()
+        ]
+        _pools.clear()
+    for pool in pools:
+        with pool._condition:
+            while pool._idle:
+                pool._idle.pop()[0].close()
+                pool._size -= 1
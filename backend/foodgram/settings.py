@@ -20,15 +20,19 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
     'django_filters',
     'recipes',
     'api',
-    'users']
+    'users',
+    'jobs']
 
 MIDDLEWARE = [
+    'api.middleware.QueryMetricsMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,14 +64,41 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'foodgram.postgresql',
         'NAME': os.getenv('POSTGRES_DB', 'foodgram'),
         'USER': os.getenv('POSTGRES_USER', 'foodgram_user'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        # Сколько секунд держать подключение между запросами.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        # Проверять постоянное подключение перед первым запросом к базе.
+        'CONN_HEALTH_CHECKS': str(
+            os.getenv('DB_CONN_HEALTH_CHECKS', True)).lower() == 'true',
     }
 }
+# Пул подключений в каждом процессе (foodgram.postgresql.pool). С пулом
+# подключение возвращается в него после каждого запроса.
+if str(os.getenv('DB_POOL', False)).lower() == 'true':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['POOL'] = {
+        'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+        'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 5)),
+        'MAX_IDLE': int(os.getenv('DB_POOL_MAX_IDLE', 300)),
+    }
+# Реплики только для чтения (foodgram.db_router): хосты через ', '.
+for number, host in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(', ')), 1):
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['foodgram.db_router.PrimaryReplicaRouter']
+# Сколько секунд после своего изменения клиент читает с основной базы.
+# Должно быть больше обычной задержки репликации.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
 
 AUTH_USER_MODEL = 'users.User'
 AUTH_PASSWORD_VALIDATORS = [
@@ -103,6 +134,15 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 DJOSER = {
     'LOGIN_FIELD': 'email',
@@ -117,6 +157,94 @@ DJOSER = {
         'user_list': ('rest_framework.permissions.AllowAny',)
     }
 }
+# Для нескольких воркеров нужен общий кэш, например
+# django.core.cache.backends.filebased.FileBasedCache или
+# django_redis.cache.RedisCache с адресом сервера в CACHE_LOCATION.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+API_CACHE_TIMEOUT = int(os.getenv('API_CACHE_TIMEOUT', 24 * 60 * 60))
+# Сколько секунд хранится ?count=true в режиме ?pagination=cursor.
+KEYSET_COUNT_TIMEOUT = int(os.getenv('KEYSET_COUNT_TIMEOUT', 60))
+
+# Поиск ингредиентов по началу названия (?name=).
+INGREDIENT_SEARCH_CACHE = str(
+    os.getenv('INGREDIENT_SEARCH_CACHE', True)).lower() == 'true'
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+# Метрики запросов (api.middleware.QueryMetricsMiddleware).
+API_METRICS = str(os.getenv('API_METRICS', True)).lower() == 'true'
+API_SERVER_TIMING = str(
+    os.getenv('API_SERVER_TIMING', True)).lower() == 'true'
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 5))
+METRICS_ALLOWED_IPS = os.getenv(
+    'METRICS_ALLOWED_IPS', '127.0.0.1, ::1').split(', ')
+
+# Сериализация ответов list и retrieve без полей DRF
+# (api.fast_serializers), вывод тот же.
+API_FAST_SERIALIZERS = str(
+    os.getenv('API_FAST_SERIALIZERS', True)).lower() == 'true'
+
+# Асинхронные представления рецептов, ингредиентов и тегов
+# (api.async_views). Включаются в foodgram/asgi.py; ASYNC_DB_THREADS —
+# потоков для запросов к базе в каждом процессе.
+API_ASYNC_VIEWS = str(os.getenv('API_ASYNC_VIEWS', False)).lower() == 'true'
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', 10))
+
+# Сколько рецептов можно добавить или убрать одним запросом
+# (/api/recipes/favorite/bulk/, /api/recipes/shopping_cart/bulk/).
+BULK_RECIPES_LIMIT = 100
+
+# Подбор рецептов по имеющимся ингредиентам (/api/recipes/cook/).
+RECIPE_MATCH_INDEX_TTL = int(os.getenv('RECIPE_MATCH_INDEX_TTL', 300))
+RECIPE_MATCH_USE_NUMPY = True
+RECIPE_MATCH_LIMIT = 20
+RECIPE_MATCH_MAX_LIMIT = 100
+
+# Полнотекстовый поиск рецептов (?search=).
+SEARCH_CONFIG = 'russian'
+SEARCH_TRIGRAM_THRESHOLD = 0.3
+
+# Лента подписок (recipes.feed). Новый рецепт автора, у которого не
+# больше FEED_SYNC_LIMIT подписчиков, раскладывается по лентам сразу, у
+# остальных — фоновой задачей. При подписке столько же последних
+# рецептов автора попадают в ленту сразу, более старые — в фоне.
+# Рецепты авторов, у которых больше FEED_ON_READ_FOLLOWERS подписчиков
+# или больше FEED_ON_READ_RECIPES рецептов, в ленты не раскладываются,
+# а читаются при запросе страницы (manage.py check_feeds пересматривает
+# этот список по счётчикам).
+FEED_SYNC_LIMIT = int(os.getenv('FEED_SYNC_LIMIT', 200))
+FEED_ON_READ_FOLLOWERS = int(os.getenv('FEED_ON_READ_FOLLOWERS', 5000))
+FEED_ON_READ_RECIPES = int(os.getenv('FEED_ON_READ_RECIPES', 500))
+FEED_BATCH_SIZE = 1000
+FEED_PAGE_SIZE = 10
+FEED_MAX_PAGE_SIZE = 100
+
+# Уменьшенные копии картинок рецептов.
+THUMBNAIL_WIDTHS = [320, 640, 1280]
+THUMBNAIL_FORMATS = ['WEBP', 'JPEG']
+THUMBNAIL_QUALITY = 80
+IMAGE_MAX_PIXELS = 40_000_000
+
+# Фоновые задачи (jobs.queue). JOBS_BACKEND: thread — пул потоков
+# процесса, database — только запись в очередь, выполняет
+# manage.py run_jobs, immediate — сразу после фиксации транзакции.
+JOBS_BACKEND = os.getenv('JOBS_BACKEND', 'thread')
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 2))
+JOBS_MAX_ATTEMPTS = 3
+# Пауза перед повторной попыткой, секунды; удваивается с каждой.
+JOBS_RETRY_DELAY = 5
+# Задача, которая выполняется дольше, считается потерянной.
+JOBS_TIMEOUT = 30 * 60
+JOBS_POLL_INTERVAL = 1
+JOBS_KEEP_DAYS = 7
+INGREDIENT_IMPORT_MAX_SIZE = 20 * 1024 * 1024
+
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 # STATIC_ROOT = os.path.join(BASE_DIR, 'collected_static')
@@ -124,3 +252,8 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Файлы фоновых задач (выгрузки списков покупок, загрузки ингредиентов)
+# лежат вне MEDIA_ROOT: nginx их не раздаёт, скачать файл можно только
+# через /api/jobs/<id>/download/ с проверкой владельца.
+JOBS_FILES_ROOT = os.getenv(
+    'JOBS_FILES_ROOT', os.path.join(BASE_DIR, 'jobs_files'))
@@ -0,0 +1,18 @@
+from django.contrib import admin
+
+from jobs.models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'task',
+        'user',
+        'status',
+        'attempts',
+        'created',
+        'finished',
+    )
+    list_filter = ('status', 'task')
+    readonly_fields = ('started', 'finished', 'created')
@@ -0,0 +1,47 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from jobs.queue import purge, run_job
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из таблицы jobs_job. Нужен при '
+            'JOBS_BACKEND = database, а при остальных бэкендах '
+            'подбирает повторные попытки и задачи, потерянные при '
+            'перезапуске процессов. Обработчиков можно запускать '
+            'несколько: одну задачу получит только один из них.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить готовые задачи и выйти.')
+        parser.add_argument(
+            '--sleep', type=float, default=settings.JOBS_POLL_INTERVAL,
+            help='Пауза между проверками пустой очереди, секунды.')
+        parser.add_argument(
+            '--purge', action='store_true',
+            help='Удалить задачи, завершённые больше JOBS_KEEP_DAYS дней '
+                 'назад, вместе с файлами и выйти.')
+
+    def handle(self, *args, **options):
+        if options['purge']:
+            deleted = purge(settings.JOBS_KEEP_DAYS)
+            self.stdout.write(self.style.SUCCESS(
+                f'Удалено задач: {deleted}.'))
+            return
+        done = 0
+        try:
+            while True:
+                close_old_connections()
+                if run_job():
+                    done += 1
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {done}.'))
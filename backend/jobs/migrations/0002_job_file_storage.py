@@ -0,0 +1,19 @@
+# Generated by Django 3.2.16 on 2026-10-18 14:23
+
+from django.db import migrations, models
+import jobs.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='file',
+            field=models.FileField(blank=True, storage=jobs.storage.JobFileStorage(), upload_to='results/', verbose_name='Файл'),
+        ),
+    ]
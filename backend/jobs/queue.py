@@ -0,0 +1,189 @@
+import logging
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from threading import Lock, Timer
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from api.metrics import JOB_DURATION_METRIC, JOBS_METRIC, registry
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+# Где выполняются задачи (settings.JOBS_BACKEND).
+IMMEDIATE = 'immediate'
+THREAD = 'thread'
+DATABASE = 'database'
+BACKENDS = (IMMEDIATE, THREAD, DATABASE)
+
+_executor = None
+_executor_lock = Lock()
+
+
+class JobError(Exception):
+    """Ошибка, после которой повторять задачу бессмысленно."""
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.JOBS_WORKERS,
+                thread_name_prefix='jobs',
+            )
+    return _executor
+
+
+def task_path(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *, user=None, max_attempts=None, **kwargs):
+    """Ставит вызов func(**kwargs) в очередь и возвращает Job.
+
+    Аргументы хранятся в JSON, поэтому передавайте id, а не объекты.
+    Задача запускается после фиксации текущей транзакции; если
+    транзакция откатится, вместе с ней пропадёт и задача.
+    """
+    job = Job.objects.create(
+        task=task_path(func),
+        args=kwargs,
+        user=user,
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+    )
+    transaction.on_commit(lambda: dispatch(job.pk))
+    return job
+
+
+def dispatch(job_id, delay=0):
+    """Запускает задачу так, как велит JOBS_BACKEND.
+
+    При DATABASE ничего не делает: задачу заберёт manage.py run_jobs.
+    При IMMEDIATE повторные попытки тоже остаются ему: ждать их в
+    потоке запроса нельзя.
+    """
+    backend = settings.JOBS_BACKEND
+    if backend == IMMEDIATE:
+        if not delay:
+            run_job(job_id)
+    elif backend == THREAD:
+        if delay:
+            timer = Timer(delay, dispatch, [job_id])
+            timer.daemon = True
+            timer.start()
+        else:
+            get_executor().submit(run_in_worker, job_id)
+
+
+def claim(job_id=None):
+    """Забирает готовую к запуску задачу и помечает её выполняемой.
+
+    Задачи, которые выполняются дольше JOBS_TIMEOUT, считаются
+    потерянными (процесс упал) и тоже забираются. Строки блокируются с
+    SKIP LOCKED, поэтому несколько обработчиков не получат одну задачу.
+    """
+    now = timezone.now()
+    ready = Q(status=Job.PENDING, run_after__lte=now) | Q(
+        status=Job.RUNNING,
+        started__lt=now - timedelta(seconds=settings.JOBS_TIMEOUT))
+    with transaction.atomic():
+        jobs = Job.objects.select_for_update(skip_locked=True).filter(ready)
+        if job_id is not None:
+            jobs = jobs.filter(pk=job_id)
+        job = jobs.order_by('run_after', 'pk').first()
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.started = now
+        job.save(update_fields=['status', 'attempts', 'started'])
+    return job
+
+
+def execute(job):
+    """Выполняет забранную задачу и сохраняет итог.
+
+    Возвращает задержку в секундах до повторной попытки или None, если
+    повторять не нужно.
+    """
+    start = time.perf_counter()
+    try:
+        result = import_string(job.task)(**job.args)
+    except Exception as error:
+        logger.exception('Задача %s завершилась с ошибкой', job)
+        if isinstance(error, JobError):
+            job.error = str(error)
+        else:
+            job.error = ''.join(traceback.format_exception_only(
+                type(error), error)).strip()
+        if (not isinstance(error, JobError)
+                and job.attempts < job.max_attempts):
+            delay = settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=delay)
+        else:
+            delay = None
+            job.status = Job.FAILED
+            job.finished = timezone.now()
+    else:
+        delay = None
+        if isinstance(result, File):
+            # Случайная папка у каждой задачи: имя файла не меняется и
+            # не угадывается по номеру задачи.
+            job.file.save(f'{uuid4().hex}/{result.name}', result,
+                          save=False)
+        else:
+            job.result = result
+        job.status = Job.SUCCESS
+        job.error = ''
+        job.finished = timezone.now()
+    job.save(update_fields=[
+        'status', 'run_after', 'result', 'file', 'error', 'finished'])
+    labels = {'task': job.task}
+    registry.observe(
+        JOB_DURATION_METRIC, labels, time.perf_counter() - start)
+    registry.increment(JOBS_METRIC, {**labels, 'status': job.status})
+    return delay
+
+
+def run_job(job_id=None):
+    """Забирает и выполняет задачу. False — готовой задачи нет."""
+    job = claim(job_id)
+    if job is None:
+        return False
+    delay = execute(job)
+    if delay is not None:
+        dispatch(job.pk, delay)
+    return True
+
+
+def run_in_worker(job_id):
+    # Потоки пула живут долго: подключения к базе закрываются по тем же
+    # правилам, что и в конце HTTP-запроса.
+    close_old_connections()
+    try:
+        run_job(job_id)
+    except Exception:
+        logger.exception('Не удалось выполнить задачу %s', job_id)
+    finally:
+        close_old_connections()
+
+
+def purge(days):
+    """Удаляет завершённые задачи старше days дней вместе с файлами."""
+    jobs = Job.objects.filter(
+        status__in=(Job.SUCCESS, Job.FAILED),
+        finished__lt=timezone.now() - timedelta(days=days),
+    )
+    for job in jobs.exclude(file='').iterator():
+        job.file.delete(save=False)
+    return jobs.delete()[0]
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.functional import cached_property
+
+
+class JobFileStorage(FileSystemStorage):
+    """Файлы задач в JOBS_FILES_ROOT, у которых нет публичного адреса."""
+
+    @cached_property
+    def base_location(self):
+        return settings.JOBS_FILES_ROOT
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'JOBS_FILES_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+
+
+job_storage = JobFileStorage()
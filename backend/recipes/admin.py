@@ -29,12 +29,16 @@ class RecipeAdmin(admin.ModelAdmin):
         'text',
         'cooking_time',
         'pub',
+        'favorites_count',
+        'shopping_cart_count',
     )
     fields = (
         ('name', 'author', 'cooking_time',),
         ('text', 'tags',),
         ('image',),
+        ('favorites_count', 'shopping_cart_count',),
     )
+    readonly_fields = ('favorites_count', 'shopping_cart_count',)
     list_editable = ('author',)
     search_fields = ('author__username', 'name',)
     list_filter = ('author', 'name', 'tags',)
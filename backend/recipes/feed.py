@@ -0,0 +1,207 @@
+from collections import namedtuple
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q, Sum
+
+from jobs.queue import enqueue
+from recipes.models import FeedItem, Recipe
+from users.models import Follow, User
+
+# Строка ленты; по этим полям строится курсор.
+FeedRow = namedtuple('FeedRow', ['pub', 'recipe_id'])
+
+
+def on_read_condition():
+    """Авторы, чьи рецепты не раскладываются по лентам, а читаются при
+    запросе: у них слишком много подписчиков (каждый рецепт — столько же
+    строк) или рецептов (каждая подписка — столько же строк)."""
+    return (Q(followers_count__gt=settings.FEED_ON_READ_FOLLOWERS)
+            | Q(recipes_count__gt=settings.FEED_ON_READ_RECIPES))
+
+
+def insert(rows):
+    """Добавляет строки лент: (читатель, автор, рецепт, дата
+    публикации). Уже существующие пропускаются. Возвращает число
+    переданных строк."""
+    rows = iter(rows)
+    total = 0
+    while True:
+        batch = [
+            FeedItem(user_id=user_id, author_id=author_id,
+                     recipe_id=recipe_id, pub=pub)
+            for user_id, author_id, recipe_id, pub in islice(
+                rows, settings.FEED_BATCH_SIZE)
+        ]
+        if not batch:
+            return total
+        FeedItem.objects.bulk_create(batch, ignore_conflicts=True)
+        total += len(batch)
+
+
+def fan_out(recipe_id):
+    """Добавляет рецепт в ленты всех подписчиков автора."""
+    recipe = Recipe.objects.filter(
+        pk=recipe_id, author__feed_on_read=False
+    ).values_list('author_id', 'pub').first()
+    if recipe is None:
+        return None
+    author_id, pub = recipe
+    followers = Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True).order_by()
+    return {'followers': insert(
+        (user_id, author_id, recipe_id, pub)
+        for user_id in followers.iterator()
+    )}
+
+
+def add_recipe(recipe):
+    """Публикация рецепта. Если у автора не больше FEED_SYNC_LIMIT
+    подписчиков, рецепт раскладывается по лентам сразу, иначе —
+    фоновой задачей."""
+    author = User.objects.filter(pk=recipe.author_id).values(
+        'followers_count', 'feed_on_read').first()
+    if not author or author['feed_on_read'] or not author[
+            'followers_count']:
+        return
+    if author['followers_count'] <= settings.FEED_SYNC_LIMIT:
+        fan_out(recipe.id)
+    else:
+        enqueue(fan_out, recipe_id=recipe.id)
+
+
+def author_recipes(author_id):
+    return Recipe.objects.filter(
+        author_id=author_id, author__feed_on_read=False
+    ).order_by('-pub', '-id').values_list('id', 'pub')
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту читателя все рецепты автора, если подписка ещё
+    есть."""
+    if not Follow.objects.filter(user_id=user_id,
+                                 author_id=author_id).exists():
+        return None
+    return {'recipes': insert(
+        (user_id, author_id, recipe_id, pub)
+        for recipe_id, pub in author_recipes(author_id).iterator()
+    )}
+
+
+def add_author(user_id, author_id):
+    """Подписка: последние FEED_SYNC_LIMIT рецептов автора попадают в
+    ленту сразу, более старые — фоновой задачей."""
+    limit = settings.FEED_SYNC_LIMIT
+    recipes = list(author_recipes(author_id)[:limit + 1])
+    insert(
+        (user_id, author_id, recipe_id, pub)
+        for recipe_id, pub in recipes[:limit]
+    )
+    if len(recipes) > limit:
+        enqueue(backfill, user_id=user_id, author_id=author_id)
+
+
+def remove_author(user_id, author_id):
+    FeedItem.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def after(position, id_field):
+    """Условие «строка дальше position» при порядке -pub, -id."""
+    pub, pk = position
+    return Q(pub__lt=pub) | Q(pub=pub, **{f'{id_field}__lt': pk})
+
+
+def page(user_id, position, limit):
+    """До limit строк ленты после position (FeedRow), новые сверху.
+
+    Готовые строки FeedItem и рецепты авторов, которые читаются при
+    запросе, выбираются одним запросом UNION ALL, если база это умеет.
+    """
+    items = FeedItem.objects.filter(user_id=user_id)
+    if position is not None:
+        items = items.filter(after(position, 'recipe_id'))
+    items = items.order_by('-pub', '-recipe_id').values_list(
+        'pub', 'recipe_id')[:limit]
+    # Таких авторов единицы (индекс user_feed_on_read_idx): сначала
+    # находим их, а не перебираем все подписки читателя.
+    author_ids = list(User.objects.filter(
+        feed_on_read=True, following__user_id=user_id
+    ).values_list('id', flat=True))
+    if not author_ids:
+        return [FeedRow(*row) for row in items]
+    recipes = Recipe.objects.filter(author_id__in=author_ids)
+    if position is not None:
+        recipes = recipes.filter(after(position, 'id'))
+    recipes = recipes.order_by('-pub', '-id').values_list('pub', 'id')[:limit]
+    if connections[items.db].features.supports_slicing_ordering_in_compound:
+        rows = items.union(recipes, all=True).order_by('-pub', '-recipe_id')
+    else:
+        rows = sorted([*items, *recipes], reverse=True)
+    return [FeedRow(*row) for row in rows[:limit]]
+
+
+def on_read_count(user_id):
+    """Сколько рецептов в ленте от авторов, которые читаются при
+    запросе."""
+    return User.objects.filter(
+        following__user_id=user_id, feed_on_read=True
+    ).aggregate(total=Sum('recipes_count'))['total'] or 0
+
+
+def expected_rows(user_ids=None, author_ids=None):
+    """Строки лент, посчитанные заново по подпискам, в порядке
+    аргумента insert."""
+    follows = Follow.objects.filter(
+        author__feed_on_read=False, author__recipes__isnull=False)
+    if user_ids is not None:
+        follows = follows.filter(user_id__in=user_ids)
+    if author_ids is not None:
+        follows = follows.filter(author_id__in=author_ids)
+    return follows.values_list(
+        'user_id', 'author_id', 'author__recipes__id', 'author__recipes__pub'
+    ).order_by().iterator()
+
+
+@transaction.atomic
+def update_on_read_authors():
+    """Переводит авторов между раскладкой по лентам и чтением при
+    запросе по текущим счётчикам и переносит их строки лент.
+
+    Возвращает, сколько авторов переведено в каждую сторону.
+    """
+    condition = on_read_condition()
+    to_read = list(User.objects.filter(
+        condition, feed_on_read=False).values_list('id', flat=True))
+    to_fan_out = list(User.objects.filter(
+        ~condition, feed_on_read=True).values_list('id', flat=True))
+    User.objects.filter(pk__in=to_read).update(feed_on_read=True)
+    User.objects.filter(pk__in=to_fan_out).update(feed_on_read=False)
+    FeedItem.objects.filter(author_id__in=to_read).delete()
+    insert(expected_rows(author_ids=to_fan_out))
+    return len(to_read), len(to_fan_out)
+
+
+def find_drift(user_ids=None):
+    """Лишние и недостающие строки лент: два множества пар
+    (читатель, рецепт)."""
+    expected = {
+        (user_id, recipe_id)
+        for user_id, _, recipe_id, _ in expected_rows(user_ids)
+    }
+    items = FeedItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    actual = set(items.values_list('user_id', 'recipe_id').iterator())
+    return actual - expected, expected - actual
+
+
+@transaction.atomic
+def rebuild(user_ids=None):
+    """Пересоздаёт ленты по подпискам."""
+    items = FeedItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    items.delete()
+    insert(expected_rows(user_ids))
@@ -0,0 +1,140 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import (Case, Exists, F, FloatField, Max, Min,
+                              OuterRef, Q, Subquery, TextField, Value, When)
+from django.db.models.functions import Coalesce
+
+from recipes.models import Recipe, RecipeIngredient
+
+FTS_TABLE = 'recipes_recipe_fts'
+WORD_RE = re.compile(r'\w+')
+REBUILD_BATCH_SIZE = 10000
+SQLITE_INSERT = f"""
+    INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients)
+    SELECT recipe.id, recipe.name, recipe.text, coalesce((
+        SELECT group_concat(ingredient.name, ' ')
+        FROM recipes_recipeingredient AS amount
+        JOIN recipes_ingredient AS ingredient
+            ON ingredient.id = amount.ingredient_id
+        WHERE amount.recipe_id = recipe.id
+    ), '')
+    FROM recipes_recipe AS recipe
+"""
+
+
+def postgresql_vector():
+    """search_vector рецепта: название с весом A, описание с весом B,
+    ингредиенты с весом C."""
+    from django.contrib.postgres.aggregates import StringAgg
+    from django.contrib.postgres.search import SearchVector
+
+    config = settings.SEARCH_CONFIG
+    ingredients = RecipeIngredient.objects.filter(
+        recipe=OuterRef('pk')
+    ).order_by().values('recipe').annotate(
+        names=StringAgg('ingredient__name', ' ')
+    ).values('names')
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector('text', weight='B', config=config)
+        + SearchVector(
+            Coalesce(Subquery(ingredients, output_field=TextField()),
+                     Value('', output_field=TextField())),
+            weight='C', config=config)
+    )
+
+
+def update_search_index(recipe_id):
+    """Обновляет поисковый индекс рецепта.
+
+    В PostgreSQL пересчитывает столбец search_vector, в SQLite
+    обновляет строку таблицы FTS5.
+    """
+    if connection.vendor == 'postgresql':
+        Recipe.objects.filter(pk=recipe_id).update(
+            search_vector=postgresql_vector())
+    elif connection.vendor == 'sqlite':
+        delete_from_search_index(recipe_id)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'{SQLITE_INSERT} WHERE recipe.id = %s', [recipe_id])
+
+
+def delete_from_search_index(recipe_id):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [recipe_id])
+
+
+def rebuild_search_index(batch_size=REBUILD_BATCH_SIZE):
+    """Пересчитывает поисковый индекс всех рецептов: один запрос на
+    каждые batch_size id. Возвращает число рецептов."""
+    bounds = Recipe.objects.aggregate(first=Min('id'), last=Max('id'))
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    if bounds['first'] is None:
+        return 0
+    for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+        end = start + batch_size
+        if connection.vendor == 'postgresql':
+            Recipe.objects.filter(pk__gte=start, pk__lt=end).update(
+                search_vector=postgresql_vector())
+        elif connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'{SQLITE_INSERT} WHERE recipe.id >= %s '
+                    'AND recipe.id < %s', [start, end])
+    return Recipe.objects.count()
+
+
+def search_postgresql(queryset, query):
+    from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                                TrigramSimilarity)
+
+    search_query = SearchQuery(
+        query, config=settings.SEARCH_CONFIG, search_type='websearch')
+    matches = Q(search_vector=search_query)
+    # Опечатки: если полнотекстовый поиск ничего не нашёл, ищем похожие
+    # названия по триграммам. NOT EXISTS не зависит от строки, поэтому
+    # PostgreSQL вычисляет его один раз в том же запросе; оператор %
+    # (trigram_similar) использует индекс recipe_name_trgm_idx. Для
+    # найденных полнотекстовым поиском строк сходство не считается.
+    typos = (~Exists(queryset.filter(matches).values('pk'))
+             & Q(name__trigram_similar=query)
+             & Q(similarity__gt=settings.SEARCH_TRIGRAM_THRESHOLD))
+    return queryset.annotate(
+        rank=SearchRank(F('search_vector'), search_query),
+        similarity=Case(
+            When(matches, then=Value(0.0)),
+            default=TrigramSimilarity('name', query),
+            output_field=FloatField(),
+        ),
+    ).filter(matches | typos).order_by('-rank', '-similarity', '-pub')
+
+
+def search_sqlite(queryset, query):
+    words = WORD_RE.findall(query)
+    if not words:
+        return queryset.none()
+    match = ' '.join(f'"{word}"*' for word in words)
+    table = queryset.model._meta.db_table
+    # bm25 тем меньше, чем релевантнее строка.
+    return queryset.extra(
+        select={'rank': f'bm25({FTS_TABLE})'},
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = {table}.id', f'{FTS_TABLE} MATCH %s'],
+        params=[match],
+    ).order_by('rank', '-pub')
+
+
+def search_recipes(queryset, query):
+    """Полнотекстовый поиск по названию, описанию и ингредиентам."""
+    if connection.vendor == 'postgresql':
+        return search_postgresql(queryset, query)
+    if connection.vendor == 'sqlite':
+        return search_sqlite(queryset, query)
+    return queryset.filter(name__icontains=query)
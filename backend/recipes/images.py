@@ -0,0 +1,142 @@
+import io
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from api.cache import bump_version
+from jobs.queue import JobError, enqueue
+from recipes.models import Recipe
+
+THUMBNAIL_DIR = 'recipes/thumbnails/'
+ORIGINAL_QUALITY = 95
+EXTENSIONS = {
+    'WEBP': 'webp',
+    'JPEG': 'jpg',
+}
+# Ключи Image.info с метаданными: EXIF, цветовой профиль, XMP,
+# комментарии.
+METADATA_KEYS = {
+    'exif', 'icc_profile', 'xmp', 'XML:com.adobe.xmp', 'comment',
+    'photoshop',
+}
+
+
+def thumbnail_name(image_name, width, image_format):
+    stem = posixpath.splitext(posixpath.basename(image_name))[0]
+    return f'{THUMBNAIL_DIR}{stem}_{width}.{EXTENSIONS[image_format]}'
+
+
+def encode(image, image_format):
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=settings.THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+
+def metadata_keys(image):
+    """Ключи image.info с метаданными снимка."""
+    keys = set(image.info) & METADATA_KEYS
+    if image.format == 'PNG':
+        # Текстовые блоки PNG попадают в info под своими именами.
+        keys.update(image.text)
+    return keys
+
+
+def without_metadata(image):
+    """Копия картинки, повёрнутая по EXIF, без метаданных."""
+    keys = metadata_keys(image)
+    clean = ImageOps.exif_transpose(image)
+    clean.info = {
+        key: value for key, value in image.info.items() if key not in keys
+    }
+    return clean
+
+
+def strip_metadata(recipe, image):
+    """Сохраняет рядом с оригиналом копию без метаданных, если они
+    есть. Возвращает имя копии или None."""
+    if not metadata_keys(image):
+        return None
+    buffer = io.BytesIO()
+    without_metadata(image).save(
+        buffer, image.format, quality=ORIGINAL_QUALITY)
+    return recipe.image.storage.save(
+        recipe.image.name, ContentFile(buffer.getvalue()))
+
+
+def make_thumbnails(recipe):
+    """Создаёт уменьшенные копии картинки рецепта.
+
+    Для каждой ширины из THUMBNAIL_WIDTHS и формата из THUMBNAIL_FORMATS
+    сохраняет файл в THUMBNAIL_DIR и записывает имена в
+    recipe.thumbnails; оригинал с метаданными заменяется копией без них.
+    Запись условная: если картинку рецепта за это время сменили, новые
+    файлы удаляются (копии сделает задача новой картинки) и возвращается
+    False.
+    """
+    storage = recipe.image.storage
+    original = recipe.image.name
+    with recipe.image.open('rb') as file:
+        image = Image.open(file)
+        image.load()
+    stripped = strip_metadata(recipe, image)
+    name = stripped or original
+    image = without_metadata(image)
+    thumbnails = {}
+    for width in settings.THUMBNAIL_WIDTHS:
+        resized = image
+        if image.width > width:
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS)
+        for image_format in settings.THUMBNAIL_FORMATS:
+            thumbnail = thumbnail_name(name, width, image_format)
+            storage.delete(thumbnail)
+            thumbnail = storage.save(
+                thumbnail, ContentFile(encode(resized, image_format)))
+            thumbnails.setdefault(EXTENSIONS[image_format], {})[
+                str(width)] = thumbnail
+    new_names = {
+        thumbnail for sizes in thumbnails.values()
+        for thumbnail in sizes.values()
+    }
+    fields = {'thumbnails': thumbnails}
+    if stripped:
+        fields['image'] = stripped
+        new_names.add(stripped)
+    if not Recipe.objects.filter(
+            pk=recipe.pk, image=original).update(**fields):
+        for thumbnail in new_names:
+            storage.delete(thumbnail)
+        return False
+    old_names = {
+        thumbnail for sizes in recipe.thumbnails.values()
+        for thumbnail in sizes.values()
+    }
+    if stripped:
+        old_names.add(original)
+    for old_name in old_names - new_names:
+        storage.delete(old_name)
+    recipe.image.name = name
+    recipe.thumbnails = thumbnails
+    # update() не отправляет сигналы post_save.
+    bump_version('recipes')
+    return True
+
+
+def process_recipe_image(recipe_id):
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is None or not recipe.image:
+        return
+    try:
+        make_thumbnails(recipe)
+    except UnidentifiedImageError as error:
+        # Повторная попытка не поможет.
+        raise JobError(str(error)) from error
+
+
+def schedule_thumbnails(recipe_id):
+    """Ставит обработку картинки в очередь фоновых задач."""
+    enqueue(process_recipe_image, recipe_id=recipe_id)
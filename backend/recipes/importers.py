@@ -0,0 +1,111 @@
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+
+from api.cache import bump_version
+from api.search import ingredient_index
+from recipes.models import Ingredient
+
+CHUNK_SIZE = 64 * 1024
+FIELDS = ('name', 'measurement_unit')
+
+
+def read_json(file):
+    """Читает JSON-массив объектов по частям, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    index = 0
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while (position < len(buffer)
+                   and buffer[position] in ' \t\r\n,'):
+                position += 1
+            if not started and buffer.startswith('[', position):
+                started = True
+                position += 1
+                continue
+            if position == len(buffer) or buffer[position] == ']':
+                break
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Объект оборвался на границе блока.
+                break
+            yield ingredient_fields(item, index)
+            index += 1
+        buffer = buffer[position:]
+    if buffer.strip() not in ('', ']'):
+        raise ValueError('Некорректный JSON.')
+
+
+def ingredient_fields(item, index):
+    """Возвращает название и единицу измерения элемента массива
+    с номером index (с нуля)."""
+    if not isinstance(item, dict):
+        raise ValueError(
+            f'элемент {index}: ожидался объект, получен '
+            f'{type(item).__name__}.')
+    for field in FIELDS:
+        if not isinstance(item.get(field), str):
+            raise ValueError(
+                f'элемент {index}: поле {field} должно быть строкой.')
+    return item['name'], item['measurement_unit']
+
+
+def read_csv(file):
+    """Читает строки вида «название,единица измерения»."""
+    reader = csv.reader(file)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < 2:
+            raise ValueError(
+                f'строка {reader.line_num}: ожидалось два столбца.')
+        yield row[0], row[1]
+
+
+READERS = {
+    '.json': read_json,
+    '.csv': read_csv,
+}
+
+
+def import_rows(rows, batch_size):
+    """Добавляет ингредиенты из пар (название, единица измерения)
+    пачками по batch_size строк. Возвращает число прочитанных строк."""
+    total = 0
+    while True:
+        batch = [
+            Ingredient(name=name.strip(),
+                       measurement_unit=measurement_unit.strip())
+            for name, measurement_unit in islice(rows, batch_size)
+        ]
+        if not batch:
+            return total
+        Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+        total += len(batch)
+
+
+def import_ingredients(sources, batch_size=1000):
+    """Загружает ингредиенты одной транзакцией.
+
+    sources — пары (reader, текстовый файл). Возвращает число
+    прочитанных строк и число добавленных ингредиентов. Ошибки формата —
+    ValueError с номером элемента или строки.
+    """
+    before = Ingredient.objects.count()
+    total = 0
+    with transaction.atomic():
+        for reader, file in sources:
+            total += import_rows(reader(file), batch_size)
+    created = Ingredient.objects.count() - before
+    if created:
+        # bulk_create не отправляет сигналы post_save.
+        ingredient_index.invalidate()
+        bump_version('ingredients')
+    return total, created
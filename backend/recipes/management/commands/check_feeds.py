@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from recipes.feed import find_drift, rebuild, update_on_read_authors
+
+
+class Command(BaseCommand):
+    help = ('Пересматривает по счётчикам, чьи рецепты читаются при '
+            'запросе, сверяет ленты подписок с подписками и пересоздаёт '
+            'расходящиеся.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, таблицу не менять.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            to_read, to_fan_out = update_on_read_authors()
+            self.stdout.write(
+                f'Авторов переведено на чтение при запросе: {to_read}, '
+                f'обратно в ленты: {to_fan_out}.')
+        extra, missing = find_drift()
+        users = {user_id for user_id, _ in extra | missing}
+        message = (f'Лишних строк: {len(extra)}, недостающих: '
+                   f'{len(missing)}, пользователей: {len(users)}.')
+        self.stdout.write(
+            self.style.WARNING(message) if extra or missing
+            else self.style.SUCCESS(message))
+        if options['dry_run'] or not users:
+            return
+        rebuild(users)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты пересозданы: {len(users)}.'))
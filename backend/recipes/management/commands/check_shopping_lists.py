@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from recipes.shopping_list import find_drift, rebuild
+
+
+class Command(BaseCommand):
+    help = ('Сверяет готовые списки покупок с ShoppingCart и '
+            'пересоздаёт таблицу.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, таблицу не менять.'
+        )
+
+    def handle(self, *args, **options):
+        drift = find_drift()
+        users = {user_id for user_id, _ in drift}
+        if options['verbosity'] > 1:
+            for (user_id, ingredient_id), (actual, expected) in sorted(
+                    drift.items()):
+                self.stdout.write(
+                    f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                    f'{actual} вместо {expected}')
+        message = (f'Расхождений: {len(drift)}, '
+                   f'пользователей: {len(users)}.')
+        self.stdout.write(
+            self.style.WARNING(message) if drift
+            else self.style.SUCCESS(message))
+        if options['dry_run']:
+            return
+        rebuild()
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересозданы.'))
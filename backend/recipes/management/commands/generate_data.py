@@ -0,0 +1,197 @@
+import io
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from PIL import Image
+
+from api.cache import bump_version
+from recipes import feed, shopping_list
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import Follow, User
+
+USERNAME_PREFIX = 'synthetic_'
+IMAGE_NAME = 'recipes/images/synthetic.png'
+TAGS = [
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F9A62B', 'dessert'),
+]
+DISHES = ['суп', 'салат', 'пирог', 'рагу', 'каша', 'запеканка', 'омлет',
+          'плов', 'паста', 'котлеты', 'блины', 'курица']
+ADJECTIVES = ['домашний', 'быстрый', 'пряный', 'летний', 'сытный',
+              'яблочный', 'сырный', 'овощной', 'грибной', 'острый']
+BATCH_SIZE = 1000
+
+
+def zipf_weights(size, exponent):
+    """Веса 1 / rank^exponent: немногие элементы популярнее остальных."""
+    return [1 / (rank ** exponent) for rank in range(1, size + 1)]
+
+
+def skewed_sample(rng, population, weights, count):
+    """До count разных элементов population с учётом весов."""
+    count = min(count, len(population))
+    chosen = set()
+    for _ in range(10):
+        if len(chosen) >= count:
+            break
+        chosen.update(rng.choices(population, weights, k=count))
+    return list(chosen)[:count]
+
+
+class Command(BaseCommand):
+    help = ('Создаёт синтетические данные для нагрузочных тестов: '
+            'пользователей, рецепты, подписки, избранное и списки '
+            'покупок с неравномерной популярностью.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument(
+            '--ingredients', type=int, default=500,
+            help='Сколько ингредиентов создать, если их в базе меньше.')
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--follows', type=int, default=10,
+                            help='Подписок на пользователя.')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Рецептов в избранном на пользователя.')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Рецептов в списке покупок на пользователя.')
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Показатель распределения Ципфа для популярности авторов '
+                 'и рецептов.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Сначала удалить ранее созданные синтетические данные.')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            if options['clear']:
+                User.objects.filter(
+                    username__startswith=USERNAME_PREFIX).delete()
+            users = self.create_users(options['users'])
+            tags = self.get_tags()
+            ingredients = self.get_ingredients(options['ingredients'])
+            recipes = self.create_recipes(
+                rng, users, tags, ingredients, options)
+            self.create_relations(rng, users, recipes, options)
+        # bulk_create не отправляет сигналы: пересчитываем производные
+        # данные целиком.
+        call_command('reconcile_counters', stdout=self.stdout)
+        shopping_list.rebuild([user.id for user in users])
+        feed.update_on_read_authors()
+        feed.rebuild([user.id for user in users])
+        call_command('rebuild_search_index', stdout=self.stdout)
+        for namespace in ('recipes', 'tags', 'ingredients'):
+            bump_version(namespace)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, рецептов: '
+            f'{len(recipes)} за {time.monotonic() - start:.1f} с.'))
+
+    def create_users(self, count):
+        offset = User.objects.filter(
+            username__startswith=USERNAME_PREFIX).count()
+        password = make_password('synthetic')
+        users = [
+            User(
+                username=f'{USERNAME_PREFIX}{number}',
+                email=f'{USERNAME_PREFIX}{number}@example.com',
+                first_name='Пользователь',
+                last_name=str(number),
+                password=password,
+            )
+            for number in range(offset, offset + count)
+        ]
+        User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+        return list(User.objects.filter(
+            username__in=[user.username for user in users]).order_by('id'))
+
+    def get_tags(self):
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create([
+                Tag(name=name, color=color, slug=slug)
+                for name, color, slug in TAGS
+            ])
+        return list(Tag.objects.all())
+
+    def get_ingredients(self, count):
+        missing = count - Ingredient.objects.count()
+        if missing > 0:
+            Ingredient.objects.bulk_create([
+                Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+                for number in range(missing)
+            ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+        return list(Ingredient.objects.values_list('id', flat=True))
+
+    def create_recipes(self, rng, users, tags, ingredients, options):
+        if not default_storage.exists(IMAGE_NAME):
+            buffer = io.BytesIO()
+            Image.new('RGB', (64, 64), '#E26C2D').save(buffer, 'PNG')
+            default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+        author_weights = zipf_weights(len(users), options['skew'])
+        authors = rng.choices(users, author_weights, k=options['recipes'])
+        recipes = Recipe.objects.bulk_create([
+            Recipe(
+                author=author,
+                name=f'{rng.choice(ADJECTIVES).capitalize()} '
+                     f'{rng.choice(DISHES)} {number}',
+                text=' '.join(rng.choices(DISHES + ADJECTIVES, k=30)),
+                cooking_time=rng.randint(5, 180),
+                image=IMAGE_NAME,
+            )
+            for number, author in enumerate(authors)
+        ], batch_size=BATCH_SIZE)
+        if recipes and recipes[0].pk is None:
+            recipes = list(Recipe.objects.filter(
+                author__in=users).order_by('id'))
+        ingredient_weights = zipf_weights(len(ingredients), options['skew'])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe=recipe, ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500))
+            for recipe in recipes
+            for ingredient_id in skewed_sample(
+                rng, ingredients, ingredient_weights,
+                rng.randint(1, options['ingredients_per_recipe']))
+        ], batch_size=BATCH_SIZE)
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+            for recipe in recipes
+            for tag in rng.sample(tags, rng.randint(1, min(2, len(tags))))
+        ], batch_size=BATCH_SIZE)
+        return recipes
+
+    def create_relations(self, rng, users, recipes, options):
+        user_weights = zipf_weights(len(users), options['skew'])
+        recipe_weights = zipf_weights(len(recipes), options['skew'])
+        follows = []
+        favorites = []
+        carts = []
+        for user in users:
+            for author in skewed_sample(
+                    rng, users, user_weights, options['follows']):
+                if author.id != user.id:
+                    follows.append(Follow(user=user, author=author))
+            for recipe in skewed_sample(
+                    rng, recipes, recipe_weights, options['favorites']):
+                favorites.append(Favorite(user=user, recipe=recipe))
+            for recipe in rng.sample(
+                    recipes, min(options['cart'], len(recipes))):
+                carts.append(ShoppingCart(user=user, recipe=recipe))
+        for model, objects in ((Follow, follows), (Favorite, favorites),
+                               (ShoppingCart, carts)):
+            model.objects.bulk_create(
+                objects, batch_size=BATCH_SIZE, ignore_conflicts=True)
@@ -1,18 +1,47 @@
-import json
+import time
+from contextlib import ExitStack
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.importers import READERS, import_ingredients
+
+DEFAULT_FILE = Path(__file__).resolve().parent / 'data' / 'ingredients.json'
 
 
 class Command(BaseCommand):
+    help = 'Загружает ингредиенты из JSON или CSV файлов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*', default=[DEFAULT_FILE],
+            help='Файлы .json или .csv с ингредиентами.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество строк в одном INSERT.'
+        )
 
     def handle(self, *args, **options):
-        with open(
-            'recipes/management/commands/data/ingredients.json', 'rb'
-        ) as f:
-            data = json.load(f)
-            for item in data:
-                print(item)
-                Ingredient.objects.create(name=item['name'],
-                                          measurement_unit=item
-                                          ['measurement_unit'])
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть не меньше 1.')
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            sources = []
+            for path in options['paths']:
+                reader = READERS.get(Path(path).suffix.lower())
+                if reader is None:
+                    raise CommandError(
+                        f'Неподдерживаемый формат файла: {path}')
+                sources.append((reader, stack.enter_context(
+                    open(path, encoding='utf-8', newline=''))))
+            try:
+                total, created = import_ingredients(
+                    sources, options['batch_size'])
+            except ValueError as error:
+                raise CommandError(f'Некорректный файл: {error}')
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {total}, добавлено: {created}, '
+            f'за {elapsed:.2f} с ({total / elapsed:.0f} строк/с).'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.fulltext import REBUILD_BATCH_SIZE, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает поисковый индекс всех рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=REBUILD_BATCH_SIZE,
+            help='Сколько id рецептов обновлять одним запросом.'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть не меньше 1.')
+        total = rebuild_search_index(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано рецептов: {total}.'))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Follow, User
+
+# (модель, поле счётчика, модель подсчитываемых записей, внешний ключ).
+COUNTERS = [
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (User, 'followers_count', Follow, 'author'),
+    (User, 'recipes_count', Recipe, 'author'),
+]
+
+
+def actual_count(related_model, foreign_key):
+    return Coalesce(Subquery(
+        related_model.objects.filter(
+            **{foreign_key: OuterRef('pk')}
+        ).order_by().values(foreign_key).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного, списков покупок, '
+            'подписчиков и рецептов. Запускается раз в сутки (cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, счётчики не менять.'
+        )
+
+    def handle(self, *args, **options):
+        for model, field, related_model, foreign_key in COUNTERS:
+            count = actual_count(related_model, foreign_key)
+            drifted = list(model.objects.annotate(
+                actual=count
+            ).exclude(
+                **{field: F('actual')}
+            ).values_list('pk', flat=True))
+            message = (f'{model._meta.model_name}.{field}: '
+                       f'расхождений {len(drifted)}.')
+            self.stdout.write(
+                self.style.WARNING(message) if drifted
+                else self.style.SUCCESS(message))
+            if drifted and not options['dry_run']:
+                model.objects.filter(pk__in=drifted).update(**{field: count})
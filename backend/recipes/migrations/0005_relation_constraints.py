@@ -0,0 +1,55 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:08
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def remove_duplicates(apps, schema_editor):
+    """Удаляет повторные записи перед добавлением ограничений."""
+    for model_name in ('Favorite', 'ShoppingCart'):
+        model = apps.get_model('recipes', model_name)
+        duplicates = model.objects.values('user', 'recipe').annotate(
+            keep_id=Min('id'), total=Count('id')
+        ).filter(total__gt=1)
+        for group in duplicates:
+            model.objects.filter(
+                user=group['user'], recipe=group['recipe']
+            ).exclude(id=group['keep_id']).delete()
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    duplicates = RecipeIngredient.objects.values(
+        'recipe', 'ingredient'
+    ).annotate(
+        keep_id=Min('id'), total=Count('id'), amount_sum=Sum('amount')
+    ).filter(total__gt=1)
+    for group in duplicates:
+        rows = RecipeIngredient.objects.filter(
+            recipe=group['recipe'], ingredient=group['ingredient'])
+        rows.exclude(id=group['keep_id']).delete()
+        rows.update(amount=min(group['amount_sum'], 32000))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_ingredient_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub'], name='recipe_pub_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favorite'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipeingredient',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_recipe_ingredient'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shopping_cart'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:55
+
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Q
+import django.db.models.deletion
+
+
+def fill_feeds(apps, schema_editor):
+    """Отмечает авторов, которые читаются при запросе, и заполняет
+    ленты по текущим подпискам на остальных."""
+    User = apps.get_model('users', 'User')
+    Follow = apps.get_model('users', 'Follow')
+    FeedItem = apps.get_model('recipes', 'FeedItem')
+    User.objects.filter(
+        Q(followers_count__gt=settings.FEED_ON_READ_FOLLOWERS)
+        | Q(recipes_count__gt=settings.FEED_ON_READ_RECIPES)
+    ).update(feed_on_read=True)
+    rows = Follow.objects.filter(
+        author__feed_on_read=False, author__recipes__isnull=False
+    ).values_list(
+        'user_id', 'author_id', 'author__recipes__id', 'author__recipes__pub'
+    ).order_by().iterator()
+    while True:
+        batch = [
+            FeedItem(user_id=user_id, author_id=author_id,
+                     recipe_id=recipe_id, pub=pub)
+            for user_id, author_id, recipe_id, pub in islice(
+                rows, settings.FEED_BATCH_SIZE)
+        ]
+        if not batch:
+            return
+        FeedItem.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0011_counters'),
+        ('users', '0003_user_feed_on_read'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub', models.DateTimeField(verbose_name='Дата публикации')),
+                ('author', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='feed', to=settings.AUTH_USER_MODEL, verbose_name='Читатель')),
+            ],
+            options={
+                'verbose_name': 'Рецепт в ленте',
+                'verbose_name_plural': 'Ленты подписок',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['user', '-pub', '-recipe'], name='feed_user_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['author', 'user'], name='feed_author_user_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feeditem',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_feed_item'),
+        ),
+        migrations.RunPython(fill_feeds, migrations.RunPython.noop),
+    ]
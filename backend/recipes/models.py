@@ -1,5 +1,7 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.db.models import Exists, OuterRef, Prefetch, Value
 
 from users.models import User
 
@@ -35,6 +37,37 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов для рецептов."""
+
+    def with_user_flags(self, user):
+        """Добавляет флаги избранного и списка покупок одним запросом."""
+        if user.is_anonymous:
+            return self.annotate(
+                favorited=Value(False, output_field=models.BooleanField()),
+                in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()),
+            )
+        return self.annotate(
+            favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+
+    def with_related(self):
+        """Подгружает автора, теги и ингредиенты фиксированным числом
+        запросов."""
+        return self.select_related('author').prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.all()),
+            Prefetch(
+                'ingredient_list',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient')
+            ),
+        )
+
+
 class Recipe(models.Model):
     """Модель рецептов."""
 
@@ -85,15 +118,49 @@ class Recipe(models.Model):
         upload_to='recipes/images/',
     )
 
+    thumbnails = models.JSONField(
+        verbose_name='Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+
     pub = models.DateTimeField(
         auto_now_add=True,
         verbose_name='Дата публикации'
     )
 
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub']
+        indexes = [
+            models.Index(fields=['-pub', '-id'], name='recipe_pub_id_idx'),
+            models.Index(fields=['author', '-pub'],
+                         name='recipe_author_pub_idx'),
+            models.Index(fields=['-favorites_count', '-pub', '-id'],
+                         name='recipe_popular_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.name
@@ -116,6 +183,12 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self) -> str:
         return self.name
@@ -155,6 +228,12 @@ class RecipeIngredient(models.Model):
         verbose_name = 'Количество ингредиента'
         verbose_name_plural = 'Список ингредиентов'
         ordering = ['-amount']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='unique_recipe_ingredient'
+            )
+        ]
 
     def __str__(self) -> str:
         return f'{self.recipe}, {self.ingredient}, {self.amount}'
@@ -182,6 +261,12 @@ class ShoppingCart(models.Model):
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
         ordering = ['recipe']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_shopping_cart'
+            )
+        ]
 
     def __str__(self):
         return (f'Пользователь {self.user} добавил {self.recipe}'
@@ -208,7 +293,114 @@ class Favorite(models.Model):
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
         ordering = ['recipe']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_favorite'
+            )
+        ]
 
     def __str__(self):
         return (f'Пользователь {self.user} добавил {self.recipe} '
                 'в избранное')
+
+
+class ShoppingListItem(models.Model):
+    """Строка готового списка покупок пользователя.
+
+    Хранит сумму количества ингредиента по всем рецептам из списка
+    покупок. Обновляется при добавлении и удалении рецептов из списка и
+    при изменении ингредиентов рецепта (recipes.shopping_list).
+    """
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+
+    amount = models.IntegerField(
+        verbose_name='Количество',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Строки списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}, {self.ingredient}, {self.amount}'
+
+
+class FeedItem(models.Model):
+    """Рецепт в ленте подписок пользователя.
+
+    Строки добавляются всем подписчикам автора при публикации рецепта и
+    подписчику при подписке, удаляются при отписке и вместе с рецептом
+    (recipes.feed). pub повторяет дату публикации рецепта, чтобы страница
+    ленты читалась по одному индексу без соединения с рецептами. Рецептов
+    авторов с User.feed_on_read здесь нет: они читаются при запросе.
+    """
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Читатель',
+        on_delete=models.CASCADE,
+        related_name='feed',
+        db_index=False,
+    )
+
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор',
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_index=False,
+    )
+
+    pub = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_item'
+            )
+        ]
+        # Отдельный индекс по user не нужен: его заменяют
+        # unique_feed_item и feed_user_pub_idx.
+        indexes = [
+            models.Index(fields=['user', '-pub', '-recipe'],
+                         name='feed_user_pub_idx'),
+            # Отписка и удаление автора.
+            models.Index(fields=['author', 'user'],
+                         name='feed_author_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user}, {self.recipe}'
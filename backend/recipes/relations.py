@@ -0,0 +1,128 @@
+import sqlite3
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+
+from recipes.models import Recipe
+
+
+class RecipesNotFound(Exception):
+    """Рецепты удалили, пока их добавляли."""
+
+    def __init__(self, recipe_ids):
+        super().__init__(f'Рецепты не найдены: {recipe_ids}.')
+        self.recipe_ids = recipe_ids
+
+
+def supports_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    return (connection.vendor == 'sqlite'
+            and sqlite3.sqlite_version_info >= (3, 35))
+
+
+def make_instances(model, user_id, rows):
+    instances = []
+    for pk, recipe_id in rows:
+        instance = model(pk=pk, user_id=user_id, recipe_id=recipe_id)
+        instance._state.adding = False
+        instance._state.db = connection.alias
+        instances.append(instance)
+    return instances
+
+
+@transaction.atomic
+def add_recipes(model, user_id, recipe_ids):
+    """Добавляет рецепты в избранное или список покупок пользователя.
+
+    model — Favorite или ShoppingCart. Один запрос
+    INSERT ... ON CONFLICT DO NOTHING RETURNING: уже добавленные рецепты
+    пропускаются, одновременные запросы не создают дублей. Для новых
+    записей отправляется post_save, как при обычном save(). Возвращает
+    созданные записи. Если часть рецептов уже удалена, ничего не
+    добавляет и выбрасывает RecipesNotFound.
+    """
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    if not recipe_ids:
+        return []
+    try:
+        with transaction.atomic():
+            rows = insert_rows(model, user_id, recipe_ids)
+            # Внешние ключи проверяются при фиксации; проверяем сразу,
+            # чтобы ошибку можно было обработать здесь.
+            connection.check_constraints(
+                table_names=[model._meta.db_table])
+    except IntegrityError:
+        existing = set(Recipe.objects.filter(
+            pk__in=recipe_ids).values_list('pk', flat=True))
+        raise RecipesNotFound(
+            [pk for pk in recipe_ids if pk not in existing])
+    instances = make_instances(model, user_id, rows)
+    for instance in instances:
+        post_save.send(
+            sender=model, instance=instance, created=True,
+            update_fields=None, raw=False, using=connection.alias)
+    return instances
+
+
+def insert_rows(model, user_id, recipe_ids):
+    """Вставляет недостающие записи, возвращает пары (id, id рецепта)
+    новых."""
+    if not supports_returning():
+        existing = set(model.objects.filter(
+            user_id=user_id, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True))
+        model.objects.bulk_create([
+            model(user_id=user_id, recipe_id=recipe_id)
+            for recipe_id in recipe_ids if recipe_id not in existing
+        ], ignore_conflicts=True)
+        return list(model.objects.filter(
+            user_id=user_id, recipe_id__in=recipe_ids
+        ).exclude(recipe_id__in=existing).values_list('pk', 'recipe_id'))
+    table = connection.ops.quote_name(model._meta.db_table)
+    values = ', '.join(['(%s, %s)'] * len(recipe_ids))
+    params = [value for recipe_id in recipe_ids
+              for value in (user_id, recipe_id)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, recipe_id) VALUES {values} '
+            'ON CONFLICT (user_id, recipe_id) DO NOTHING '
+            'RETURNING id, recipe_id',
+            params
+        )
+        return cursor.fetchall()
+
+
+@transaction.atomic
+def remove_recipes(model, user_id, recipe_ids):
+    """Убирает рецепты из избранного или списка покупок пользователя.
+
+    Записи выбираются с блокировкой (SELECT ... FOR UPDATE), затем
+    отправляется pre_delete, удаляются строки и отправляется
+    post_delete, как при обычном delete(). Одновременный запрос ждёт
+    конца транзакции и уже не видит удалённых строк, поэтому сигналы
+    не повторяются. Возвращает удалённые записи.
+    """
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    if not recipe_ids:
+        return []
+    rows = model.objects.select_for_update().filter(
+        user_id=user_id, recipe_id__in=recipe_ids
+    ).values_list('pk', 'recipe_id')
+    instances = make_instances(model, user_id, rows)
+    if not instances:
+        return []
+    for instance in instances:
+        pre_delete.send(
+            sender=model, instance=instance, using=connection.alias)
+    table = connection.ops.quote_name(model._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(instances))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN ({placeholders})',
+            [instance.pk for instance in instances]
+        )
+    for instance in instances:
+        post_delete.send(
+            sender=model, instance=instance, using=connection.alias)
+    return instances
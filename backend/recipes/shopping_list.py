@@ -0,0 +1,137 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from recipes.models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+
+def recipe_amounts(recipe_id):
+    """Количество каждого ингредиента рецепта: {id ингредиента: количество}."""
+    return dict(
+        RecipeIngredient.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount')
+    )
+
+
+@transaction.atomic
+def apply_changes(user_ids, deltas):
+    """Прибавляет deltas к спискам покупок пользователей user_ids.
+
+    deltas — {id ингредиента: изменение количества}. Недостающие строки
+    создаются, строки с количеством 0 и меньше удаляются. Изменения
+    делаются через F(), поэтому одновременные запросы не теряют
+    обновлений друг друга.
+    """
+    user_ids = list(user_ids)
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta
+    }
+    if not user_ids or not deltas:
+        return
+    ShoppingListItem.objects.bulk_create([
+        ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id)
+        for user_id in user_ids
+        for ingredient_id, delta in deltas.items() if delta > 0
+    ], ignore_conflicts=True)
+    by_delta = defaultdict(list)
+    for ingredient_id, delta in deltas.items():
+        by_delta[delta].append(ingredient_id)
+    for delta, ingredient_ids in by_delta.items():
+        ShoppingListItem.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=ingredient_ids
+        ).update(amount=F('amount') + delta)
+    ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas, amount__lte=0
+    ).delete()
+
+
+def add_recipe(user_id, recipe_id):
+    apply_changes([user_id], recipe_amounts(recipe_id))
+
+
+def remove_recipe(user_id, recipe_id):
+    apply_changes([user_id], {
+        ingredient_id: -amount
+        for ingredient_id, amount in recipe_amounts(recipe_id).items()
+    })
+
+
+def change_recipe(recipe_id, deltas):
+    """Применяет изменения ингредиентов рецепта ко всем спискам покупок,
+    в которых он есть."""
+    apply_changes(
+        ShoppingCart.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('user_id', flat=True),
+        deltas
+    )
+
+
+def export_rows(user_id):
+    """Строки списка покупок для выгрузки, по алфавиту."""
+    return ShoppingListItem.objects.filter(
+        user_id=user_id
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit',
+        amount_sum=F('amount')
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
+
+def expected_items(user_ids=None):
+    """Списки покупок, посчитанные заново по ShoppingCart.
+
+    Возвращает {(id пользователя, id ингредиента): количество}.
+    """
+    carts = ShoppingCart.objects.all()
+    if user_ids is not None:
+        carts = carts.filter(user_id__in=user_ids)
+    rows = carts.values_list(
+        'user_id', 'recipe__ingredient_list__ingredient_id'
+    ).annotate(
+        Sum('recipe__ingredient_list__amount')
+    ).order_by()
+    return {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in rows.iterator()
+        if ingredient_id is not None
+    }
+
+
+def find_drift(user_ids=None):
+    """Расхождения таблицы со списками, посчитанными заново.
+
+    Возвращает {(id пользователя, id ингредиента): (в таблице, должно
+    быть)}; отсутствующая строка считается количеством 0.
+    """
+    expected = expected_items(user_ids)
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    actual = {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in items.values_list(
+            'user_id', 'ingredient_id', 'amount').iterator()
+    }
+    return {
+        key: (actual.get(key, 0), expected.get(key, 0))
+        for key in actual.keys() | expected.keys()
+        if actual.get(key, 0) != expected.get(key, 0)
+    }
+
+
+@transaction.atomic
+def rebuild(user_ids=None, batch_size=1000):
+    """Пересоздаёт строки списков покупок из ShoppingCart."""
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    items.delete()
+    ShoppingListItem.objects.bulk_create([
+        ShoppingListItem(
+            user_id=user_id, ingredient_id=ingredient_id, amount=amount)
+        for (user_id, ingredient_id), amount in expected_items(
+            user_ids).items()
+    ], batch_size=batch_size)
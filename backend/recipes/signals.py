@@ -0,0 +1,90 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from recipes import feed
+from recipes.fulltext import delete_from_search_index, update_search_index
+from recipes.models import Favorite, Recipe, ShoppingCart
+from recipes.shopping_list import add_recipe, remove_recipe
+from users.counters import change_counter
+from users.models import Follow, User
+
+# Поля, изменение которых не влияет на поисковый индекс.
+NOT_INDEXED_FIELDS = {'image', 'thumbnails', 'search_vector'}
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= NOT_INDEXED_FIELDS:
+        return
+    # Ингредиенты сохраняются после рецепта, поэтому ждём фиксации.
+    transaction.on_commit(lambda: update_search_index(instance.pk))
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(instance, **kwargs):
+    delete_from_search_index(instance.pk)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(instance, created, **kwargs):
+    if created:
+        add_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(instance, **kwargs):
+    # pre_delete: при удалении рецепта его ингредиенты удаляются каскадом
+    # вместе с записями списка покупок, после удаления их уже не прочитать.
+    remove_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(post_save, sender=Favorite)
+def count_favorite(instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def count_unfavorite(instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def count_cart_add(instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'shopping_cart_count', 1)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def count_cart_remove(instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'shopping_cart_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def count_recipe(instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def uncount_recipe(instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def add_to_feeds(instance, created, **kwargs):
+    # Из лент рецепт удаляется каскадом вместе с собой.
+    if created:
+        feed.add_recipe(instance)
+
+
+@receiver(post_save, sender=Follow)
+def add_author_to_feed(instance, created, **kwargs):
+    if created:
+        feed.add_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def remove_author_from_feed(instance, **kwargs):
+    feed.remove_author(instance.user_id, instance.author_id)
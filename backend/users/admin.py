@@ -13,6 +13,8 @@ class UserAdmin(UserAdmin):
         'email',
         'first_name',
         'last_name',
+        'followers_count',
+        'recipes_count',
     ]
     list_filter = [
         'email',
@@ -0,0 +1,13 @@
+from django.db.models import F
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет счётчик field у записи pk на delta.
+
+    Счётчик не уходит ниже нуля: уменьшение нулевого значения ничего
+    не делает.
+    """
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
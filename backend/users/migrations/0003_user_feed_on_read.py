@@ -0,0 +1,22 @@
+# Generated by Django 3.2.16 on 2026-10-18 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='feed_on_read',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Рецепты попадают в ленты при чтении'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('feed_on_read', True)), fields=['id'], name='user_feed_on_read_idx'),
+        ),
+    ]
@@ -29,10 +29,30 @@ class User(AbstractUser):
         max_length=150,
         verbose_name='Фамилия',
     )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+        editable=False,
+    )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+        default=0,
+        editable=False,
+    )
+    feed_on_read = models.BooleanField(
+        verbose_name='Рецепты попадают в ленты при чтении',
+        default=False,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            # Авторы, которые читаются при запросе (recipes.feed.page).
+            models.Index(fields=['id'], condition=models.Q(
+                feed_on_read=True), name='user_feed_on_read_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.username
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from users.counters import change_counter
+from users.models import Follow, User
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'followers_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_unfollow(instance, **kwargs):
+    change_counter(User, instance.author_id, 'followers_count', -1)